@@ -0,0 +1,429 @@
+"""
+Cold storage for closed months
+
+`python manage.py archive` moves the washes of months older than N months out
+of the live store into one Parquet file per month (columnar, zstd) and records
+each archived day's WashStats in the archive index, along with the month's
+plates and observacoes terms so searches only open the months that can match.
+Archived washes are read-only.
+
+`ArchivedWashRepository` wraps the live repository so every read endpoint
+covers both tiers: totals for plain date ranges come straight from the stored
+day stats, while lists, exports, series, analytics and filtered stats over
+archived dates read the month files back (a few recent months stay cached).
+Moving a wash into the archive is logged as its delete from the live store,
+so other workers and sync clients drop what they cached of it.
+"""
+
+import asyncio
+import bisect
+import json
+import os
+from collections import Counter, OrderedDict
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from events import stats_of
+from models import BulkItemResult, SeriesValue, WashFilter, WashRegistration, WashStats, public_wash
+from repositories.base import (
+    AnalyticsRow, ChangeLog, PageKey, SeriesBuckets, WashRepository, plate_keys, search_terms, wash_lavadores,
+)
+from repositories.memory import MemoryWashRepository
+
+INDEX_FILE = "index.json"
+
+SCHEMA = pa.schema([
+    ("id", pa.string()),
+    ("data", pa.string()),
+    ("tipo_veiculo", pa.string()),
+    ("area_negocio", pa.string()),
+    ("lavadores", pa.list_(pa.string())),
+    ("tipo_lavagem", pa.string()),
+    ("empresa_tipo", pa.string()),
+    ("empresa_nome", pa.string()),
+    ("matricula_trator", pa.string()),
+    ("matricula_reboque", pa.string()),
+    ("valor", pa.float64()),
+    ("observacoes", pa.string()),
+    ("created_at", pa.timestamp("us")),
+    ("data_dia", pa.timestamp("us")),
+    ("idempotency_key", pa.string()),
+])
+
+
+class ArchivedWashError(Exception):
+    """The wash was moved to the archive, which is read-only."""
+
+
+# Analytics merges every group of both tiers before ranking
+ALL_GROUPS = 2 ** 31 - 1
+
+
+def month_key(day: date) -> str:
+    return f"{day.year:04d}-{day.month:02d}"
+
+
+def month_bounds(key: str) -> Tuple[date, date]:
+    """First and last day of a "YYYY-MM" month."""
+    year, month = map(int, key.split("-"))
+    last = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return date(year, month, 1), date.fromordinal(last.toordinal() - 1)
+
+
+def add_stats(stats: Iterable[WashStats]) -> WashStats:
+    totals = {"total_lavagens": 0, "total_valor": 0.0}
+    breakdowns = {name: Counter() for name in ("por_tipo_veiculo", "por_area_negocio", "por_lavador", "por_tipo_lavagem")}
+    for item in stats:
+        totals["total_lavagens"] += item.total_lavagens
+        totals["total_valor"] += item.total_valor
+        for name, counts in breakdowns.items():
+            counts.update(getattr(item, name))
+    totals["total_valor"] = round(totals["total_valor"], 2)
+    return WashStats(**totals, **{name: dict(counts) for name, counts in breakdowns.items()})
+
+
+def _page_key(lavagem: dict) -> PageKey:
+    return lavagem["created_at"], lavagem["id"]
+
+
+def _has_prefix(values: List[str], prefix: str) -> bool:
+    """Whether sorted `values` holds a string starting with `prefix`."""
+    position = bisect.bisect_left(values, prefix)
+    return position < len(values) and values[position].startswith(prefix)
+
+
+def _has(values: List[str], value: str) -> bool:
+    position = bisect.bisect_left(values, value)
+    return position < len(values) and values[position] == value
+
+
+def _stream_key(lavagem: dict):
+    # Same order as WashRepository.stream: undated washes first, then by day
+    return lavagem["data_dia"] is not None, lavagem["data_dia"] or datetime.min, lavagem["created_at"]
+
+
+class ArchiveStore:
+    """The archive directory: month files plus index.json.
+
+    The index maps each month to its file, totals, newest created_at,
+    per-day stats, and the sorted plates and terms of its washes. A month
+    whose washes are not yet deleted from the live store lists their ids as
+    "pendentes"; reads leave those rows to the live tier. The index is re-read
+    whenever another process (the archive command) replaces it.
+    """
+
+    def __init__(self, path: str, cache_months: int = 12):
+        self.path = path
+        self.cache_months = cache_months
+        self._index: Dict[str, dict] = {}
+        self._index_mtime: Optional[float] = None
+        self._months: "OrderedDict[str, MemoryWashRepository]" = OrderedDict()
+
+    @property
+    def index(self) -> Dict[str, dict]:
+        try:
+            mtime = os.stat(os.path.join(self.path, INDEX_FILE)).st_mtime
+        except FileNotFoundError:
+            return {}
+        if mtime != self._index_mtime:
+            with open(os.path.join(self.path, INDEX_FILE), encoding="utf-8") as f:
+                self._index = json.load(f)
+            self._index_mtime = mtime
+            self._months.clear()
+        return self._index
+
+    def overlapping(self, filtro: WashFilter) -> List[str]:
+        """Archived months that intersect the filter's date range, oldest first."""
+        keys = []
+        for key in sorted(self.index):
+            first, last = month_bounds(key)
+            if (filtro.from_ is None or last >= filtro.from_) and (filtro.to is None or first <= filtro.to):
+                keys.append(key)
+        return keys
+
+    def newest(self, key: str) -> datetime:
+        return datetime.fromisoformat(self.index[key]["max_created_at"])
+
+    def pending(self, key: str) -> set:
+        """Ids of the month's washes still in the live store."""
+        return set(self.index[key].get("pendentes", ()))
+
+    def may_have_plate(self, key: str, prefix: str) -> bool:
+        # Months indexed before plates were recorded have to be opened
+        matriculas = self.index[key].get("matriculas")
+        return matriculas is None or _has_prefix(matriculas, prefix)
+
+    def may_have_terms(self, key: str, termos: Iterable[str]) -> bool:
+        indexed = self.index[key].get("termos")
+        return indexed is None or any(_has(indexed, termo) for termo in termos)
+
+    def day_stats(self, filtro: WashFilter) -> WashStats:
+        """Stored stats of the archived days in the filter's date range; months
+        with pending washes are left out (their stored stats count them twice)."""
+        days = []
+        for key in self.overlapping(filtro):
+            if self.pending(key):
+                continue
+            for dia, stats in self.index[key]["dias"].items():
+                day = date.fromisoformat(dia)
+                if (filtro.from_ is None or day >= filtro.from_) and (filtro.to is None or day <= filtro.to):
+                    days.append(WashStats(**stats))
+        return add_stats(days)
+
+    def holds(self, wash_id: str) -> bool:
+        """Whether a month file has the wash `wash_id` (reading only the ids)."""
+        for entry in self.index.values():
+            table = pq.read_table(os.path.join(self.path, entry["ficheiro"]), columns=["id"])
+            if wash_id in set(table.column("id").to_pylist()) - set(entry.get("pendentes", ())):
+                return True
+        return False
+
+    def read(self, key: str) -> List[dict]:
+        table = pq.read_table(os.path.join(self.path, self.index[key]["ficheiro"]))
+        return table.to_pylist()
+
+    def month(self, key: str) -> MemoryWashRepository:
+        """An archived month as a read-only in-memory repository (LRU cached)."""
+        self.index  # pick up a replaced index before trusting the cache
+        if key in self._months:
+            self._months.move_to_end(key)
+            return self._months[key]
+        pending = self.pending(key)
+        repository = MemoryWashRepository.from_documents([row for row in self.read(key) if row["id"] not in pending])
+        self._months[key] = repository
+        while len(self._months) > self.cache_months:
+            self._months.popitem(last=False)
+        return repository
+
+    def write(self, key: str, lavagens: List[dict], pending: Iterable[str] = ()):
+        """Write (or replace) a month's file, then publish it in the index with
+        `pending` (ids of `lavagens` still to be deleted from the live store)."""
+        os.makedirs(self.path, exist_ok=True)
+        rows = [{**lavagem, "lavadores": wash_lavadores(lavagem)} for lavagem in lavagens]
+        rows.sort(key=_stream_key)
+        ficheiro = f"lavagens-{key}.parquet"
+        tmp = os.path.join(self.path, ficheiro + ".tmp")
+        pq.write_table(pa.Table.from_pylist(rows, schema=SCHEMA), tmp, compression="zstd")
+        os.replace(tmp, os.path.join(self.path, ficheiro))
+
+        dias: Dict[str, List[dict]] = {}
+        for row in rows:
+            dias.setdefault(row["data_dia"].date().isoformat(), []).append(row)
+        index = dict(self.index)
+        index[key] = {
+            "ficheiro": ficheiro,
+            "total_lavagens": len(rows),
+            "total_valor": round(sum(row["valor"] for row in rows), 2),
+            "max_created_at": max(row["created_at"] for row in rows).isoformat(),
+            "arquivado_em": datetime.utcnow().isoformat(),
+            "dias": {dia: stats_of(day_rows) for dia, day_rows in sorted(dias.items())},
+            "matriculas": sorted({matricula for row in rows for matricula in plate_keys(row)}),
+            "termos": sorted({termo for row in rows for termo in search_terms(row["observacoes"] or "")}),
+            "pendentes": sorted(pending),
+        }
+        self._publish(index)
+
+    def settle(self, key: str):
+        """The month's pending washes are gone from the live store: serve them from the file."""
+        index = dict(self.index)
+        index[key] = {**index[key], "pendentes": []}
+        self._publish(index)
+
+    def _publish(self, index: Dict[str, dict]):
+        tmp = os.path.join(self.path, INDEX_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp, os.path.join(self.path, INDEX_FILE))
+
+
+async def _merge(hot: AsyncIterator[dict], cold: AsyncIterator[dict], key) -> AsyncIterator[dict]:
+    """Merge two streams already sorted by `key`."""
+    pending = await anext(cold, None)
+    async for lavagem in hot:
+        while pending is not None and key(pending) <= key(lavagem):
+            yield pending
+            pending = await anext(cold, None)
+        yield lavagem
+    while pending is not None:
+        yield pending
+        pending = await anext(cold, None)
+
+
+class ArchivedWashRepository(WashRepository):
+    """The live repository plus the archive; writes only ever touch the live one."""
+
+    def __init__(self, inner: WashRepository, store: ArchiveStore):
+        self.inner = inner
+        self.store = store
+
+    async def _month(self, key: str) -> MemoryWashRepository:
+        return await asyncio.to_thread(self.store.month, key)
+
+    async def _months(self, keys: List[str]) -> List[MemoryWashRepository]:
+        return [await self._month(key) for key in keys]
+
+    async def create(self, lavagem: WashRegistration) -> WashRegistration:
+        return await self.inner.create(lavagem)
+
+    async def create_many(self, lavagens: List[WashRegistration]) -> List[BulkItemResult]:
+        return await self.inner.create_many(lavagens)
+
+    async def delete(self, wash_id: str) -> Optional[dict]:
+        lavagem = await self.inner.delete(wash_id)
+        if lavagem is None and await asyncio.to_thread(self.store.holds, wash_id):
+            raise ArchivedWashError(wash_id)
+        return lavagem
+
+    async def delete_many(self, wash_ids: List[str]) -> int:
+        return await self.inner.delete_many(wash_ids)
+
+    async def list(
+        self, filtro: WashFilter, limit: Optional[int] = None, after: Optional[PageKey] = None
+    ) -> List[dict]:
+        lavagens = await self.inner.list(filtro, limit, after)
+        # Newest months first; stop once the page is full of washes newer than the next month's
+        keys = sorted(self.store.overlapping(filtro), key=self.store.newest, reverse=True)
+        for key in keys:
+            if limit and len(lavagens) >= limit and lavagens[limit - 1]["created_at"] > self.store.newest(key):
+                break
+            month = await self._month(key)
+            lavagens = sorted(lavagens + await month.list(filtro, limit, after), key=_page_key, reverse=True)
+            lavagens = lavagens[:limit] if limit else lavagens
+        return lavagens
+
+    async def stream(
+        self, filtro: WashFilter, batch_size: int = 1000, fields: Optional[List[str]] = None
+    ) -> AsyncIterator[dict]:
+        keys = self.store.overlapping(filtro)
+
+        async def cold():
+            # Month files are disjoint date ranges, so month order is day order
+            for key in keys:
+                async for lavagem in (await self._month(key)).stream(filtro, batch_size, fields):
+                    yield lavagem
+
+        async for lavagem in _merge(self.inner.stream(filtro, batch_size, fields), cold(), _stream_key):
+            yield lavagem
+
+    async def stats(self, filtro: WashFilter) -> WashStats:
+        keys = self.store.overlapping(filtro)
+        if not keys:
+            return await self.inner.stats(filtro)
+        if not filtro.dimensions():
+            unsettled = await self._months([key for key in keys if self.store.pending(key)])
+            return add_stats(
+                [await self.inner.stats(filtro), self.store.day_stats(filtro)]
+                + [await month.stats(filtro) for month in unsettled]
+            )
+        months = await self._months(keys)
+        return add_stats([await self.inner.stats(filtro)] + [await month.stats(filtro) for month in months])
+
+    async def dashboard(
+        self, filtro: WashFilter, limit: int, after: Optional[PageKey] = None, with_stats: bool = True
+    ) -> Tuple[List[dict], Optional[WashStats]]:
+        if not self.store.overlapping(filtro):
+            return await self.inner.dashboard(filtro, limit, after, with_stats)
+        return await super().dashboard(filtro, limit, after, with_stats)
+
+    async def series_buckets(self, filtro: WashFilter, bucket: str, group_by: Optional[str]) -> SeriesBuckets:
+        parts = [self.inner] + await self._months(self.store.overlapping(filtro))
+        totais: Dict[date, SeriesValue] = {}
+        grupos: Dict[date, Dict[str, SeriesValue]] = {}
+        for part in parts:
+            part_totais, part_grupos = await part.series_buckets(filtro, bucket, group_by)
+            for periodo, value in part_totais.items():
+                _add_value(totais.setdefault(periodo, SeriesValue()), value)
+            for periodo, values in part_grupos.items():
+                for grupo, value in values.items():
+                    _add_value(grupos.setdefault(periodo, {}).setdefault(grupo, SeriesValue()), value)
+        return totais, grupos
+
+    async def analytics_rows(
+        self, filtro: WashFilter, group_by: str, top: int, sort: str
+    ) -> Tuple[SeriesValue, List[AnalyticsRow]]:
+        months = await self._months(self.store.overlapping(filtro))
+        if not months:
+            return await self.inner.analytics_rows(filtro, group_by, top, sort)
+        totais = SeriesValue()
+        grupos: Dict[str, list] = {}
+        for part in [self.inner] + months:
+            part_totais, rows = await part.analytics_rows(filtro, group_by, ALL_GROUPS, sort)
+            _add_value(totais, part_totais)
+            for nome, lavagens, valor, valor_trabalhos in rows:
+                grupo = grupos.setdefault(nome, [nome, 0, 0.0, 0.0])
+                grupo[1] += lavagens
+                grupo[2] += valor
+                grupo[3] += valor_trabalhos
+        column = 2 if sort == "valor" else 1
+        ranked = sorted(grupos.values(), key=lambda grupo: (-grupo[column], grupo[0]))
+        return totais, [tuple(grupo) for grupo in ranked[:top]]
+
+    async def plate_hits(self, prefix: str, limit: int) -> List[dict]:
+        # Newest first across both tiers, gated like `list`
+        hits = await self.inner.plate_hits(prefix, limit)
+        keys = [key for key in self.store.index if self.store.may_have_plate(key, prefix)]
+        for key in sorted(keys, key=self.store.newest, reverse=True):
+            if len(hits) >= limit and hits[limit - 1]["created_at"] > self.store.newest(key):
+                break
+            month = await self._month(key)
+            hits = sorted(hits + await month.plate_hits(prefix, limit), key=_page_key, reverse=True)[:limit]
+        return hits
+
+    async def text_hits(self, text: str, limit: int) -> List[dict]:
+        # Relevance is only comparable within a tier: live matches first, then archived months from the newest
+        hits = await self.inner.text_hits(text, limit)
+        termos = set(search_terms(text))
+        keys = [key for key in self.store.index if self.store.may_have_terms(key, termos)]
+        for key in sorted(keys, reverse=True):
+            if len(hits) >= limit:
+                break
+            hits += await (await self._month(key)).text_hits(text, limit - len(hits))
+        return hits
+
+
+def _add_value(total: SeriesValue, value: SeriesValue):
+    total.total_lavagens += value.total_lavagens
+    total.total_valor += value.total_valor
+
+
+async def _delete_archived(repository: WashRepository, changes: ChangeLog, lavagens: List[dict]):
+    # Log the deletes: other workers (and sync clients) must not keep serving the live copies
+    await repository.delete_many(sorted(lavagem["id"] for lavagem in lavagens))
+    await changes.append("lavagens", "delete", [public_wash(lavagem) for lavagem in lavagens])
+
+
+async def archive_before(
+    repository: WashRepository, changes: ChangeLog, store: ArchiveStore, cutoff: date
+) -> Dict[str, int]:
+    """Move every live wash dated before `cutoff` into the archive, one month at a time.
+
+    A month's file is written and indexed, with its washes marked pending,
+    before they are deleted from the live store (and the deletes logged in
+    `changes`); until then reads take them from the live tier only. If a run
+    is interrupted, the next one finishes the pending deletes first and merges
+    any remaining live washes into the same file.
+    """
+    for key in [key for key in store.index if store.pending(key)]:
+        pending = store.pending(key)
+        rows = await asyncio.to_thread(store.read, key)
+        await _delete_archived(repository, changes, [row for row in rows if row["id"] in pending])
+        await asyncio.to_thread(store.settle, key)
+
+    archived: Dict[str, int] = {}
+    totais, _ = await repository.series_buckets(WashFilter(to=date.fromordinal(cutoff.toordinal() - 1)), "month", None)
+    for first in sorted(totais):
+        key = month_key(first)
+        _, last = month_bounds(key)
+        lavagens = [lavagem async for lavagem in repository.stream(WashFilter(from_=first, to=last))]
+        if not lavagens:
+            continue
+        ids = {lavagem["id"] for lavagem in lavagens}
+        existing = await asyncio.to_thread(store.read, key) if key in store.index else []
+        await asyncio.to_thread(store.write, key, [row for row in existing if row["id"] not in ids] + lavagens, ids)
+        await _delete_archived(repository, changes, lavagens)
+        await asyncio.to_thread(store.settle, key)
+        archived[key] = len(lavagens)
+    return archived
@@ -0,0 +1,64 @@
+"""
+Synthetic wash data for benchmarks
+
+Generates documents shaped like those stored by POST /api/lavagens, with
+realistic Portuguese values and a deterministic seed.
+"""
+
+import random
+import uuid
+from datetime import datetime, timedelta
+
+TIPOS_VEICULO = ["Cisterna", "Frigorífico", "Basculante", "Porta-Contentores", "Cortinas", "Trator"]
+AREAS_NEGOCIO = ["Alimentar", "Energia", "Químicos", "Construção", "Logística"]
+LAVADORES = [
+    "Anfilófio Sousa", "Bruno Lourenço", "Carlos Mendes", "Diogo Ferreira",
+    "Eduardo Pinto", "Fábio Costa", "Gonçalo Ribeiro", "Hélder Marques",
+]
+TIPOS_LAVAGEM = [
+    "Exterior Conjunto", "Exterior Trator", "Interior Cisterna",
+    "Interior Cisterna + Conjunto", "Desinfeção", "Lavagem de Chassis",
+]
+EMPRESAS_EXTERNAS = [
+    "Transportes Silva", "Transportes Atlântico Lda", "Logística do Norte",
+    "Frota Ibérica", "TransMinho", "Rodoviária do Sado",
+]
+OBSERVACOES = [
+    "", "", "", "Lavagem completa com desinfeção", "Cliente pediu urgência",
+    "Resíduos de cimento", "Cisterna de leite", "Repetir interior",
+]
+
+
+def matricula(rng: random.Random) -> str:
+    letras = "ABCDEFGHIJKLMNOPRSTUVXZ"
+    return "%02d-%s%s-%02d" % (rng.randint(0, 99), rng.choice(letras), rng.choice(letras), rng.randint(0, 99))
+
+
+def make_wash(rng: random.Random, day: datetime) -> dict:
+    externa = rng.random() < 0.35
+    created_at = day + timedelta(seconds=rng.randint(6 * 3600, 20 * 3600), milliseconds=rng.randint(0, 999))
+    return {
+        "id": str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        "data": day.strftime("%Y-%m-%d"),
+        "tipo_veiculo": rng.choice(TIPOS_VEICULO),
+        "area_negocio": rng.choice(AREAS_NEGOCIO),
+        "lavadores": rng.sample(LAVADORES, rng.choice([1, 1, 1, 2, 2, 3])),
+        "tipo_lavagem": rng.choice(TIPOS_LAVAGEM),
+        "empresa_tipo": "externa" if externa else "interna",
+        "empresa_nome": rng.choice(EMPRESAS_EXTERNAS) if externa else "HPD Transportes",
+        "matricula_trator": matricula(rng),
+        "matricula_reboque": matricula(rng) if rng.random() < 0.7 else "",
+        "valor": float(rng.choice([25, 35, 40, 45, 60, 85.5, 120])),
+        "observacoes": rng.choice(OBSERVACOES),
+        "created_at": created_at.replace(microsecond=created_at.microsecond // 1000 * 1000),
+        "data_dia": day,
+        "idempotency_key": None,
+    }
+
+
+def generate_washes(count: int, days: int = 730, seed: int = 42, end: datetime = None):
+    """Yield `count` washes spread uniformly over the `days` days before `end`."""
+    rng = random.Random(seed)
+    end = end or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(count):
+        yield make_wash(rng, end - timedelta(days=rng.randrange(days)))
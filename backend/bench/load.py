@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+API load test: latency percentiles, throughput and peak RSS per route
+
+Starts the real app under uvicorn on a free local port, seeds it with
+synthetic Portuguese washes (bench.data) and drives concurrent HTTP load at
+every /api/lavagens*, /api/lavadores and /api/empresas-externas route, one
+route at a time. Results are written as JSON so runs can be diffed.
+
+The load generator shares the server's process and event loop, so absolute
+numbers are conservative; compare runs made with the same options.
+
+Run from the backend directory:
+    python -m bench.load --backend memory --count 100000
+    python -m bench.load --backend sqlite --count 1000000 --requests 200
+    MONGO_URL=mongodb://localhost:27017 python -m bench.load --backend mongo
+
+The mongo backend seeds (and first drops) the database named by --db-name,
+never the app's configured DB_NAME.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import resource
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+import httpx
+import uvicorn
+
+from bench.data import EMPRESAS_EXTERNAS, LAVADORES, generate_washes
+
+SEED_BATCH_SIZE = 1000
+
+# Scale presets for --count
+SCALES = {"1k": 1_000, "100k": 100_000, "1m": 1_000_000}
+
+
+def parse_count(value: str) -> int:
+    return SCALES.get(value.lower()) or int(value)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def sample_wash(n: int) -> dict:
+    today = date.today().isoformat()
+    return {
+        "data": today,
+        "tipo_veiculo": "Cisterna",
+        "area_negocio": "Alimentar",
+        "lavadores": ["Anfilófio Sousa", "Bruno Lourenço"],
+        "tipo_lavagem": "Interior Cisterna",
+        "empresa_tipo": "externa",
+        "empresa_nome": "Transportes Silva",
+        "matricula_trator": "12-AB-%02d" % (n % 100),
+        "valor": 45.0,
+        "observacoes": "Carga de benchmark",
+    }
+
+
+class Scenario:
+    """One route under load; `request(n)` builds the n-th request."""
+
+    def __init__(self, name: str, method: str, request: Callable[[int], dict]):
+        self.name = name
+        self.method = method
+        self.request = request
+
+
+def build_scenarios(state: dict) -> List[Scenario]:
+    today = date.today()
+    week_ago = (today - timedelta(days=6)).isoformat()
+    month = f"{today.year}/{today.month}"
+    created = state["created_ids"]
+
+    def get(path: str, **params):
+        return lambda n: {"url": path, "params": params}
+
+    return [
+        Scenario("GET /api/lavagens", "GET", get("/api/lavagens")),
+        Scenario("GET /api/lavagens?after", "GET", get("/api/lavagens", after=state["cursor"])),
+        Scenario("GET /api/lavagens?legacy", "GET", get("/api/lavagens", legacy="true")),
+        Scenario("GET /api/lavagens/today", "GET", get("/api/lavagens/today")),
+        Scenario("GET /api/lavagens/month", "GET", get(f"/api/lavagens/month/{month}")),
+        Scenario("GET /api/lavagens/search?plate", "GET", get("/api/lavagens/search", q="12-AB")),
+        Scenario("GET /api/lavagens/search?text", "GET", get("/api/lavagens/search", q="cimento")),
+        Scenario("GET /api/lavagens/export", "GET", get("/api/lavagens/export", **{"from": week_ago})),
+        Scenario("GET /api/lavagens/stats", "GET", get("/api/lavagens/stats")),
+        Scenario("GET /api/lavagens/stats?filtered", "GET", get(
+            "/api/lavagens/stats", area_negocio="Alimentar", lavador="Carlos Mendes",
+            **{"from": f"{today.year - 1}-01-01"},
+        )),
+        Scenario("GET /api/lavagens/stats/today", "GET", get("/api/lavagens/stats/today")),
+        Scenario("GET /api/lavagens/stats/month", "GET", get(f"/api/lavagens/stats/month/{month}")),
+        Scenario("GET /api/lavagens/series", "GET", get(
+            "/api/lavagens/series", bucket="month", group_by="lavador", **{"from": f"{today.year - 1}-01-01"},
+        )),
+        Scenario("GET /api/lavagens/analytics", "GET", get(
+            "/api/lavagens/analytics", group_by="lavador", **{"from": f"{today.year - 1}-01-01"},
+        )),
+        Scenario("GET /api/dashboard?today", "GET", get("/api/dashboard", scope="today")),
+        Scenario("GET /api/dashboard?month", "GET", get(
+            "/api/dashboard", scope="month", year=today.year, month=today.month, limit=500,
+        )),
+        Scenario("GET /api/dashboard?range", "GET", get("/api/dashboard", scope="range")),
+        Scenario("GET /api/lavadores", "GET", get("/api/lavadores")),
+        Scenario("GET /api/empresas-externas", "GET", get("/api/empresas-externas")),
+        Scenario("POST /api/lavagens", "POST", lambda n: {"url": "/api/lavagens", "json": sample_wash(n)}),
+        Scenario("POST /api/lavagens/bulk", "POST", lambda n: {
+            "url": "/api/lavagens/bulk", "json": [sample_wash(n * 10 + i) for i in range(10)],
+        }),
+        # Deletes the washes created by the POST scenario
+        Scenario("DELETE /api/lavagens/{id}", "DELETE", lambda n: {
+            "url": f"/api/lavagens/{created.pop() if created else 'inexistente'}",
+        }),
+    ]
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, requests: int, concurrency: int,
+                       state: dict) -> dict:
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for n in counter:
+            start = time.perf_counter()
+            try:
+                response = await client.request(scenario.method, **scenario.request(n))
+                await response.aread()
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                response, failed = None, True
+            latencies.append(time.perf_counter() - start)
+            if failed:
+                errors += 1
+            elif scenario.name == "POST /api/lavagens":
+                state["created_ids"].append(response.json()["id"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive") if len(latencies) > 1 else latencies * 99
+    return {
+        "method": scenario.method,
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(cuts[49] * 1000, 2),
+        "p95_ms": round(cuts[94] * 1000, 2),
+        "p99_ms": round(cuts[98] * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2),
+    }
+
+
+async def seed(storage, count: int, seed_value: int) -> float:
+    from models import CustomWasher, ExternalCompany, WashRegistration
+    from repositories import DuplicateError
+
+    start = time.perf_counter()
+    for nome in LAVADORES:
+        try:
+            await storage.lavadores.create(CustomWasher(nome=nome).model_dump())
+        except DuplicateError:
+            pass
+    for nome in EMPRESAS_EXTERNAS:
+        try:
+            await storage.empresas_externas.create(ExternalCompany(nome=nome).model_dump())
+        except DuplicateError:
+            pass
+
+    batch = []
+    for wash in generate_washes(count, seed=seed_value):
+        batch.append(WashRegistration(**wash))
+        if len(batch) == SEED_BATCH_SIZE:
+            await storage.lavagens.create_many(batch)
+            batch = []
+    if batch:
+        await storage.lavagens.create_many(batch)
+    return round(time.perf_counter() - start, 2)
+
+
+async def run(args) -> dict:
+    os.environ["STORAGE_BACKEND"] = args.backend
+    if args.backend == "sqlite":
+        os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(prefix="hpd-bench-"), "lavagens.db")
+    if args.backend == "mongo":
+        os.environ["DB_NAME"] = args.db_name
+    os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+    os.environ.setdefault("DB_NAME", args.db_name)
+
+    import server
+
+    if args.no_cache:
+        server.response_cache.maxsize = 0
+
+    port = free_port()
+    uv = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=port, log_level="warning"))
+    serving = asyncio.create_task(uv.serve())
+    while not uv.started:
+        if serving.done():
+            serving.result()
+        await asyncio.sleep(0.05)
+
+    storage = server.app.state.storage
+    if args.backend == "mongo":
+        await storage.client.drop_database(args.db_name)
+        await storage.start()
+    seed_seconds = await seed(storage, args.count, args.seed)
+    server.response_cache.clear()
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    results: Dict[str, dict] = {}
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=300) as client:
+        first_page = (await client.get("/api/lavagens")).json()
+        state = {"cursor": first_page["next_cursor"] or "", "created_ids": []}
+        for scenario in build_scenarios(state):
+            if args.routes and not any(route in scenario.name for route in args.routes):
+                continue
+            # Warm-up, then measure
+            await run_scenario(client, scenario, min(args.concurrency, args.requests), args.concurrency, state)
+            results[scenario.name] = await run_scenario(client, scenario, args.requests, args.concurrency, state)
+            logging.info("%-40s p50 %8.2f ms  p99 %8.2f ms  %8.1f req/s",
+                         scenario.name, results[scenario.name]["p50_ms"],
+                         results[scenario.name]["p99_ms"], results[scenario.name]["rps"])
+
+    uv.should_exit = True
+    await serving
+
+    return {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "backend": args.backend,
+        "count": args.count,
+        "requests_per_route": args.requests,
+        "concurrency": args.concurrency,
+        "response_cache": not args.no_cache,
+        "seed": args.seed,
+        "seed_seconds": seed_seconds,
+        "peak_rss_mb": peak_rss_mb(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "routes": results,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--backend", choices=["memory", "sqlite", "mongo"], default="memory")
+    parser.add_argument("--count", type=parse_count, default=1_000,
+                        help="washes to seed: a number or one of 1k, 100k, 1m")
+    parser.add_argument("--requests", type=int, default=500, help="measured requests per route")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--no-cache", action="store_true", help="disable the response cache")
+    parser.add_argument("--route", dest="routes", action="append",
+                        help="only routes whose name contains this text (repeatable)")
+    parser.add_argument("--db-name", default="hpd_bench", help="MongoDB database to seed (dropped first)")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    report = asyncio.run(run(args))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    logging.info("Wrote %s (peak RSS %.1f MB)", args.output, report["peak_rss_mb"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Instrumentation overhead: cost of the metrics middleware and Mongo listeners
+
+Times a no-op ASGI request with and without MetricsMiddleware (route lookup,
+in-flight gauge, histogram and counter) against the real app's route table,
+and the per-command cost of the CommandListener/ConnectionPoolListener hooks.
+No server or database needed.
+
+Run from the backend directory:
+    python -m bench.metrics_overhead --iterations 100000
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from metrics import CommandMetrics, MetricsMiddleware, PoolMetrics  # noqa: E402
+from server import app  # noqa: E402
+
+
+async def noop_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def noop_send(message):
+    pass
+
+
+async def noop_receive():
+    return {"type": "http.request", "body": b""}
+
+
+def scope_for(path: str) -> dict:
+    return {
+        "type": "http", "method": "GET", "path": path, "root_path": "", "query_string": b"",
+        "headers": [], "scheme": "http", "server": ("testserver", 80),
+    }
+
+
+async def per_request_us(handler, scope: dict, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await handler(scope, noop_receive, noop_send)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def per_command_us(iterations: int) -> float:
+    commands, pool = CommandMetrics(), PoolMetrics()
+    started = SimpleNamespace(connection_id=("localhost", 27017), request_id=1,
+                              command_name="find", command={"find": "lavagens"})
+    succeeded = SimpleNamespace(connection_id=("localhost", 27017), request_id=1,
+                                command_name="find", duration_micros=800)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        pool.connection_check_out_started(None)
+        pool.connection_checked_out(None)
+        commands.started(started)
+        commands.succeeded(succeeded)
+        pool.connection_checked_in(None)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=100_000)
+    args = parser.parse_args()
+
+    instrumented = MetricsMiddleware(noop_app, router_app=app)
+    results = {"iterations": args.iterations, "middleware_us": {}}
+    for path in ("/api/lavagens", "/api/lavadores/abc", "/nao/existe"):
+        scope = scope_for(path)
+        bare = asyncio.run(per_request_us(noop_app, scope, args.iterations))
+        wrapped = asyncio.run(per_request_us(instrumented, scope, args.iterations))
+        results["middleware_us"][path] = round(wrapped - bare, 2)
+    results["mongo_listeners_us_per_command"] = round(per_command_us(args.iterations), 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+List serialisation benchmark: Pydantic re-validation vs. the lean orjson path
+
+Serves the same N wash documents through two in-process routes, one per code
+path, and checks that both produce identical JSON with exactly the fields the
+API returned before either path existed. No MongoDB needed; the
+documents are what Motor would hand back (with `_id` for the old path, after
+WASH_PROJECTION for the new one).
+
+Run from the backend directory:
+    python -m bench.serialization --count 10000
+"""
+
+import argparse
+import gzip
+import json
+import logging
+import statistics
+import time
+from typing import List
+
+from bson import ObjectId
+from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
+from fastapi.testclient import TestClient
+
+from bench.data import generate_washes
+from models import WashRegistration, public_wash
+
+# The public wash payload as the API has always returned it; both paths must match it
+BASELINE_FIELDS = {
+    "id", "data", "tipo_veiculo", "area_negocio", "lavadores", "tipo_lavagem",
+    "empresa_tipo", "empresa_nome", "matricula_trator", "matricula_reboque",
+    "valor", "observacoes", "created_at",
+}
+
+def build_app(docs: List[dict]) -> FastAPI:
+    raw_docs = [{"_id": ObjectId(), **doc} for doc in docs]
+    # What WASH_PROJECTION leaves of each stored document
+    lean_docs = [public_wash(doc) for doc in docs]
+    app = FastAPI()
+
+    @app.get("/before", response_model=List[WashRegistration])
+    async def before():
+        return [WashRegistration(**lavagem) for lavagem in raw_docs]
+
+    @app.get("/after", response_model=List[WashRegistration])
+    async def after():
+        return ORJSONResponse(lean_docs)
+
+    return app
+
+
+def timed(client: TestClient, path: str, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        response = client.get(path)
+        timings.append(time.perf_counter() - start)
+    return response.content, timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=10_000)
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    docs = list(generate_washes(args.count))
+    client = TestClient(build_app(docs))
+    client.get("/before")
+    client.get("/after")
+
+    results = {}
+    for path in ("/before", "/after"):
+        body, timings = timed(client, path, args.runs)
+        results[path] = {
+            "median_ms": round(statistics.median(timings) * 1000, 1),
+            "min_ms": round(min(timings) * 1000, 1),
+            "bytes": len(body),
+            "gzip_bytes": len(gzip.compress(body)),
+            "json": json.loads(body),
+        }
+
+    before, after = results["/before"].pop("json"), results["/after"].pop("json")
+    same = before == after
+    baseline = all(set(lavagem) == BASELINE_FIELDS for lavagem in before + after)
+    print(json.dumps({
+        "documents": args.count,
+        "runs": args.runs,
+        "identical_json": same,
+        "baseline_fields": baseline,
+        "before": results["/before"],
+        "after": results["/after"],
+        "speedup": round(results["/before"]["median_ms"] / results["/after"]["median_ms"], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Monthly billing statements (extratos) for external companies
+
+One pass over a month's external washes builds every company's statement:
+totals, the wash-type and plate breakdowns and one line per wash. Statements
+of closed months are issued once and stored as immutable snapshots, so
+reading one again is a single fetch. Issuing is explicit (POST or
+`manage.py billing`); until then, and for the current month, reads get a
+provisional preview. Statements render to CSV and to a small self-contained
+PDF (no PDF library needed).
+"""
+
+import asyncio
+import csv
+import io
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from models import BillingStatement, SeriesValue, StatementLine, StatementSummary, WashFilter, month_range
+from repositories import DuplicateError, StatementRepository, WashRepository
+
+BILLING_CONCURRENCY = 4
+SEM_MATRICULA = "Sem matrícula"
+
+
+class OpenPeriodError(Exception):
+    """Only closed months can be issued."""
+
+
+def statement_id(periodo: str, empresa_nome: str) -> str:
+    return f"{periodo}/{empresa_nome}"
+
+
+def period_bounds(periodo: str):
+    """First and last day of a "YYYY-MM" period."""
+    year, month = map(int, periodo.split("-"))
+    start, end = month_range(year, month)
+    return start.date(), (end - timedelta(days=1)).date()
+
+
+def period_closed(periodo: str) -> bool:
+    return period_bounds(periodo)[1] < date.today()
+
+
+def _add(total: SeriesValue, valor: float):
+    total.total_lavagens += 1
+    total.total_valor = round(total.total_valor + valor, 2)
+
+
+def build_statements(lavagens: Iterable[dict], periodo: str) -> List[BillingStatement]:
+    """Every company's (provisional) statement from the period's external washes, by company name."""
+    emitido_em = datetime.utcnow()
+    por_empresa: Dict[str, List[StatementLine]] = {}
+    for lavagem in lavagens:
+        linha = StatementLine(**{field: lavagem.get(field) for field in StatementLine.model_fields})
+        por_empresa.setdefault(lavagem["empresa_nome"], []).append(linha)
+
+    statements = []
+    for empresa_nome in sorted(por_empresa):
+        linhas = por_empresa[empresa_nome]
+        por_tipo_lavagem: Dict[str, SeriesValue] = {}
+        por_matricula: Dict[str, SeriesValue] = {}
+        for linha in linhas:
+            _add(por_tipo_lavagem.setdefault(linha.tipo_lavagem, SeriesValue()), linha.valor)
+            matricula = linha.matricula_trator or linha.matricula_reboque or SEM_MATRICULA
+            _add(por_matricula.setdefault(matricula, SeriesValue()), linha.valor)
+        statements.append(BillingStatement(
+            id=statement_id(periodo, empresa_nome),
+            empresa_nome=empresa_nome,
+            periodo=periodo,
+            total_lavagens=len(linhas),
+            total_valor=round(sum(linha.valor for linha in linhas), 2),
+            emitido_em=emitido_em,
+            fechado=False,
+            por_tipo_lavagem=dict(sorted(por_tipo_lavagem.items())),
+            por_matricula=dict(sorted(por_matricula.items())),
+            linhas=linhas,
+        ))
+    return statements
+
+
+async def compute_period(
+    repository: WashRepository, periodo: str, empresa_nome: Optional[str] = None
+) -> List[BillingStatement]:
+    inicio, fim = period_bounds(periodo)
+    filtro = WashFilter(from_=inicio, to=fim, empresa_tipo="externa", empresa_nome=empresa_nome)
+    lavagens = [lavagem async for lavagem in repository.stream(filtro)]
+    return build_statements(lavagens, periodo)
+
+
+async def issue_period(repository: WashRepository, extratos: StatementRepository, periodo: str) -> List[dict]:
+    """Issue the closed month's statements not issued yet; returns the summaries of all of them.
+
+    Issued statements are never touched again, so a wash registered late for an
+    already-billed company does not change its statement.
+    """
+    if not period_closed(periodo):
+        raise OpenPeriodError(periodo)
+    issued = {statement["empresa_nome"] for statement in await extratos.list(periodo)}
+    for statement in await compute_period(repository, periodo):
+        if statement.empresa_nome in issued:
+            continue
+        try:
+            await extratos.create({**statement.model_dump(), "fechado": True})
+        except DuplicateError:
+            pass  # issued concurrently by another worker or run
+    return await extratos.list(periodo)
+
+
+async def issue_periods(
+    repository: WashRepository,
+    extratos: StatementRepository,
+    periodos: List[str],
+    concurrency: int = BILLING_CONCURRENCY,
+) -> Dict[str, List[dict]]:
+    """Issue several months at once, at most `concurrency` passes in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def issue(periodo: str) -> List[dict]:
+        async with semaphore:
+            return await issue_period(repository, extratos, periodo)
+
+    return dict(zip(periodos, await asyncio.gather(*(issue(periodo) for periodo in periodos))))
+
+
+async def list_statements(repository: WashRepository, extratos: StatementRepository, periodo: str) -> List[dict]:
+    """Summaries of the period: issued snapshots, and previews for the companies not issued yet."""
+    issued = await extratos.list(periodo) if period_closed(periodo) else []
+    names = {statement["empresa_nome"] for statement in issued}
+    previews = [
+        StatementSummary(**statement.model_dump()).model_dump()
+        for statement in await compute_period(repository, periodo)
+        if statement.empresa_nome not in names
+    ]
+    return sorted(issued + previews, key=lambda statement: statement["empresa_nome"])
+
+
+async def get_statement(
+    repository: WashRepository, extratos: StatementRepository, periodo: str, empresa_nome: str
+) -> Optional[BillingStatement]:
+    """The issued snapshot, or else a preview computed from the current washes; never issues."""
+    if period_closed(periodo):
+        doc = await extratos.get(statement_id(periodo, empresa_nome))
+        if doc is not None:
+            return BillingStatement(**doc)
+    statements = await compute_period(repository, periodo, empresa_nome)
+    return statements[0] if statements else None
+
+
+# Rendering
+CSV_FIELDS = ["data", "matricula_trator", "matricula_reboque", "tipo_veiculo", "tipo_lavagem", "valor"]
+
+
+def statement_csv(statement: BillingStatement) -> str:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    for linha in statement.linhas:
+        writer.writerow(linha.model_dump())
+    writer.writerow({"data": "Total", "valor": f"{statement.total_valor:.2f}"})
+    return buffer.getvalue()
+
+
+def _money(valor: float) -> str:
+    return f"€{valor:.2f}"
+
+
+def statement_lines(statement: BillingStatement) -> List[str]:
+    """The statement as fixed-width text, as printed on the PDF."""
+    inicio, fim = period_bounds(statement.periodo)
+    lines = [
+        "HPD Lavagens - Extrato mensal" + ("" if statement.fechado else " (PROVISÓRIO)"),
+        "",
+        f"Empresa:    {statement.empresa_nome}",
+        f"Período:    {inicio:%d/%m/%Y} a {fim:%d/%m/%Y}",
+        f"Emitido em: {statement.emitido_em:%d/%m/%Y %H:%M} UTC",
+        f"Total:      {statement.total_lavagens} lavagens, {_money(statement.total_valor)}",
+        "",
+        "Por tipo de lavagem",
+    ]
+    for nome, total in statement.por_tipo_lavagem.items():
+        lines.append(f"  {nome[:50]:<50} {total.total_lavagens:>6} {_money(total.total_valor):>14}")
+    lines += ["", "Por matrícula"]
+    for nome, total in statement.por_matricula.items():
+        lines.append(f"  {nome[:50]:<50} {total.total_lavagens:>6} {_money(total.total_valor):>14}")
+    lines += ["", "Lavagens", f"  {'Data':<10} {'Trator':<12} {'Reboque':<12} {'Tipo de lavagem':<34} {'Valor':>12}"]
+    for linha in statement.linhas:
+        lines.append(
+            f"  {linha.data:<10} {(linha.matricula_trator or '')[:12]:<12} {(linha.matricula_reboque or '')[:12]:<12}"
+            f" {linha.tipo_lavagem[:34]:<34} {_money(linha.valor):>12}"
+        )
+    return lines
+
+
+# A4 in points, Courier 9pt: 5.4pt per character, 11pt per line
+PDF_PAGE_SIZE = (595, 842)
+PDF_MARGIN = 40
+PDF_LEADING = 11
+PDF_PAGE_LINES = (PDF_PAGE_SIZE[1] - 2 * PDF_MARGIN) // PDF_LEADING
+
+
+def _pdf_string(text: str) -> bytes:
+    raw = text.encode("cp1252", "replace")  # WinAnsiEncoding covers Portuguese and €
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def text_pdf(lines: List[str]) -> bytes:
+    """A minimal PDF 1.4 document printing `lines` in Courier, paginated."""
+    pages = [lines[start:start + PDF_PAGE_LINES] for start in range(0, len(lines), PDF_PAGE_LINES)] or [[]]
+    width, height = PDF_PAGE_SIZE
+    # 1: catalog, 2: page tree, 3: font, then a (page, content) pair per page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % (4 + 2 * index) for index in range(len(pages))), len(pages)
+        ),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>",
+    ]
+    for index, page in enumerate(pages):
+        content = b"BT /F1 9 Tf %d TL %d %d Td " % (PDF_LEADING, PDF_MARGIN, height - PDF_MARGIN)
+        content += b"".join(_pdf_string(line) + b" Tj T* " for line in page) + b"ET"
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Resources << /Font << /F1 3 0 R >> >>"
+            b" /Contents %d 0 R >>" % (width, height, 5 + 2 * index)
+        )
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+
+    pdf = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(pdf))
+        pdf += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(pdf)
+    pdf += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    pdf += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    pdf += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(pdf)
+
+
+def statement_pdf(statement: BillingStatement) -> bytes:
+    return text_pdf(statement_lines(statement))
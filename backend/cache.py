@@ -0,0 +1,58 @@
+"""
+In-process response cache
+
+Bounded LRU with a per-entry TTL. Entries are tagged with the collections they
+were computed from so write endpoints can drop exactly the affected keys.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+
+@dataclass
+class CachedResponse:
+    body: bytes
+    etag: str
+    tags: frozenset
+    expires_at: float
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 256, ttl: float = 60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, CachedResponse]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def set(self, key: str, body: bytes, tags: Iterable[str]) -> CachedResponse:
+        # Strong validator: identical bodies always share the same ETag
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        entry = CachedResponse(body, etag, frozenset(tags), time.monotonic() + self.ttl)
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, *tags: str):
+        stale = [key for key, entry in self._entries.items() if entry.tags.intersection(tags)]
+        for key in stale:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,123 @@
+"""
+In-process event fan-out for live dashboards
+
+Write handlers publish one event per change; every open SSE stream holds a
+bounded queue. A subscriber too slow to keep up never blocks writers: events
+it cannot take are dropped and it is flagged to resynchronise from a fresh
+snapshot instead.
+
+With several workers the change listener republishes writes made elsewhere;
+the broker remembers what it recently published, so a write seen both by its
+own route and through the change feed goes out once.
+"""
+
+import asyncio
+from collections import Counter, OrderedDict
+from typing import List, Optional, Set
+
+from models import public_wash
+from repositories.base import STATS_DIMENSIONS, stat_key, washer_keys
+
+SUBSCRIBER_QUEUE_SIZE = 1000
+RECENT_EVENTS = 10000
+
+
+def stats_delta(lavagem: dict, sign: int = 1) -> dict:
+    """The change a wash makes to WashStats: +1/+valor on insert, -1/-valor on delete."""
+    delta = {
+        "total_lavagens": sign,
+        "total_valor": sign * lavagem.get("valor", 0),
+        "por_lavador": {
+            lavador: sign * count for lavador, count in Counter(washer_keys(lavagem)).items()
+        },
+    }
+    for field, prefix in STATS_DIMENSIONS.items():
+        delta[prefix] = {stat_key(lavagem.get(field)): sign}
+    return delta
+
+
+def stats_of(lavagens: List[dict]) -> dict:
+    """WashStats for a complete list of washes, as the sum of their deltas."""
+    stats = {"total_lavagens": 0, "total_valor": 0, "por_lavador": Counter(),
+             **{prefix: Counter() for prefix in STATS_DIMENSIONS.values()}}
+    for lavagem in lavagens:
+        for key, value in stats_delta(lavagem).items():
+            if isinstance(value, dict):
+                stats[key].update(value)
+            else:
+                stats[key] += value
+    stats["total_valor"] = round(stats["total_valor"], 2)
+    return {key: dict(value) if isinstance(value, Counter) else value for key, value in stats.items()}
+
+
+class Subscription:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.lost = False  # events were dropped; resend a snapshot
+
+    async def get(self, timeout: float) -> Optional[dict]:
+        """Next event, or None if nothing arrived within `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def reset(self):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.lost = False
+
+
+class EventBroker:
+    def __init__(self):
+        self.subscribers: Set[Subscription] = set()
+        self.recent: "OrderedDict[tuple, None]" = OrderedDict()  # (type, id) already published
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription()
+        self.subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self.subscribers.discard(subscription)
+
+    def publish(self, event: dict):
+        for subscription in self.subscribers:
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                subscription.lost = True
+
+    def _first_time(self, event_type: str, wash_id: str) -> bool:
+        key = (event_type, wash_id)
+        if key in self.recent:
+            return False
+        self.recent[key] = None
+        if len(self.recent) > RECENT_EVENTS:
+            self.recent.popitem(last=False)
+        return True
+
+    def resync(self):
+        """Events were lost upstream: every subscriber starts over from a snapshot."""
+        for subscription in self.subscribers:
+            subscription.lost = True
+            try:
+                subscription.queue.put_nowait({"type": "resync"})  # wake it now
+            except asyncio.QueueFull:
+                pass
+
+    def publish_insert(self, lavagem: dict):
+        if not self._first_time("insert", lavagem["id"]):
+            return
+        # Change feed documents arrive as stored: send only what the API shows
+        self.publish({"type": "insert", "lavagem": public_wash(lavagem), "delta": stats_delta(lavagem)})
+
+    def publish_delete(self, lavagem: dict):
+        if not self._first_time("delete", lavagem["id"]):
+            return
+        self.publish({
+            "type": "delete",
+            "id": lavagem["id"],
+            "data": lavagem["data"],
+            "delta": stats_delta(lavagem, -1),
+        })
@@ -0,0 +1,153 @@
+"""
+Load shedding for expensive endpoints
+
+Each class of expensive routes (stats, month, export) runs at most
+`concurrency` requests at once per worker, with at most `queue` more waiting
+for a slot. Anything beyond that is refused straight away with 503 and
+Retry-After rather than piling up behind a burst, so the cheap endpoints
+(POST /api/lavagens, lookups) keep their latency and their share of the
+MongoDB pool.
+
+Admitted requests get a deadline: MongoDB receives what is left of it as
+maxTimeMS (pymongo.timeout) and the handler stops waiting once it passes.
+The query is also cancelled as soon as the client disconnects.
+"""
+
+import asyncio
+import contextlib
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Optional, TypeVar
+
+import pymongo
+from starlette.requests import Request
+
+T = TypeVar("T")
+
+
+class Overloaded(Exception):
+    """The route class is saturated; retry after `retry_after` seconds."""
+
+    def __init__(self, limiter: "RouteLimiter"):
+        super().__init__(limiter.name)
+        self.route_class = limiter.name
+        self.retry_after = limiter.retry_after
+
+
+class DeadlineExceeded(Exception):
+    def __init__(self, limiter: "RouteLimiter"):
+        super().__init__(limiter.name)
+        self.route_class = limiter.name
+
+
+class ClientDisconnected(Exception):
+    def __init__(self, limiter: "RouteLimiter"):
+        super().__init__(limiter.name)
+        self.route_class = limiter.name
+
+
+class Lease:
+    """One admitted request's slot; releasing it twice is harmless."""
+
+    def __init__(self, limiter: "RouteLimiter"):
+        self._limiter = limiter
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._limiter._slots.release()
+
+
+class RouteLimiter:
+    def __init__(
+        self,
+        name: str,
+        concurrency: int,
+        queue: int,
+        deadline: Optional[float] = None,
+        max_wait: float = 5.0,
+        retry_after: int = 2,
+    ):
+        self.name = name
+        self.queue = queue
+        self.deadline = deadline  # seconds per request, queueing included; None: the client's timeoutMS
+        self.max_wait = max_wait  # longest wait for a slot before shedding
+        self.retry_after = retry_after
+        self.waiting = 0
+        self._slots = asyncio.Semaphore(concurrency)
+
+    @classmethod
+    def from_env(cls, name: str, concurrency: int, queue: int, deadline: Optional[float] = None) -> "RouteLimiter":
+        """Defaults overridable per deployment, e.g. STATS_MAX_CONCURRENCY, STATS_MAX_QUEUE, STATS_DEADLINE_SECONDS."""
+        env = os.environ.get
+        prefix = name.upper()
+        deadline = env(f"{prefix}_DEADLINE_SECONDS", deadline)
+        return cls(
+            name,
+            concurrency=int(env(f"{prefix}_MAX_CONCURRENCY", concurrency)),
+            queue=int(env(f"{prefix}_MAX_QUEUE", queue)),
+            deadline=float(deadline) if deadline not in (None, "", "0") else None,
+            max_wait=float(env("LOAD_SHED_MAX_WAIT_SECONDS", "5")),
+            retry_after=int(env("LOAD_SHED_RETRY_AFTER_SECONDS", "2")),
+        )
+
+    async def acquire(self) -> Lease:
+        """A slot, queueing for it if the queue has room; raises Overloaded otherwise."""
+        if self._slots.locked():
+            if self.waiting >= self.queue:
+                raise Overloaded(self)
+            self.waiting += 1
+            try:
+                wait = self.max_wait if self.deadline is None else min(self.max_wait, self.deadline)
+                await asyncio.wait_for(self._slots.acquire(), wait)
+            except asyncio.TimeoutError:
+                raise Overloaded(self)
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+        return Lease(self)
+
+    async def run(self, request: Request, producer: Callable[[], Awaitable[T]]) -> T:
+        """Run `producer()` in a slot, within the deadline and only while the client waits."""
+        started = time.monotonic()
+        lease = await self.acquire()
+        try:
+            timeout = None
+            limit = contextlib.nullcontext()
+            if self.deadline is not None:
+                timeout = max(self.deadline - (time.monotonic() - started), 0.001)
+                limit = pymongo.timeout(timeout)
+            with limit:
+                # The task copies the context, and with it the pymongo deadline
+                task = asyncio.ensure_future(producer())
+            watcher = asyncio.ensure_future(_disconnect(request))
+            try:
+                done, _ = await asyncio.wait({task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                watcher.cancel()
+                if not task.done():
+                    # Let the query unwind before its slot is handed on
+                    task.cancel()
+                    await asyncio.wait({task})
+            if task in done:
+                return task.result()
+            raise ClientDisconnected(self) if watcher in done else DeadlineExceeded(self)
+        finally:
+            lease.release()
+
+    async def stream(self, lease: Lease, body: AsyncIterator) -> AsyncIterator:
+        """Hold `lease` while a streamed body is sent; pair with a background `lease.release`,
+        which also covers a body that never started."""
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            lease.release()
+
+
+async def _disconnect(request: Request):
+    # Request bodies of these routes are empty or already read, so the next message is the disconnect
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
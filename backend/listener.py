@@ -0,0 +1,105 @@
+"""
+Cross-worker change feed
+
+Each uvicorn worker has its own response cache and live-dashboard broker, so a
+write handled by one worker must reach the others. Every worker runs a
+ChangeListener that follows all writes to lavagens, lavadores and
+empresas_externas:
+
+- on MongoDB through a change stream, resumed from a persisted token after a
+  dropped connection or a quick restart;
+- where change streams are unavailable (standalone mongod, SQLite) by polling
+  the change log.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Callable, Optional
+
+from repositories import ChangeStreamUnavailable, Storage
+from repositories.base import settled_changes
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 1.0
+POLL_BATCH = 1000
+RETRY_SECONDS = 5.0
+TOKEN_SAVE_SECONDS = 5.0
+
+
+class ChangeListener:
+    """Calls `on_change(event)` for every write ({colecao, op, id, doc}) and
+    `on_resync()` when events may have been missed."""
+
+    def __init__(
+        self,
+        storage: Storage,
+        on_change: Callable[[dict], None],
+        on_resync: Callable[[], None],
+        poll_seconds: float = POLL_SECONDS,
+    ):
+        self.storage = storage
+        self.on_change = on_change
+        self.on_resync = on_resync
+        self.poll_seconds = poll_seconds
+        self._token = None  # last change stream resume token
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # Where polling would start, should the stream turn out to be unavailable
+        _, seq = await self.storage.changes.bounds()
+        try:
+            await self._follow_stream()
+        except ChangeStreamUnavailable as e:
+            logger.info("Change streams unavailable (%s); polling the change log every %ss", e, self.poll_seconds)
+        await self._poll(seq)
+
+    async def _follow_stream(self):
+        self._token = await self.storage.load_resume_token()
+        saved_at = time.monotonic()
+        try:
+            while True:
+                try:
+                    async for event in self.storage.watch(self._token):
+                        self._token = event["token"]
+                        if event["op"] == "resync":
+                            self.on_resync()
+                            continue
+                        self.on_change(event)
+                        if time.monotonic() - saved_at >= TOKEN_SAVE_SECONDS:
+                            await self.storage.save_resume_token(self._token)
+                            saved_at = time.monotonic()
+                except ChangeStreamUnavailable:
+                    raise
+                except Exception as e:
+                    # Reopen from the last token; nothing is lost unless the oplog moves past it
+                    logger.warning("Change stream interrupted, retrying in %ss: %s", RETRY_SECONDS, e)
+                    await asyncio.sleep(RETRY_SECONDS)
+        finally:
+            if self._token is not None:
+                await self.storage.save_resume_token(self._token)
+
+    async def _poll(self, seq: int):
+        while True:
+            await asyncio.sleep(self.poll_seconds)
+            try:
+                entries = await self.storage.changes.since(seq, POLL_BATCH)
+            except Exception as e:
+                logger.warning("Change log poll failed: %s", e)
+                continue
+            settled, seq, _ = settled_changes(entries, seq)
+            for entry in settled:
+                self.on_change(entry)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+HPD Wash Management maintenance commands
+
+Run from the backend directory, e.g.:
+    python manage.py backfill-data-dia
+"""
+
+import asyncio
+import logging
+import os
+from datetime import date, datetime
+
+import typer
+from dotenv import load_dotenv
+from pymongo import UpdateOne
+
+from archive import ArchivedWashRepository, ArchiveStore, archive_before
+from billing import BILLING_CONCURRENCY, issue_periods, period_closed, statement_csv, statement_pdf
+from models import BillingStatement, WashFilter, parse_wash_date
+from reports import default_range, generate, snapshot
+from repositories import create_storage
+from repositories.base import plate_keys
+from repositories.mongo import MaintenanceConflict, MongoStorage
+
+load_dotenv(os.path.join(os.path.dirname(__file__), ".env"))
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+cli = typer.Typer(help="HPD backend maintenance commands")
+
+
+def _storage() -> MongoStorage:
+    # Maintenance commands work on the MongoDB backend's own documents
+    return MongoStorage(os.environ["MONGO_URL"], os.environ["DB_NAME"])
+
+
+async def _backfill_data_dia(batch_size: int) -> int:
+    storage = _storage()
+    db = storage.db
+    updated = 0
+    pending = []
+    cursor = db.lavagens.find(
+        {"data_dia": {"$exists": False}},
+        {"_id": 1, "data": 1},
+        batch_size=batch_size,
+    )
+    async for lavagem in cursor:
+        data_dia = parse_wash_date(lavagem.get("data"))
+        if data_dia is None:
+            logger.warning("Skipping wash %s with invalid data %r", lavagem["_id"], lavagem.get("data"))
+            continue
+        pending.append(UpdateOne({"_id": lavagem["_id"]}, {"$set": {"data_dia": data_dia}}))
+        if len(pending) >= batch_size:
+            updated += (await db.lavagens.bulk_write(pending, ordered=False)).modified_count
+            pending = []
+    if pending:
+        updated += (await db.lavagens.bulk_write(pending, ordered=False)).modified_count
+    await storage.close()
+    return updated
+
+
+@cli.command("backfill-data-dia")
+def backfill_data_dia(batch_size: int = typer.Option(1000, help="Documents per bulk write")):
+    """Populate the native data_dia field on washes created before it existed."""
+    updated = asyncio.run(_backfill_data_dia(batch_size))
+    typer.echo(f"Backfilled data_dia on {updated} washes")
+
+
+async def _backfill_matriculas(batch_size: int) -> int:
+    storage = _storage()
+    db = storage.db
+    updated = 0
+    pending = []
+    cursor = db.lavagens.find(
+        {"matriculas": {"$exists": False}},
+        {"_id": 1, "matricula_trator": 1, "matricula_reboque": 1},
+        batch_size=batch_size,
+    )
+    async for lavagem in cursor:
+        pending.append(UpdateOne({"_id": lavagem["_id"]}, {"$set": {"matriculas": plate_keys(lavagem)}}))
+        if len(pending) >= batch_size:
+            updated += (await db.lavagens.bulk_write(pending, ordered=False)).modified_count
+            pending = []
+    if pending:
+        updated += (await db.lavagens.bulk_write(pending, ordered=False)).modified_count
+    await storage.close()
+    return updated
+
+
+@cli.command("backfill-matriculas")
+def backfill_matriculas(batch_size: int = typer.Option(1000, help="Documents per bulk write")):
+    """Populate the normalised plates searched by /lavagens/search on older washes."""
+    updated = asyncio.run(_backfill_matriculas(batch_size))
+    typer.echo(f"Backfilled matriculas on {updated} washes")
+
+
+async def _rebuild_rollups(batch_size: int) -> int:
+    storage = _storage()
+    try:
+        return await storage.lavagens.rebuild_rollups(batch_size)
+    finally:
+        await storage.close()
+
+
+@cli.command("rebuild-rollups")
+def rebuild_rollups(batch_size: int = typer.Option(1000, help="Documents per cursor batch and bulk write")):
+    """Recompute the lavagens_daily rollups from scratch, e.g. after an upgrade or a failed write.
+
+    Stop the API first: writes during the rebuild would be lost from the rollups.
+    """
+    try:
+        rebuilt = asyncio.run(_rebuild_rollups(batch_size))
+    except MaintenanceConflict as e:
+        typer.echo(f"Refusing to rebuild: {e}", err=True)
+        raise typer.Exit(1)
+    typer.echo(f"Rebuilt rollups for {rebuilt} days")
+
+
+def archive_dir() -> str:
+    return os.environ.get("ARCHIVE_DIR", os.path.join(os.path.dirname(__file__), "arquivo"))
+
+
+async def _archive(months: int, path: str) -> dict:
+    storage = create_storage(os.environ.get("STORAGE_BACKEND", "mongo"))
+    await storage.start()
+    try:
+        today = date.today()
+        total = today.year * 12 + today.month - 1 - months
+        cutoff = date(total // 12, total % 12 + 1, 1)
+        return await archive_before(storage.lavagens, storage.changes, ArchiveStore(path), cutoff)
+    finally:
+        await storage.close()
+
+
+@cli.command("archive")
+def archive(
+    months: int = typer.Option(24, min=1, help="Keep this many months (plus the current one) live"),
+    path: str = typer.Option(None, "--dir", help="Archive directory; defaults to ARCHIVE_DIR or backend/arquivo"),
+):
+    """Move washes from closed months into the Parquet archive, keeping their stats."""
+    archived = asyncio.run(_archive(months, path or archive_dir()))
+    for key, count in archived.items():
+        typer.echo(f"{key}: {count} washes archived")
+    typer.echo(f"Archived {sum(archived.values())} washes from {len(archived)} months")
+
+
+def _periods(start: str, end: str) -> list:
+    first_year, first_month = map(int, start.split("-"))
+    last_year, last_month = map(int, end.split("-"))
+    return [
+        f"{total // 12:04d}-{total % 12 + 1:02d}"
+        for total in range(first_year * 12 + first_month - 1, last_year * 12 + last_month)
+    ]
+
+
+def _write_statement(statement: BillingStatement, path: str) -> None:
+    base = os.path.join(path, statement.periodo, statement.empresa_nome.replace("/", "-"))
+    os.makedirs(os.path.dirname(base), exist_ok=True)
+    with open(base + ".csv", "w", encoding="utf-8", newline="") as f:
+        f.write(statement_csv(statement))
+    with open(base + ".pdf", "wb") as f:
+        f.write(statement_pdf(statement))
+
+
+async def _billing(periodos: list, path: str, concurrency: int) -> dict:
+    storage = create_storage(os.environ.get("STORAGE_BACKEND", "mongo"))
+    await storage.start()
+    try:
+        # Archived months are billed from the archive, like the API does
+        lavagens = ArchivedWashRepository(storage.lavagens, ArchiveStore(archive_dir()))
+        issued = await issue_periods(lavagens, storage.extratos, periodos, concurrency)
+        for periodo, summaries in issued.items():
+            for summary in summaries:
+                statement = BillingStatement(**await storage.extratos.get(summary["id"]))
+                await asyncio.to_thread(_write_statement, statement, path)
+        return issued
+    finally:
+        await storage.close()
+
+
+@cli.command("billing")
+def billing(
+    start: str = typer.Option(..., "--from", help="First month to bill, YYYY-MM"),
+    end: str = typer.Option(None, "--to", help="Last month to bill, YYYY-MM; defaults to --from"),
+    path: str = typer.Option(None, "--out", help="Output directory; defaults to backend/extratos"),
+    concurrency: int = typer.Option(BILLING_CONCURRENCY, min=1, help="Months computed at the same time"),
+):
+    """Issue the monthly statements of external companies and write them as CSV and PDF files."""
+    path = path or os.path.join(os.path.dirname(__file__), "extratos")
+    try:
+        periodos = _periods(start, end or start)
+    except ValueError:
+        raise typer.BadParameter("months must be YYYY-MM")
+    if not periodos or not period_closed(periodos[-1]):
+        raise typer.BadParameter("only closed months can be billed")
+    issued = asyncio.run(_billing(periodos, path, concurrency))
+    for periodo, summaries in issued.items():
+        total = sum(summary["total_valor"] for summary in summaries)
+        typer.echo(f"{periodo}: {len(summaries)} statements, {total:.2f}€")
+    typer.echo(f"Statements written to {path}")
+
+
+async def _snapshot(start: date, end: date):
+    storage = create_storage(os.environ.get("STORAGE_BACKEND", "mongo"))
+    await storage.start()
+    try:
+        lavagens = ArchivedWashRepository(storage.lavagens, ArchiveStore(archive_dir()))
+        return await snapshot(lavagens, WashFilter(from_=start, to=end))
+    finally:
+        await storage.close()
+
+
+@cli.command("report")
+def report(
+    start: datetime = typer.Option(None, "--from", formats=["%Y-%m-%d"], help="First day; defaults to last year's"),
+    end: datetime = typer.Option(None, "--to", formats=["%Y-%m-%d"], help="Last day; defaults to last year's"),
+    path: str = typer.Option(None, "--out", help="Output directory; defaults to backend/relatorios"),
+    workers: int = typer.Option(None, min=1, help="Worker processes; defaults to one per CPU"),
+):
+    """Write yearly analytics reports (areas by month, washers, wash types, companies) as CSV files."""
+    first, last = default_range()
+    path = path or os.path.join(os.path.dirname(__file__), "relatorios")
+    frame, credits = asyncio.run(_snapshot(start.date() if start else first, end.date() if end else last))
+    logger.info("Snapshot of %d washes, %.1f MB", len(frame), frame.memory_usage(deep=True).sum() / 1e6)
+    for year, count in generate(frame, credits, path, workers).items():
+        typer.echo(f"{year}: {count} washes")
+    typer.echo(f"Reports written to {path}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,210 @@
+"""
+Prometheus metrics
+
+HTTP request counts, latency histograms and in-flight gauges labelled by route
+template (e.g. /api/lavagens/{wash_id}, never the raw path), plus MongoDB
+command durations per collection/command and connection-pool checkout waits
+collected through PyMongo's monitoring listeners.
+
+Metrics live in a dedicated registry and are per process; scrape every worker.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from pymongo import monitoring
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Match
+
+registry = CollectorRegistry()
+
+# Requests that match no route share one label so 404 scans cannot blow up cardinality
+UNMATCHED_ROUTE = "unmatched"
+
+HTTP_REQUESTS = Counter(
+    "hpd_http_requests_total", "HTTP requests handled", ["method", "route", "status"], registry=registry,
+)
+HTTP_LATENCY = Histogram(
+    "hpd_http_request_duration_seconds", "HTTP request latency, including the streamed body",
+    ["method", "route"], registry=registry,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "hpd_http_requests_in_flight", "HTTP requests currently being served", ["method", "route"], registry=registry,
+)
+SHED_REQUESTS = Counter(
+    "hpd_shed_requests_total",
+    "Expensive requests given up: refused while saturated (overloaded), past their deadline or abandoned by the client",
+    ["route_class", "reason"], registry=registry,
+)
+
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+MONGO_COMMAND_LATENCY = Histogram(
+    "hpd_mongo_command_duration_seconds", "MongoDB command round-trip time as reported by the driver",
+    ["collection", "command"], buckets=MONGO_BUCKETS, registry=registry,
+)
+MONGO_COMMAND_FAILURES = Counter(
+    "hpd_mongo_command_failures_total", "MongoDB commands that returned an error",
+    ["collection", "command"], registry=registry,
+)
+MONGO_POOL_WAIT = Histogram(
+    "hpd_mongo_pool_checkout_wait_seconds", "Time spent waiting to check a connection out of the pool",
+    ["outcome"], buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0), registry=registry,
+)
+MONGO_POOL_CHECKED_OUT = Gauge(
+    "hpd_mongo_pool_checked_out_connections", "Connections currently checked out of the pool", registry=registry,
+)
+
+
+def route_template(app, scope) -> str:
+    """The path template of the route that will serve `scope`, resolved as the router does."""
+    path = scope["path"]
+    partial = None
+    for route in app.router.routes:
+        # Cheap regex prefilter; matches() also builds path params for every route
+        path_regex = getattr(route, "path_regex", None)
+        if path_regex is not None and not path_regex.match(path):
+            continue
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # e.g. right path, wrong method: answered with 405
+    return partial or UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware, so streamed responses (exports) are timed to the last byte."""
+
+    def __init__(self, app, router_app):
+        self.app = app
+        self.router_app = router_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = route_template(self.router_app, scope)
+        in_flight = HTTP_IN_FLIGHT.labels(method, route)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            in_flight.dec()
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def _command_collection(event) -> str:
+    # Most commands name their collection as the command's value ({"find": "lavagens"});
+    # getMore carries it separately
+    if event.command_name == "getMore":
+        return str(event.command.get("collection", ""))
+    value = event.command.get(event.command_name)
+    return value if isinstance(value, str) else ""
+
+
+# Commands whose outcome is never reported (e.g. fire-and-forget writes) would
+# otherwise stay pending forever; past this many, the oldest are forgotten
+COMMANDS_PENDING_MAX = 10_000
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Times every MongoDB command; durations come from the driver itself."""
+
+    def __init__(self):
+        # started() sees the command document, succeeded()/failed() only its ids:
+        # keep just the collection name in between
+        self._pending: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()  # events arrive on the driver's threads
+
+    def started(self, event):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = _command_collection(event)
+            if len(self._pending) > COMMANDS_PENDING_MAX:
+                self._pending.popitem(last=False)
+
+    def _collection(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), "")
+
+    def succeeded(self, event):
+        collection = self._collection(event)
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._collection(event)
+        MONGO_COMMAND_LATENCY.labels(collection, event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(collection, event.command_name).inc()
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Measures pool checkout waits.
+
+    Checkout events carry no request id, but a checkout starts and ends on the
+    same driver thread, so the start time is kept in a thread-local.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _wait(self) -> float:
+        start = getattr(self._local, "checkout_started", None)
+        self._local.checkout_started = None
+        return time.perf_counter() - start if start is not None else 0.0
+
+    def connection_check_out_started(self, event):
+        self._local.checkout_started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        MONGO_POOL_WAIT.labels("ok").observe(self._wait())
+        MONGO_POOL_CHECKED_OUT.inc()
+
+    def connection_check_out_failed(self, event):
+        MONGO_POOL_WAIT.labels(event.reason).observe(self._wait())
+
+    def connection_checked_in(self, event):
+        MONGO_POOL_CHECKED_OUT.dec()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        pass
+
+
+def mongo_listeners() -> list:
+    """Event listeners to pass to the Motor client."""
+    return [CommandMetrics(), PoolMetrics()]
@@ -0,0 +1,225 @@
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import ClassVar, Dict, List, Optional, Tuple
+import uuid
+from datetime import datetime, date
+
+# Date helpers
+def parse_wash_date(value: str) -> Optional[datetime]:
+    """Parse a YYYY-MM-DD `data` string into a midnight datetime, or None."""
+    try:
+        return datetime.strptime(value, "%Y-%m-%d")
+    except (TypeError, ValueError):
+        return None
+
+def month_range(year: int, month: int) -> Tuple[datetime, datetime]:
+    """Return the [first day, first day of next month) bounds for a month."""
+    start = datetime(year, month, 1)
+    end = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+    return start, end
+
+# Models
+class WashRegistration(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    data: str  # Date in YYYY-MM-DD format
+    tipo_veiculo: str
+    area_negocio: str
+    lavadores: List[str]  # Changed to list of washers
+    tipo_lavagem: str
+    empresa_tipo: str  # "interna" or "externa"
+    empresa_nome: str
+    matricula_trator: Optional[str] = ""
+    matricula_reboque: Optional[str] = ""
+    valor: float
+    observacoes: Optional[str] = ""
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    # Native, indexed copy of `data` (midnight), for queries only: `data` is what clients see
+    data_dia: Optional[datetime] = Field(None, exclude=True)
+    # Stored to deduplicate client retries, never sent back: whoever reads it could replay it
+    idempotency_key: Optional[str] = Field(None, exclude=True)
+
+    # Fields kept on the stored document but left out of every API payload
+    INTERNAL_FIELDS: ClassVar[Tuple[str, ...]] = ("data_dia", "idempotency_key")
+
+    @model_validator(mode="after")
+    def fill_data_dia(self):
+        if self.data_dia is None:
+            self.data_dia = parse_wash_date(self.data)
+        return self
+
+    def document(self) -> dict:
+        """The wash as stored: its API fields plus the internal ones."""
+        return {**self.model_dump(), **{field: getattr(self, field) for field in self.INTERNAL_FIELDS}}
+
+# Fields of a wash as the API returns it
+WASH_FIELDS = [name for name, field in WashRegistration.model_fields.items() if not field.exclude]
+
+def public_wash(doc: dict) -> dict:
+    """A stored wash document trimmed to what the API returns."""
+    return {field: doc[field] for field in WASH_FIELDS if field in doc}
+
+class WashRegistrationCreate(BaseModel):
+    data: str
+    tipo_veiculo: str
+    area_negocio: str
+    lavadores: List[str]  # Changed to list of washers
+    tipo_lavagem: str
+    empresa_tipo: str
+    empresa_nome: str
+    matricula_trator: Optional[str] = ""
+    matricula_reboque: Optional[str] = ""
+    valor: float
+    observacoes: Optional[str] = ""
+    idempotency_key: Optional[str] = None  # Client-generated; replays return the original
+
+    @field_validator("idempotency_key")
+    @classmethod
+    def blank_key_is_none(cls, value: Optional[str]) -> Optional[str]:
+        # "" is no key at all, on every engine (Mongo's unique index would take it as one)
+        return value if value and value.strip() else None
+
+class CustomWasher(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    nome: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class CustomWasherCreate(BaseModel):
+    nome: str
+
+class ExternalCompany(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    nome: str
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ExternalCompanyCreate(BaseModel):
+    nome: str
+
+class AuthRequest(BaseModel):
+    password: str
+
+class WashRegistrationPage(BaseModel):
+    items: List[WashRegistration]
+    next_cursor: Optional[str] = None  # Pass as `after` to fetch the next page
+
+class WashSearchPage(BaseModel):
+    items: List[WashRegistration]  # Best match first
+    next_offset: Optional[int] = None  # Pass as `offset` to fetch the next page
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: str  # "criada", "duplicada", "invalida" or "erro"
+    id: Optional[str] = None
+    erro: Optional[str] = None
+
+class BulkResult(BaseModel):
+    criadas: int
+    duplicadas: int
+    falhadas: int
+    resultados: List[BulkItemResult]
+
+class WashStats(BaseModel):
+    total_lavagens: int
+    total_valor: float
+    por_tipo_veiculo: dict
+    por_area_negocio: dict
+    por_lavador: dict
+    por_tipo_lavagem: dict
+
+class Dashboard(BaseModel):
+    scope: str
+    inicio: Optional[date] = None
+    fim: Optional[date] = None
+    items: List[WashRegistration]
+    next_cursor: Optional[str] = None
+    stats: Optional[WashStats] = None  # Omitted on follow-up pages (stats=false)
+
+class SeriesValue(BaseModel):
+    total_lavagens: int = 0
+    total_valor: float = 0
+
+class SeriesPoint(BaseModel):
+    periodo: date  # First day of the bucket (Mondays for weeks)
+    total_lavagens: int
+    total_valor: float
+    grupos: Dict[str, SeriesValue] = {}
+
+class WashSeries(BaseModel):
+    bucket: str
+    group_by: Optional[str] = None
+    inicio: Optional[date] = None
+    fim: Optional[date] = None
+    pontos: List[SeriesPoint]
+
+class AnalyticsGroup(BaseModel):
+    nome: str
+    lavagens: int
+    valor: float  # Revenue credited; a job shared by n washers credits valor / n to each
+    ticket_medio: float  # Average valor of the group's jobs
+    quota: float  # Share of the total valor, 0-1
+
+class WashAnalytics(BaseModel):
+    group_by: str
+    sort: str
+    inicio: Optional[date] = None
+    fim: Optional[date] = None
+    total_lavagens: int
+    total_valor: float
+    grupos: List[AnalyticsGroup]  # Top groups by `sort`, descending
+
+class StatementLine(BaseModel):
+    id: str
+    data: str
+    tipo_veiculo: str
+    tipo_lavagem: str
+    matricula_trator: Optional[str] = ""
+    matricula_reboque: Optional[str] = ""
+    valor: float
+
+class StatementSummary(BaseModel):
+    id: str  # "<YYYY-MM>/<empresa_nome>"
+    empresa_nome: str
+    periodo: str  # YYYY-MM
+    total_lavagens: int
+    total_valor: float
+    emitido_em: datetime
+    fechado: bool  # True: an immutable snapshot of a closed month; False: a provisional preview
+
+class BillingStatement(StatementSummary):
+    por_tipo_lavagem: Dict[str, SeriesValue]
+    por_matricula: Dict[str, SeriesValue]  # Tractor plate (or trailer, when there is none)
+    linhas: List[StatementLine]  # Every wash, by date
+
+class SyncPage(BaseModel):
+    token: str  # Pass as `since` on the next call
+    reset: bool = False  # `since` missing, unknown or expired: reload the full lists, then sync from `token`
+    has_more: bool = False  # More changes are waiting; call again with `token` straight away
+    lavagens: List[WashRegistration] = []  # Inserted since `since`
+    lavadores: List[CustomWasher] = []
+    empresas_externas: List[ExternalCompany] = []
+    eliminados: Dict[str, List[str]] = {}  # Collection -> ids deleted since `since`
+
+# Filters shared by the stats, series and analytics endpoints
+class WashFilter(BaseModel):
+    from_: Optional[date] = None
+    to: Optional[date] = None
+    area_negocio: Optional[str] = None
+    lavador: Optional[str] = None
+    empresa_tipo: Optional[str] = None
+    empresa_nome: Optional[str] = None
+    tipo_veiculo: Optional[str] = None
+
+    # Query parameter -> document field
+    DIMENSIONS: ClassVar[dict] = {
+        "area_negocio": "area_negocio",
+        "lavador": "lavadores",
+        "empresa_tipo": "empresa_tipo",
+        "empresa_nome": "empresa_nome",
+        "tipo_veiculo": "tipo_veiculo",
+    }
+
+    def dimensions(self) -> dict:
+        """Requested dimension filters as {document field: value}."""
+        return {
+            field: getattr(self, param)
+            for param, field in self.DIMENSIONS.items()
+            if getattr(self, param)
+        }
@@ -0,0 +1,199 @@
+"""
+Offline analytics reports
+
+`python manage.py report` snapshots the washes of a date range into a pandas
+DataFrame and writes year-end breakdowns as CSV files, beyond what the
+row-capped API can serve:
+
+- area_negocio_mensal.csv: washes and revenue per month and business area
+- lavadores.csv: washer productivity, with shared jobs split between washers
+- tipos_lavagem.csv: wash-type mix
+- empresas.csv: revenue by company
+
+The snapshot reads a projected cursor in chunks, each turned into categorical
+columns straight away, so memory stays at a few dozen bytes per wash. Each
+year is then computed and written by its own worker process.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+from models import WashFilter
+from repositories.base import WashRepository, washer_keys
+
+CATEGORIES = ["area_negocio", "tipo_lavagem", "tipo_veiculo", "empresa_tipo", "empresa_nome"]
+REPORT_FIELDS = [*CATEGORIES, "lavadores", "valor"]
+CHUNK_ROWS = 50_000
+
+
+def _chunk(columns: Dict[str, list], lavadores: Tuple[list, list], offset: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    frame = pd.DataFrame({
+        "data_dia": pd.to_datetime(columns["data_dia"]),
+        **{field: pd.Categorical(columns[field]) for field in CATEGORIES},
+        "valor": np.asarray(columns["valor"], dtype="float64"),
+        "n_lavadores": np.asarray(columns["n_lavadores"], dtype="int16"),
+    })
+    # One row per (wash, washer); `lavagem` is the wash's row in the full frame
+    credits = pd.DataFrame({
+        "lavagem": np.asarray(lavadores[0], dtype="int64") + offset,
+        "lavador": pd.Categorical(lavadores[1]),
+    })
+    return frame, credits
+
+
+def _concat(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    if len(frames) == 1:
+        return frames[0]
+    # Plain concat would fall back to object columns when chunk categories differ
+    return pd.DataFrame({
+        column: (
+            union_categoricals([frame[column] for frame in frames])
+            if isinstance(frames[0][column].dtype, pd.CategoricalDtype)
+            else np.concatenate([frame[column].to_numpy() for frame in frames])
+        )
+        for column in frames[0].columns
+    })
+
+
+async def snapshot(
+    repository: WashRepository, filtro: WashFilter, chunk_rows: int = CHUNK_ROWS
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """Dated washes matching `filtro` as (washes, washer credits) frames."""
+    frames, credits = [], []
+    rows = 0
+
+    def empty():
+        return {field: [] for field in ["data_dia", *CATEGORIES, "valor", "n_lavadores"]}, ([], [])
+
+    columns, lavadores = empty()
+    async for lavagem in repository.stream(filtro, chunk_rows, REPORT_FIELDS):
+        if lavagem["data_dia"] is None:
+            continue
+        index = len(columns["valor"])
+        for field in CATEGORIES:
+            columns[field].append(lavagem.get(field) or "N/A")
+        columns["data_dia"].append(lavagem["data_dia"])
+        columns["valor"].append(lavagem["valor"])
+        # Washes without a washer credit nobody, as in /api/lavagens/analytics
+        nomes = washer_keys(lavagem)
+        columns["n_lavadores"].append(len(nomes))
+        lavadores[0].extend([index] * len(nomes))
+        lavadores[1].extend(nomes)
+        if len(columns["valor"]) == chunk_rows:
+            frame, credit = _chunk(columns, lavadores, rows)
+            frames.append(frame)
+            credits.append(credit)
+            rows += len(frame)
+            columns, lavadores = empty()
+    if columns["valor"] or not frames:
+        frame, credit = _chunk(columns, lavadores, rows)
+        frames.append(frame)
+        credits.append(credit)
+    return _concat(frames), _concat(credits)
+
+
+def _share(values: pd.Series) -> pd.Series:
+    total = values.sum()
+    return values / total * 100 if total else values * 0.0
+
+
+def breakdowns(frame: pd.DataFrame, credits: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Every report table of `frame`; `credits` rows point into `frame` by position."""
+    mes = frame["data_dia"].dt.to_period("M").astype(str).rename("mes")
+    por_area = (
+        frame.groupby([mes, "area_negocio"], observed=True)["valor"]
+        .agg(lavagens="size", valor="sum")
+        .reset_index()
+    )
+
+    tipos = frame.groupby("tipo_lavagem", observed=True)["valor"].agg(lavagens="size", valor="sum")
+    tipos["valor_medio"] = tipos["valor"] / tipos["lavagens"]
+    tipos["pct_lavagens"] = _share(tipos["lavagens"])
+    tipos["pct_valor"] = _share(tipos["valor"])
+
+    empresas = frame.groupby(["empresa_tipo", "empresa_nome"], observed=True)["valor"].agg(
+        lavagens="size", valor="sum"
+    )
+    empresas["pct_valor"] = _share(empresas["valor"])
+
+    # A job shared by n washers credits valor / n to each of them, as in /api/lavagens/analytics
+    posicoes = credits["lavagem"].to_numpy()
+    valor = frame["valor"].to_numpy()[posicoes]
+    trabalho = pd.DataFrame({
+        "lavador": credits["lavador"].to_numpy(),
+        "dia": frame["data_dia"].to_numpy()[posicoes],
+        "valor_creditado": valor / frame["n_lavadores"].to_numpy()[posicoes],
+        "valor_total": valor,
+    })
+    lavadores = trabalho.groupby("lavador", observed=True).agg(
+        lavagens=("dia", "size"),
+        dias_ativos=("dia", "nunique"),
+        valor_creditado=("valor_creditado", "sum"),
+        valor_total=("valor_total", "sum"),
+    )
+    lavadores["lavagens_por_dia"] = lavadores["lavagens"] / lavadores["dias_ativos"]
+
+    return {
+        "area_negocio_mensal": por_area,
+        "lavadores": lavadores.sort_values("valor_creditado", ascending=False).reset_index(),
+        "tipos_lavagem": tipos.sort_values("lavagens", ascending=False).reset_index(),
+        "empresas": empresas.sort_values("valor", ascending=False).reset_index(),
+    }
+
+
+def write_tables(tables: Dict[str, pd.DataFrame], path: str) -> List[str]:
+    os.makedirs(path, exist_ok=True)
+    ficheiros = []
+    for name, table in tables.items():
+        ficheiro = os.path.join(path, f"{name}.csv")
+        table.to_csv(ficheiro, index=False, float_format="%.2f")
+        ficheiros.append(ficheiro)
+    return ficheiros
+
+
+def write_year(year: int, frame: pd.DataFrame, credits: pd.DataFrame, path: str) -> List[str]:
+    """Compute and write one year's report; runs in a worker process."""
+    return write_tables(breakdowns(frame, credits), os.path.join(path, f"relatorio-{year}"))
+
+
+def split_years(frame: pd.DataFrame, credits: pd.DataFrame):
+    """(year, washes, credits) per year, credit positions rebased onto each year's frame."""
+    years = frame["data_dia"].dt.year.to_numpy()
+    credit_years = years[credits["lavagem"].to_numpy()]
+    for year in np.unique(years):
+        rows = np.flatnonzero(years == year)
+        year_credits = credits[credit_years == year].reset_index(drop=True)
+        # Positions in the year frame: how many of its rows come before each one
+        year_credits["lavagem"] = np.searchsorted(rows, year_credits["lavagem"].to_numpy())
+        yield int(year), frame.iloc[rows].reset_index(drop=True), year_credits
+
+
+def generate(
+    frame: pd.DataFrame, credits: pd.DataFrame, path: str, workers: Optional[int] = None
+) -> Dict[int, int]:
+    """Write a report per year (in parallel) plus a yearly summary; returns washes per year."""
+    years = list(split_years(frame, credits))
+    workers = min(workers or os.cpu_count() or 1, len(years) or 1)
+    if workers > 1:
+        with ProcessPoolExecutor(workers) as pool:
+            for future in [pool.submit(write_year, *year, path) for year in years]:
+                future.result()
+    else:
+        for year in years:
+            write_year(*year, path)
+
+    resumo = frame.groupby(frame["data_dia"].dt.year.rename("ano"))["valor"].agg(lavagens="size", valor="sum")
+    write_tables({"resumo": resumo.reset_index()}, path)
+    return {int(ano): int(lavagens) for ano, lavagens in resumo["lavagens"].items()}
+
+
+def default_range(today: Optional[date] = None) -> Tuple[date, date]:
+    """The last closed calendar year."""
+    year = (today or date.today()).year - 1
+    return date(year, 1, 1), date(year, 12, 31)
@@ -0,0 +1,57 @@
+"""
+Pluggable storage
+
+`create_storage` picks the engine named by STORAGE_BACKEND ("mongo", "memory"
+or "sqlite"); engines are imported lazily so only the selected one's driver
+needs to be installed.
+"""
+
+import os
+
+from repositories.base import (
+    ChangeLog,
+    ChangeStreamUnavailable,
+    CompanyRepository,
+    DuplicateError,
+    NameRepository,
+    PageKey,
+    QueryTooLargeError,
+    StatementRepository,
+    Storage,
+    WashRepository,
+    WasherRepository,
+)
+
+STORAGE_BACKENDS = ("mongo", "memory", "sqlite")
+
+
+def create_storage(backend: str, **client_options) -> Storage:
+    """`client_options` are passed to the MongoDB client and ignored by other engines."""
+    if backend == "mongo":
+        from repositories.mongo import MongoStorage, client_options_from_env
+        options = {**client_options_from_env(), **client_options}
+        return MongoStorage(os.environ["MONGO_URL"], os.environ["DB_NAME"], **options)
+    if backend == "memory":
+        from repositories.memory import MemoryStorage
+        return MemoryStorage()
+    if backend == "sqlite":
+        from repositories.sqlite import SqliteStorage
+        return SqliteStorage(os.environ.get("SQLITE_PATH", "lavagens.db"))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r}; expected one of {', '.join(STORAGE_BACKENDS)}")
+
+
+__all__ = [
+    "ChangeLog",
+    "ChangeStreamUnavailable",
+    "CompanyRepository",
+    "DuplicateError",
+    "NameRepository",
+    "PageKey",
+    "QueryTooLargeError",
+    "STORAGE_BACKENDS",
+    "StatementRepository",
+    "Storage",
+    "WashRepository",
+    "WasherRepository",
+    "create_storage",
+]
@@ -0,0 +1,373 @@
+"""
+Storage interfaces
+
+Routes only talk to these abstract repositories; each storage engine (MongoDB,
+in-memory, SQLite) implements them and pushes filtering, stats and range
+queries down into the engine itself.
+"""
+
+import contextlib
+import re
+import unicodedata
+from abc import ABC, abstractmethod
+from datetime import date, datetime, timedelta
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from models import (
+    AnalyticsGroup, BulkItemResult, SeriesPoint, SeriesValue, WashAnalytics, WashFilter, WashRegistration, WashSeries,
+    WashStats,
+)
+
+# (created_at, id) of the last wash a client has seen, newest-first order
+PageKey = Tuple[datetime, str]
+
+# {bucket start: totals} and {bucket start: {group: totals}}
+SeriesBuckets = Tuple[Dict[date, SeriesValue], Dict[date, Dict[str, SeriesValue]]]
+
+SERIES_MAX_POINTS = 1500
+
+# (group, jobs, credited valor, full valor of those jobs); see AnalyticsGroup
+AnalyticsRow = Tuple[str, int, float, float]
+
+# Single-valued wash field -> its WashStats breakdown
+STATS_DIMENSIONS = {
+    "tipo_veiculo": "por_tipo_veiculo",
+    "area_negocio": "por_area_negocio",
+    "tipo_lavagem": "por_tipo_lavagem",
+}
+
+
+class DuplicateError(Exception):
+    """A unique value (e.g. a washer or company name) already exists."""
+
+
+class QueryTooLargeError(Exception):
+    """The request would produce more results than the endpoint allows."""
+
+
+class ChangeStreamUnavailable(Exception):
+    """The engine cannot push changes (e.g. MongoDB without a replica set)."""
+
+
+def stat_key(value):
+    """The breakdown key of a dimension value: missing and empty values count as "N/A"."""
+    return "N/A" if value is None or value == "" else value
+
+
+def wash_lavadores(lavagem: dict) -> list:
+    """Washers of a wash as a list; legacy documents stored a single string."""
+    lavadores = lavagem.get("lavadores", [])
+    if isinstance(lavadores, list):
+        return lavadores
+    return [lavadores or "N/A"]
+
+
+def washer_keys(lavagem: dict) -> List[str]:
+    """The breakdown keys a wash counts for per washer, in stats, series,
+    analytics and reports alike: one per washer, none without a washer.
+    A job shared by n washers credits valor / n to each of them."""
+    return [stat_key(lavador) for lavador in wash_lavadores(lavagem)]
+
+
+# Plate search: the normalised query must be at least this long to be used as a prefix
+PLATE_MIN_PREFIX = 2
+
+
+def normalize_plate(value: Optional[str]) -> str:
+    """Upper-case a licence plate and strip separators: "aa-12 bc" -> "AA12BC"."""
+    return "".join(char for char in (value or "").upper() if char.isalnum())
+
+
+def plate_keys(lavagem: dict) -> List[str]:
+    """Normalised tractor and trailer plates of a wash, as stored for search."""
+    keys = [normalize_plate(lavagem.get(field)) for field in ("matricula_trator", "matricula_reboque")]
+    return sorted({key for key in keys if key})
+
+
+def search_terms(text: str) -> List[str]:
+    """Words of a free-text query or observacoes, lower-case and without accents."""
+    plain = unicodedata.normalize("NFKD", text.casefold())
+    return re.findall(r"\w+", "".join(char for char in plain if not unicodedata.combining(char)))
+
+
+def bucket_start(day: date, bucket: str) -> date:
+    if bucket == "week":
+        return day - timedelta(days=day.weekday())
+    if bucket == "month":
+        return day.replace(day=1)
+    return day
+
+
+def next_bucket(day: date, bucket: str) -> date:
+    if bucket == "month":
+        return date(day.year + 1, 1, 1) if day.month == 12 else date(day.year, day.month + 1, 1)
+    return day + timedelta(days=7 if bucket == "week" else 1)
+
+
+class WashRepository(ABC):
+    """Wash registrations (lavagens).
+
+    Read methods return plain dicts already shaped like a serialised
+    WashRegistration (internal fields left out), so routes can encode them
+    without re-validation. `stream`, used by internal jobs rather than
+    responses, returns the stored documents.
+    """
+
+    @abstractmethod
+    async def create(self, lavagem: WashRegistration) -> WashRegistration:
+        """Store a wash; a replayed idempotency_key returns the original instead."""
+
+    @abstractmethod
+    async def create_many(self, lavagens: List[WashRegistration]) -> List[BulkItemResult]:
+        """Store many washes in one pass; result `index` is the position in `lavagens`."""
+
+    @abstractmethod
+    async def delete(self, wash_id: str) -> Optional[dict]:
+        """Delete a wash and return it, or None when it does not exist."""
+
+    async def delete_many(self, wash_ids: List[str]) -> int:
+        """Delete washes in bulk (e.g. after archiving them); returns how many existed."""
+        deleted = 0
+        for wash_id in wash_ids:
+            deleted += await self.delete(wash_id) is not None
+        return deleted
+
+    @abstractmethod
+    async def list(
+        self, filtro: WashFilter, limit: Optional[int] = None, after: Optional[PageKey] = None
+    ) -> List[dict]:
+        """Washes matching `filtro`, newest first, strictly after `after`."""
+
+    @abstractmethod
+    def stream(
+        self, filtro: WashFilter, batch_size: int = 1000, fields: Optional[List[str]] = None
+    ) -> AsyncIterator[dict]:
+        """Iterate every matching wash, oldest first, without loading them all.
+
+        With `fields`, engines that can project return only those keys (plus
+        data_dia and created_at); callers must not rely on the others.
+        """
+
+    @abstractmethod
+    async def stats(self, filtro: WashFilter) -> WashStats:
+        ...
+
+    async def dashboard(
+        self, filtro: WashFilter, limit: int, after: Optional[PageKey] = None, with_stats: bool = True
+    ) -> Tuple[List[dict], Optional[WashStats]]:
+        """One page of `list` plus `stats` over the same filter; engines that
+        can answer both in a single query override this."""
+        lavagens = await self.list(filtro, limit, after)
+        return lavagens, await self.stats(filtro) if with_stats else None
+
+    @abstractmethod
+    async def series_buckets(self, filtro: WashFilter, bucket: str, group_by: Optional[str]) -> SeriesBuckets:
+        """Non-empty buckets only; `series` zero-fills the gaps."""
+
+    async def series(self, filtro: WashFilter, bucket: str, group_by: Optional[str]) -> WashSeries:
+        totais, grupos = await self.series_buckets(filtro, bucket, group_by)
+        keys = sorted({key for values in grupos.values() for key in values})
+
+        # Zero-fill every bucket in the requested (or observed) range
+        inicio = filtro.from_ or (min(totais) if totais else None)
+        fim = filtro.to or (max(totais) if totais else None)
+        pontos = []
+        if inicio and fim:
+            periodo = bucket_start(inicio, bucket)
+            while periodo <= fim:
+                if len(pontos) == SERIES_MAX_POINTS:
+                    raise QueryTooLargeError("Intervalo demasiado longo para este bucket")
+                total = totais.get(periodo, SeriesValue())
+                values = grupos.get(periodo, {})
+                pontos.append(SeriesPoint(
+                    periodo=periodo,
+                    total_lavagens=total.total_lavagens,
+                    total_valor=total.total_valor,
+                    grupos={key: values.get(key, SeriesValue()) for key in keys},
+                ))
+                periodo = next_bucket(periodo, bucket)
+        return WashSeries(bucket=bucket, group_by=group_by, inicio=inicio, fim=fim, pontos=pontos)
+
+    @abstractmethod
+    async def analytics_rows(
+        self, filtro: WashFilter, group_by: str, top: int, sort: str
+    ) -> Tuple[SeriesValue, List[AnalyticsRow]]:
+        """Totals of the match and its `top` groups, descending by `sort`
+        ("valor", the credited valor, or "lavagens"), ties by name."""
+
+    async def analytics(self, filtro: WashFilter, group_by: str, top: int, sort: str = "valor") -> WashAnalytics:
+        totais, rows = await self.analytics_rows(filtro, group_by, top, sort)
+        grupos = [
+            AnalyticsGroup(
+                nome=str(nome),
+                lavagens=lavagens,
+                valor=round(valor, 2),
+                ticket_medio=round(valor_trabalhos / lavagens, 2) if lavagens else 0,
+                quota=round(valor / totais.total_valor, 4) if totais.total_valor else 0,
+            )
+            for nome, lavagens, valor, valor_trabalhos in rows
+        ]
+        return WashAnalytics(
+            group_by=group_by,
+            sort=sort,
+            inicio=filtro.from_,
+            fim=filtro.to,
+            total_lavagens=totais.total_lavagens,
+            total_valor=round(totais.total_valor, 2),
+            grupos=grupos,
+        )
+
+    @abstractmethod
+    async def plate_hits(self, prefix: str, limit: int) -> List[dict]:
+        """Washes with a tractor or trailer plate starting with the normalised
+        `prefix`, newest first."""
+
+    @abstractmethod
+    async def text_hits(self, text: str, limit: int) -> List[dict]:
+        """Washes whose observacoes match `text`, most relevant first, then newest."""
+
+    async def search(self, q: str, limit: int, offset: int = 0) -> List[dict]:
+        """Washes matching `q`, best first: plate matches (newest first) rank
+        above observacoes matches. Each source is asked for no more hits than
+        the requested page can use."""
+        wanted = offset + limit
+        prefix = normalize_plate(q)
+        hits = await self.plate_hits(prefix, wanted) if len(prefix) >= PLATE_MIN_PREFIX else []
+        if len(hits) < wanted and search_terms(q):
+            seen = {lavagem["id"] for lavagem in hits}
+            texto = [lavagem for lavagem in await self.text_hits(q, wanted) if lavagem["id"] not in seen]
+            hits += texto[:wanted - len(hits)]
+        return hits[offset:]
+
+
+class NameRepository(ABC):
+    """A lookup list of unique names, compared case-insensitively."""
+
+    @abstractmethod
+    async def list(self) -> List[dict]:
+        """Every entry, sorted by name."""
+
+    @abstractmethod
+    async def create(self, entry: dict) -> None:
+        """Store an entry; raises DuplicateError if the name is taken."""
+
+    @abstractmethod
+    async def delete(self, entry_id: str) -> bool:
+        ...
+
+
+class WasherRepository(NameRepository):
+    """Custom washers (lavadores)."""
+
+
+class CompanyRepository(NameRepository):
+    """External companies (empresas externas)."""
+
+
+class StatementRepository(ABC):
+    """Issued billing statements (extratos), write-once: a statement is never replaced."""
+
+    @abstractmethod
+    async def get(self, statement_id: str) -> Optional[dict]:
+        ...
+
+    @abstractmethod
+    async def list(self, periodo: str) -> List[dict]:
+        """A month's statements by company, as summaries (no breakdowns or lines)."""
+
+    @abstractmethod
+    async def create(self, statement: dict) -> None:
+        """Store a statement; raises DuplicateError if it was already issued."""
+
+
+# Changes older than this are pruned; a client holding an older sync token starts over
+CHANGE_RETENTION = timedelta(days=30)
+
+# A seq still missing this long after a later one was logged belongs to an abandoned write
+CHANGE_GAP = timedelta(seconds=60)
+
+
+def settled_changes(entries: List[dict], seq: int) -> Tuple[List[dict], int, bool]:
+    """The entries of `ChangeLog.since(seq)` that are safe to consume, the seq
+    to resume from, and whether a gap stopped the scan.
+
+    Seqs are reserved before their entry is written, so with several writers an
+    entry can appear after a later one; consuming past the gap would skip it.
+    """
+    deadline = datetime.utcnow() - CHANGE_GAP
+    settled = []
+    for entry in entries:
+        if entry["seq"] != seq + 1 and entry["ts"] > deadline:
+            return settled, seq, True
+        settled.append(entry)
+        seq = entry["seq"]
+    return settled, seq, False
+
+
+class ChangeLog(ABC):
+    """Inserts and deletes across lavagens, lavadores and empresas_externas,
+    numbered by a sequence that only grows. Entries carry the document (as it
+    was, for deletes), so a client catching up needs nothing else."""
+
+    # Identifies this log: a token from another one (e.g. a wiped database) cannot resume
+    epoch: str
+
+    @abstractmethod
+    async def append(self, colecao: str, op: str, docs: List[dict]) -> None:
+        """Log `op` ("insert" or "delete") of each of `docs`, in order."""
+
+    @abstractmethod
+    async def since(self, seq: int, limit: int) -> List[dict]:
+        """Up to `limit` entries after `seq`, ascending: {seq, colecao, op, id, doc, ts}."""
+
+    @abstractmethod
+    async def bounds(self) -> Tuple[int, int]:
+        """(oldest retained seq, newest seq); the oldest is newest + 1 while nothing is retained."""
+
+
+class Storage(ABC):
+    """One storage engine: its repositories, the change log and lifecycle hooks."""
+
+    lavagens: WashRepository
+    lavadores: WasherRepository
+    empresas_externas: CompanyRepository
+    extratos: StatementRepository
+    changes: ChangeLog
+
+    # Other processes (e.g. more uvicorn workers) can write to the same data
+    shared = True
+
+    def watch(self, resume_token=None) -> AsyncIterator[dict]:
+        """Push feed of writes to the three collections, resumable after
+        `resume_token`: {colecao, op, id, doc, token}; op "resync" means
+        events were lost. Raises ChangeStreamUnavailable if the engine cannot."""
+        raise ChangeStreamUnavailable(f"{type(self).__name__} has no change stream")
+
+    async def load_resume_token(self):
+        return None
+
+    async def save_resume_token(self, token):
+        ...
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """Run a write and its change-log entry atomically where the engine
+        needs it; nested uses join the outer transaction."""
+        yield
+
+    async def heartbeat(self, instance: str):
+        """Record that API worker `instance` is serving; maintenance that must
+        not race live writes refuses to run while one was seen recently."""
+
+    async def retire(self, instance: str):
+        """Forget `instance` on a clean shutdown."""
+
+    async def start(self):
+        """Create schema/indexes; called once before serving requests."""
+
+    async def ping(self) -> bool:
+        """Readiness check; raises or returns False when the engine cannot serve."""
+        return True
+
+    async def close(self):
+        ...
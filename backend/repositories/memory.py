@@ -0,0 +1,325 @@
+"""
+In-memory storage engine
+
+Keeps everything in Python dicts for tests, demos and local development; data
+is lost on restart. Washes are also kept in a list sorted by (created_at, id)
+so pagination is a bisect rather than a full sort.
+"""
+
+import bisect
+import uuid
+from collections import Counter, deque
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set, Tuple
+
+from models import (
+    BulkItemResult, CustomWasher, ExternalCompany, SeriesValue, StatementSummary, WashFilter, WashRegistration,
+    WashStats, public_wash,
+)
+from repositories.base import (
+    CHANGE_RETENTION,
+    STATS_DIMENSIONS,
+    AnalyticsRow,
+    ChangeLog,
+    CompanyRepository,
+    DuplicateError,
+    PageKey,
+    SeriesBuckets,
+    StatementRepository,
+    Storage,
+    WashRepository,
+    WasherRepository,
+    bucket_start,
+    plate_keys,
+    search_terms,
+    stat_key,
+    wash_lavadores,
+    washer_keys,
+)
+
+
+def wash_matches(lavagem: dict, filtro: WashFilter) -> bool:
+    for field, value in filtro.dimensions().items():
+        if field == "lavadores":
+            if value not in wash_lavadores(lavagem):
+                return False
+        elif lavagem.get(field) != value:
+            return False
+    dia = lavagem["data_dia"]
+    if filtro.from_ or filtro.to:
+        if dia is None:
+            return False
+        if filtro.from_ and dia.date() < filtro.from_:
+            return False
+        if filtro.to and dia.date() > filtro.to:
+            return False
+    return True
+
+
+class MemoryWashRepository(WashRepository):
+    def __init__(self):
+        self.lavagens: Dict[str, dict] = {}
+        self.keys: List[PageKey] = []  # (created_at, id), ascending
+        self.idempotency_keys: Dict[str, str] = {}
+        self.matriculas: List[Tuple[str, str]] = []  # (normalised plate, id), ascending
+        self.termos: Dict[str, Set[str]] = {}  # observacoes word -> ids
+
+    @classmethod
+    def from_documents(cls, docs: Iterable[dict]) -> "MemoryWashRepository":
+        """A repository over already-serialised washes (e.g. an archived month)."""
+        repository = cls()
+        for doc in docs:
+            repository._store(doc)
+        return repository
+
+    def _insert(self, lavagem: WashRegistration) -> Optional[str]:
+        """Store a wash; returns the existing id when its idempotency key is taken.
+
+        A taken id raises DuplicateError, like the unique index of the other engines.
+        """
+        if lavagem.idempotency_key in self.idempotency_keys:
+            return self.idempotency_keys[lavagem.idempotency_key]
+        if lavagem.id in self.lavagens:
+            raise DuplicateError(lavagem.id)
+        self._store(lavagem.document())
+        return None
+
+    def _store(self, doc: dict):
+        self.lavagens[doc["id"]] = doc
+        bisect.insort(self.keys, (doc["created_at"], doc["id"]))
+        for matricula in plate_keys(doc):
+            bisect.insort(self.matriculas, (matricula, doc["id"]))
+        for termo in set(search_terms(doc["observacoes"] or "")):
+            self.termos.setdefault(termo, set()).add(doc["id"])
+        if doc["idempotency_key"]:
+            self.idempotency_keys[doc["idempotency_key"]] = doc["id"]
+
+    async def create(self, lavagem: WashRegistration) -> WashRegistration:
+        existing = self._insert(lavagem)
+        if existing:
+            return WashRegistration(**self.lavagens[existing])
+        return lavagem
+
+    async def create_many(self, lavagens: List[WashRegistration]) -> List[BulkItemResult]:
+        resultados = []
+        for index, lavagem in enumerate(lavagens):
+            try:
+                existing = self._insert(lavagem)
+            except DuplicateError as e:
+                resultados.append(BulkItemResult(index=index, status="erro", erro=f"id duplicado: {e}"))
+                continue
+            if existing:
+                resultados.append(BulkItemResult(index=index, status="duplicada", id=existing))
+            else:
+                resultados.append(BulkItemResult(index=index, status="criada", id=lavagem.id))
+        return resultados
+
+    async def delete(self, wash_id: str) -> Optional[dict]:
+        lavagem = self.lavagens.pop(wash_id, None)
+        if lavagem is not None:
+            self.keys.remove((lavagem["created_at"], wash_id))
+            for matricula in plate_keys(lavagem):
+                self.matriculas.remove((matricula, wash_id))
+            for termo in set(search_terms(lavagem["observacoes"] or "")):
+                self.termos[termo].discard(wash_id)
+            self.idempotency_keys.pop(lavagem["idempotency_key"], None)
+        return lavagem
+
+    def _newest_first(self, after: Optional[PageKey] = None):
+        end = bisect.bisect_left(self.keys, after) if after else len(self.keys)
+        for created_at, wash_id in reversed(self.keys[:end]):
+            yield self.lavagens[wash_id]
+
+    async def list(
+        self, filtro: WashFilter, limit: Optional[int] = None, after: Optional[PageKey] = None
+    ) -> List[dict]:
+        lavagens = []
+        for lavagem in self._newest_first(after):
+            if wash_matches(lavagem, filtro):
+                lavagens.append(public_wash(lavagem))
+                if limit and len(lavagens) == limit:
+                    break
+        return lavagens
+
+    async def plate_hits(self, prefix: str, limit: int) -> List[dict]:
+        ids = set()
+        for matricula, wash_id in self.matriculas[bisect.bisect_left(self.matriculas, (prefix,)):]:
+            if not matricula.startswith(prefix):
+                break
+            ids.add(wash_id)
+        lavagens = sorted((self.lavagens[wash_id] for wash_id in ids), key=_page_key, reverse=True)
+        return [public_wash(lavagem) for lavagem in lavagens[:limit]]
+
+    async def text_hits(self, text: str, limit: int) -> List[dict]:
+        # Relevance: how many of the query's words the observacoes contain
+        scores = Counter()
+        for termo in set(search_terms(text)):
+            scores.update(self.termos.get(termo, ()))
+        ranked = sorted(
+            scores, key=lambda wash_id: (scores[wash_id], _page_key(self.lavagens[wash_id])), reverse=True
+        )
+        return [public_wash(self.lavagens[wash_id]) for wash_id in ranked[:limit]]
+
+    async def stream(
+        self, filtro: WashFilter, batch_size: int = 1000, fields: Optional[List[str]] = None
+    ) -> AsyncIterator[dict]:
+        lavagens = [lavagem for lavagem in self.lavagens.values() if wash_matches(lavagem, filtro)]
+        lavagens.sort(key=lambda lavagem: (lavagem["data_dia"] is not None, lavagem["data_dia"], lavagem["created_at"]))
+        for lavagem in lavagens:
+            yield dict(lavagem)
+
+    async def stats(self, filtro: WashFilter) -> WashStats:
+        total_lavagens = 0
+        total_valor = 0
+        breakdowns = {prefix: Counter() for prefix in [*STATS_DIMENSIONS.values(), "por_lavador"]}
+        for lavagem in self.lavagens.values():
+            if not wash_matches(lavagem, filtro):
+                continue
+            total_lavagens += 1
+            total_valor += lavagem["valor"]
+            for field, prefix in STATS_DIMENSIONS.items():
+                breakdowns[prefix][stat_key(lavagem.get(field))] += 1
+            for lavador in washer_keys(lavagem):
+                breakdowns["por_lavador"][lavador] += 1
+        return WashStats(
+            total_lavagens=total_lavagens,
+            total_valor=round(total_valor, 2),
+            **{prefix: dict(counts) for prefix, counts in breakdowns.items()},
+        )
+
+    async def series_buckets(self, filtro: WashFilter, bucket: str, group_by: Optional[str]) -> SeriesBuckets:
+        totais = {}
+        grupos = {}
+        for lavagem in self.lavagens.values():
+            if lavagem["data_dia"] is None or not wash_matches(lavagem, filtro):
+                continue
+            periodo = bucket_start(lavagem["data_dia"].date(), bucket)
+            _add(totais.setdefault(periodo, SeriesValue()), lavagem)
+            if group_by == "lavador":
+                keys = washer_keys(lavagem)
+            elif group_by:
+                keys = [stat_key(lavagem.get(group_by))]
+            else:
+                keys = []
+            for key in keys:
+                _add(grupos.setdefault(periodo, {}).setdefault(str(key), SeriesValue()), lavagem)
+        return totais, grupos
+
+    async def analytics_rows(
+        self, filtro: WashFilter, group_by: str, top: int, sort: str
+    ) -> Tuple[SeriesValue, List[AnalyticsRow]]:
+        totais = SeriesValue()
+        grupos: Dict[str, list] = {}
+        for lavagem in self.lavagens.values():
+            if not wash_matches(lavagem, filtro):
+                continue
+            _add(totais, lavagem)
+            if group_by == "lavador":
+                # A job shared by n washers credits valor / n to each of them
+                lavadores = washer_keys(lavagem)
+                shares = [(lavador, lavagem["valor"] / len(lavadores)) for lavador in lavadores]
+            else:
+                shares = [(stat_key(lavagem.get(group_by)), lavagem["valor"])]
+            for nome, valor in shares:
+                grupo = grupos.setdefault(nome, [nome, 0, 0.0, 0.0])
+                grupo[1] += 1
+                grupo[2] += valor
+                grupo[3] += lavagem["valor"]
+        column = 2 if sort == "valor" else 1
+        rows = sorted(grupos.values(), key=lambda grupo: (-grupo[column], grupo[0]))
+        return totais, [tuple(grupo) for grupo in rows[:top]]
+
+
+def _page_key(lavagem: dict) -> PageKey:
+    return lavagem["created_at"], lavagem["id"]
+
+
+def _add(total: SeriesValue, lavagem: dict):
+    total.total_lavagens += 1
+    total.total_valor += lavagem["valor"]
+
+
+class MemoryNameRepository:
+    model: type
+
+    def __init__(self):
+        self.entries: Dict[str, dict] = {}
+
+    async def list(self) -> List[dict]:
+        entries = sorted(self.entries.values(), key=lambda entry: entry["nome"].casefold())
+        return [self.model(**entry).model_dump() for entry in entries]
+
+    async def create(self, entry: dict) -> None:
+        nome = entry["nome"].casefold()
+        if any(existing["nome"].casefold() == nome for existing in self.entries.values()):
+            raise DuplicateError(entry["nome"])
+        self.entries[entry["id"]] = dict(entry)
+
+    async def delete(self, entry_id: str) -> bool:
+        return self.entries.pop(entry_id, None) is not None
+
+
+class MemoryWasherRepository(MemoryNameRepository, WasherRepository):
+    model = CustomWasher
+
+
+class MemoryCompanyRepository(MemoryNameRepository, CompanyRepository):
+    model = ExternalCompany
+
+
+class MemoryStatementRepository(StatementRepository):
+    def __init__(self):
+        self.statements: Dict[str, dict] = {}
+
+    async def get(self, statement_id: str) -> Optional[dict]:
+        statement = self.statements.get(statement_id)
+        return dict(statement) if statement else None
+
+    async def list(self, periodo: str) -> List[dict]:
+        statements = sorted(
+            (statement for statement in self.statements.values() if statement["periodo"] == periodo),
+            key=lambda statement: statement["empresa_nome"],
+        )
+        return [{key: statement[key] for key in StatementSummary.model_fields} for statement in statements]
+
+    async def create(self, statement: dict) -> None:
+        if statement["id"] in self.statements:
+            raise DuplicateError(statement["id"])
+        self.statements[statement["id"]] = dict(statement)
+
+
+class MemoryChangeLog(ChangeLog):
+    def __init__(self):
+        self.epoch = uuid.uuid4().hex  # the log starts over with the process
+        self.seq = 0
+        self.entries: deque = deque()
+
+    async def append(self, colecao: str, op: str, docs: List[dict]) -> None:
+        ts = datetime.utcnow()
+        for doc in docs:
+            self.seq += 1
+            self.entries.append({
+                "seq": self.seq, "colecao": colecao, "op": op, "id": doc["id"],
+                "doc": dict(doc), "ts": ts,
+            })
+        while self.entries and self.entries[0]["ts"] < ts - CHANGE_RETENTION:
+            self.entries.popleft()
+
+    async def since(self, seq: int, limit: int) -> List[dict]:
+        # Seqs are contiguous here, so the position is an offset from the oldest
+        start = max(seq + 1 - (self.entries[0]["seq"] if self.entries else 0), 0)
+        return [dict(entry) for entry in list(self.entries)[start:start + limit]]
+
+    async def bounds(self) -> Tuple[int, int]:
+        return (self.entries[0]["seq"] if self.entries else self.seq + 1), self.seq
+
+
+class MemoryStorage(Storage):
+    shared = False
+
+    def __init__(self):
+        self.lavagens = MemoryWashRepository()
+        self.lavadores = MemoryWasherRepository()
+        self.empresas_externas = MemoryCompanyRepository()
+        self.extratos = MemoryStatementRepository()
+        self.changes = MemoryChangeLog()
@@ -0,0 +1,874 @@
+"""
+MongoDB (Motor) storage engine
+"""
+
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import AsyncIterator, List, Optional, Tuple
+import asyncio
+import contextlib
+import logging
+import os
+import re
+import socket
+import uuid
+from time import monotonic
+from urllib.parse import unquote
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from models import (
+    BulkItemResult, CustomWasher, ExternalCompany, SeriesValue, StatementSummary, WashFilter, WashRegistration,
+    WashStats,
+)
+from repositories.base import (
+    CHANGE_RETENTION,
+    STATS_DIMENSIONS,
+    AnalyticsRow,
+    ChangeLog,
+    ChangeStreamUnavailable,
+    CompanyRepository,
+    DuplicateError,
+    PageKey,
+    SeriesBuckets,
+    StatementRepository,
+    Storage,
+    WashRepository,
+    WasherRepository,
+    plate_keys,
+    stat_key,
+    wash_lavadores,
+)
+
+logger = logging.getLogger(__name__)
+
+# Names compare case-insensitively (and accent-sensitively) in Portuguese
+NOME_COLLATION = {"locale": "pt", "strength": 2}
+
+# API workers heartbeat (server.INSTANCE_HEARTBEAT_SECONDS); unseen for this long, they are gone
+INSTANCE_TTL = timedelta(seconds=60)
+
+# Indexes ensured at startup: collection -> [(keys, options)]
+INDEXES = {
+    "lavagens": [
+        ([("id", 1)], {"unique": True}),
+        ([("created_at", -1), ("id", -1)], {}),
+        ([("data", 1), ("created_at", -1), ("id", -1)], {}),
+        ([("data_dia", 1), ("created_at", 1)], {}),
+        # Equality-then-range indexes for the filtered stats engine
+        ([("area_negocio", 1), ("data_dia", 1)], {}),
+        ([("tipo_veiculo", 1), ("data_dia", 1)], {}),
+        ([("empresa_nome", 1), ("data_dia", 1)], {}),
+        ([("lavadores", 1), ("data_dia", 1)], {}),
+        # Search: anchored regexes on the normalised plates are index range
+        # scans; observacoes gets a Portuguese text index
+        ([("matriculas", 1), ("created_at", -1)], {}),
+        ([("observacoes", "text")], {"default_language": "portuguese"}),
+        ([("idempotency_key", 1)], {
+            "unique": True,
+            "partialFilterExpression": {"idempotency_key": {"$type": "string"}},
+        }),
+    ],
+    "lavadores": [
+        ([("id", 1)], {"unique": True}),
+        ([("nome", 1)], {"unique": True, "collation": NOME_COLLATION}),
+    ],
+    "empresas_externas": [
+        ([("id", 1)], {"unique": True}),
+        ([("nome", 1)], {"unique": True, "collation": NOME_COLLATION}),
+    ],
+    "lavagens_daily": [
+        ([("dia", 1)], {}),
+    ],
+    "extratos": [
+        ([("periodo", 1), ("empresa_nome", 1)], {}),
+    ],
+    "instancias": [
+        ([("visto_em", 1)], {"expireAfterSeconds": int(INSTANCE_TTL.total_seconds())}),
+    ],
+    "alteracoes": [
+        ([("seq", 1)], {"unique": True}),
+        ([("ts", 1)], {"expireAfterSeconds": int(CHANGE_RETENTION.total_seconds())}),
+    ],
+}
+
+def wash_document(lavagem: WashRegistration) -> dict:
+    """A wash as stored: the model plus the normalised plates it is searched by."""
+    doc = lavagem.document()
+    doc["matriculas"] = plate_keys(doc)
+    return doc
+
+def date_range_match(from_: Optional[date], to: Optional[date]) -> dict:
+    """Match washes between two days, both inclusive; either bound may be open."""
+    bounds = {}
+    if from_:
+        bounds["$gte"] = datetime.combine(from_, time.min)
+    if to:
+        bounds["$lt"] = datetime.combine(to + timedelta(days=1), time.min)
+    return {"data_dia": bounds} if bounds else {}
+
+def wash_match(filtro: WashFilter) -> dict:
+    # Equality on the dimensions first, then the date (index order)
+    match = filtro.dimensions()
+    if not match and filtro.from_ and filtro.from_ == filtro.to:
+        # A single day is an equality on `data`, served by (data, created_at, id)
+        match["data"] = filtro.from_.isoformat()
+    else:
+        match.update(date_range_match(filtro.from_, filtro.to))
+    return match
+
+def _or_default(field: str, default):
+    # Missing fields take the model default; explicit nulls stay null, as in Pydantic
+    return {"$cond": [{"$eq": [{"$type": f"${field}"}, "missing"]}, default, f"${field}"]}
+
+# Lean read path: MongoDB returns documents already shaped exactly as
+# WashRegistration serialises them, so list endpoints can skip per-document
+# validation. Keep in sync with the WashRegistration fields.
+WASH_PROJECTION = {
+    "_id": 0,
+    "id": 1,
+    "data": 1,
+    "tipo_veiculo": 1,
+    "area_negocio": 1,
+    "lavadores": 1,
+    "tipo_lavagem": 1,
+    "empresa_tipo": 1,
+    "empresa_nome": 1,
+    "matricula_trator": _or_default("matricula_trator", ""),
+    "matricula_reboque": _or_default("matricula_reboque", ""),
+    "valor": {"$toDouble": "$valor"},
+    "observacoes": _or_default("observacoes", ""),
+    "created_at": 1,
+}
+
+# `stream` feeds internal consumers (archive, billing, reports): the stored fields too
+STREAM_PROJECTION = {
+    **WASH_PROJECTION,
+    "data_dia": {"$ifNull": ["$data_dia", {"$dateFromString": {
+        "dateString": "$data", "format": "%Y-%m-%d", "onError": None, "onNull": None,
+    }}]},
+    "idempotency_key": {"$ifNull": ["$idempotency_key", None]},
+}
+
+# Keyset pagination over (created_at, id), newest first
+PAGE_SORT = [("created_at", -1), ("id", -1)]
+
+def after_match(after: PageKey) -> dict:
+    created_at, wash_id = after
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": wash_id}},
+    ]}
+
+# Stats engine
+# Legacy documents stored a single washer as a plain string; normalise it to a
+# one-element list (empty/null becomes "N/A") so $unwind counts it exactly once.
+LAVADORES_AS_LIST = {
+    "$switch": {
+        "branches": [
+            {"case": {"$isArray": "$lavadores"}, "then": "$lavadores"},
+            {"case": {"$eq": [{"$type": "$lavadores"}, "missing"]}, "then": []},
+            {
+                "case": {"$and": ["$lavadores", {"$ne": ["$lavadores", ""]}]},
+                "then": ["$lavadores"],
+            },
+        ],
+        "default": ["N/A"],
+    }
+}
+
+def stat_key_expr(value) -> dict:
+    """stat_key() as an aggregation expression: missing, null and "" become "N/A"."""
+    return {"$let": {
+        "vars": {"value": {"$ifNull": [value, ""]}},
+        "in": {"$cond": [{"$eq": ["$$value", ""]}, "N/A", "$$value"]},
+    }}
+
+def _count_by(field: str) -> list:
+    return [
+        {"$group": {"_id": stat_key_expr(f"${field}"), "count": {"$sum": 1}}},
+    ]
+
+# Every WashStats breakdown of the documents entering the $facet
+STATS_FACETS = {
+    "totais": [
+        {"$group": {
+            "_id": None,
+            "total_lavagens": {"$sum": 1},
+            "total_valor": {"$sum": "$valor"},
+        }},
+    ],
+    "por_tipo_veiculo": _count_by("tipo_veiculo"),
+    "por_area_negocio": _count_by("area_negocio"),
+    "por_lavador": [
+        {"$project": {"lavadores": LAVADORES_AS_LIST}},
+        {"$unwind": "$lavadores"},
+        {"$group": {"_id": stat_key_expr("$lavadores"), "count": {"$sum": 1}}},
+    ],
+    "por_tipo_lavagem": _count_by("tipo_lavagem"),
+}
+
+def build_stats_pipeline(match: dict) -> list:
+    """Aggregation returning a single document with every WashStats breakdown."""
+    return [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "valor": 1,
+            "tipo_veiculo": 1,
+            "area_negocio": 1,
+            "tipo_lavagem": 1,
+            "lavadores": 1,
+        }},
+        {"$facet": STATS_FACETS},
+    ]
+
+def build_dashboard_pipeline(match: dict, limit: int, after: Optional[PageKey]) -> list:
+    """One page of washes (as `list` returns it) and the WashStats of the whole match, in one round trip."""
+    items = [{"$match": after_match(after)}] if after else []
+    items += [{"$sort": dict(PAGE_SORT)}, {"$limit": limit}, {"$project": WASH_PROJECTION}]
+    return [
+        {"$match": match},
+        {"$facet": {"items": items, **STATS_FACETS}},
+    ]
+
+def stats_from_facets(facets: dict) -> WashStats:
+    totais = facets.get("totais") or [{}]
+
+    def counts(name: str) -> dict:
+        return {row["_id"]: row["count"] for row in facets.get(name, [])}
+
+    return WashStats(
+        total_lavagens=totais[0].get("total_lavagens", 0),
+        total_valor=totais[0].get("total_valor", 0),
+        por_tipo_veiculo=counts("por_tipo_veiculo"),
+        por_area_negocio=counts("por_area_negocio"),
+        por_lavador=counts("por_lavador"),
+        por_tipo_lavagem=counts("por_tipo_lavagem"),
+    )
+
+# Daily rollups
+# One lavagens_daily document per `data` day holds that day's WashStats counters,
+# kept current with $inc on every write so reports never rescan raw washes.
+ROLLUP_DIMENSIONS = STATS_DIMENSIONS
+# Rollups found out of date fall back to the pipeline; look again this often.
+# Without transactions a wash and its $inc are two writes that can be split by
+# a crash, so rollups found in step are also rechecked this often for drift.
+ROLLUP_RECHECK_SECONDS = 300
+
+
+class MaintenanceConflict(Exception):
+    """An API worker is running, so its writes would race the maintenance task."""
+
+def _rollup_key(value) -> str:
+    # Counter names become field paths: normalise like the pipeline (stat_key, so
+    # never "", which is not a valid path) and percent-escape "%", "." and "$",
+    # undone with unquote.
+    return str(stat_key(value)).replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+def rollup_increments(lavagem: dict, sign: int = 1) -> dict:
+    valor = lavagem.get("valor", 0)
+    inc = Counter({
+        "total_lavagens": sign,
+        "total_valor": sign * valor if isinstance(valor, (int, float)) else 0,
+    })
+    for field, prefix in ROLLUP_DIMENSIONS.items():
+        inc[f"{prefix}.{_rollup_key(lavagem.get(field))}"] += sign
+    for lavador in wash_lavadores(lavagem):
+        inc[f"por_lavador.{_rollup_key(lavador)}"] += sign
+    return dict(inc)
+
+def rollup_operations(lavagens: List[dict], sign: int = 1) -> List[UpdateOne]:
+    """One upsert per day touched by `lavagens`."""
+    days = {}
+    for lavagem in lavagens:
+        inc = days.setdefault(lavagem["data"], (Counter(), lavagem.get("data_dia")))[0]
+        inc.update(rollup_increments(lavagem, sign))
+    return [
+        UpdateOne({"_id": data}, {"$inc": dict(inc), "$setOnInsert": {"dia": data_dia}}, upsert=True)
+        for data, (inc, data_dia) in days.items()
+    ]
+
+# Time series
+def build_series_pipeline(match: dict, bucket: str, group_by: Optional[str]) -> list:
+    periodo = {"$dateTrunc": {"date": "$data_dia", "unit": bucket}}
+    if bucket == "week":
+        periodo["$dateTrunc"]["startOfWeek"] = "monday"
+    totals = {"total_lavagens": {"$sum": 1}, "total_valor": {"$sum": "$valor"}}
+    facets = {"totais": [{"$group": {"_id": periodo, **totals}}]}
+    if group_by == "lavador":
+        # Each washer on a job is credited with the job's full valor
+        facets["grupos"] = [
+            {"$project": {"data_dia": 1, "valor": 1, "lavadores": LAVADORES_AS_LIST}},
+            {"$unwind": "$lavadores"},
+            {"$group": {"_id": {"periodo": periodo, "grupo": stat_key_expr("$lavadores")}, **totals}},
+        ]
+    elif group_by:
+        facets["grupos"] = [
+            {"$group": {"_id": {"periodo": periodo, "grupo": stat_key_expr(f"${group_by}")}, **totals}},
+        ]
+    return [
+        {"$match": {**match, "data_dia": {"$ne": None, **match.get("data_dia", {})}}},
+        {"$facet": facets},
+    ]
+
+# Revenue attribution
+def build_analytics_pipeline(match: dict, group_by: str, top: int, sort: str) -> list:
+    sums = {"lavagens": {"$sum": 1}}
+    if group_by == "lavador":
+        # A job shared by n washers credits valor / n to each of them
+        grupos = [
+            {"$project": {"valor": 1, "lavadores": LAVADORES_AS_LIST}},
+            {"$addFields": {"partes": {"$size": "$lavadores"}}},
+            {"$unwind": "$lavadores"},
+            {"$group": {
+                "_id": stat_key_expr("$lavadores"),
+                **sums,
+                "valor": {"$sum": {"$divide": ["$valor", "$partes"]}},
+                "valor_trabalhos": {"$sum": "$valor"},
+            }},
+        ]
+    else:
+        grupos = [
+            {"$group": {"_id": stat_key_expr(f"${group_by}"), **sums, "valor": {"$sum": "$valor"}}},
+            {"$addFields": {"valor_trabalhos": "$valor"}},
+        ]
+    grupos += [{"$sort": {sort: -1, "_id": 1}}, {"$limit": top}]
+    return [
+        {"$match": match},
+        {"$facet": {"totais": STATS_FACETS["totais"], "grupos": grupos}},
+    ]
+
+
+class MongoWashRepository(WashRepository):
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.lavagens
+        self.rollups_ready = False
+        self.rollups_checked_at = None
+        # Set at startup when the deployment (replica set or sharded) has transactions
+        self.transactions = False
+
+    @contextlib.asynccontextmanager
+    async def write_session(self):
+        """A session in a transaction, so a wash and its rollup $inc commit
+        together; None (separate writes) where transactions are unavailable."""
+        if not self.transactions:
+            yield None
+            return
+        async with await self.db.client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+
+    async def create(self, lavagem: WashRegistration) -> WashRegistration:
+        try:
+            async with self.write_session() as session:
+                await self.collection.insert_one(wash_document(lavagem), session=session)
+                await self.apply_rollups([lavagem.document()], session=session)
+        except DuplicateKeyError:
+            # Replayed idempotency key: hand back the wash created the first time.
+            # Without a key the duplicate is something else (e.g. the id): never
+            # look up by a None key, which would match any keyless wash
+            if not lavagem.idempotency_key:
+                raise
+            existing = await self.collection.find_one({"idempotency_key": lavagem.idempotency_key})
+            if existing is None:
+                raise
+            return WashRegistration(**existing)
+        return lavagem
+
+    async def create_many(self, lavagens: List[WashRegistration]) -> List[BulkItemResult]:
+        docs = [wash_document(lavagem) for lavagem in lavagens]
+        # Unordered: one round trip, and a failing document does not stop the rest
+        write_errors = {}
+        pending = list(range(len(docs)))
+        while pending:
+            try:
+                async with self.write_session() as session:
+                    await self.collection.insert_many([docs[i] for i in pending], ordered=False, session=session)
+                    await self.apply_rollups([docs[i] for i in pending], session=session)
+                break
+            except BulkWriteError as e:
+                failed = {pending[err["index"]]: err for err in e.details["writeErrors"]}
+                write_errors.update(failed)
+                pending = [i for i in pending if i not in failed]
+                if not self.transactions:
+                    # The others were written; count them alone
+                    await self.apply_rollups([docs[i] for i in pending])
+                    break
+                # The transaction was rolled back: write the others again without the failures
+
+        # Duplicate idempotency keys resolve to the wash that already holds them
+        duplicate_keys = [
+            docs[i]["idempotency_key"] for i, err in write_errors.items()
+            if err["code"] == 11000 and docs[i]["idempotency_key"]
+        ]
+        existing = {}
+        if duplicate_keys:
+            async for lavagem in self.collection.find(
+                {"idempotency_key": {"$in": duplicate_keys}}, {"_id": 0, "id": 1, "idempotency_key": 1}
+            ):
+                existing[lavagem["idempotency_key"]] = lavagem["id"]
+
+        resultados = []
+        for index, doc in enumerate(docs):
+            err = write_errors.get(index)
+            if err is None:
+                resultados.append(BulkItemResult(index=index, status="criada", id=doc["id"]))
+            elif doc["idempotency_key"] in existing:
+                resultados.append(BulkItemResult(index=index, status="duplicada", id=existing[doc["idempotency_key"]]))
+            else:
+                resultados.append(BulkItemResult(index=index, status="erro", erro=err.get("errmsg")))
+        return resultados
+
+    async def delete(self, wash_id: str) -> Optional[dict]:
+        async with self.write_session() as session:
+            lavagem = await self.collection.find_one_and_delete({"id": wash_id}, {"_id": 0}, session=session)
+            if lavagem is not None:
+                await self.apply_rollups([lavagem], -1, session=session)
+        return lavagem
+
+    async def delete_many(self, wash_ids: List[str]) -> int:
+        async with self.write_session() as session:
+            lavagens = await self.collection.find({"id": {"$in": wash_ids}}, {"_id": 0}, session=session).to_list(None)
+            result = await self.collection.delete_many(
+                {"id": {"$in": [lavagem["id"] for lavagem in lavagens]}}, session=session
+            )
+            await self.apply_rollups(lavagens, -1, session=session)
+        return result.deleted_count
+
+    async def list(
+        self, filtro: WashFilter, limit: Optional[int] = None, after: Optional[PageKey] = None
+    ) -> List[dict]:
+        match = wash_match(filtro)
+        if after:
+            match = {"$and": [match, after_match(after)]}
+        cursor = self.collection.find(match, WASH_PROJECTION).sort(PAGE_SORT)
+        if limit:
+            cursor = cursor.limit(limit)
+        return await cursor.to_list(limit)
+
+    async def stream(
+        self, filtro: WashFilter, batch_size: int = 1000, fields: Optional[List[str]] = None
+    ) -> AsyncIterator[dict]:
+        projection = STREAM_PROJECTION
+        if fields:
+            projection = {key: STREAM_PROJECTION[key] for key in ["_id", "data_dia", "created_at", *fields]}
+        cursor = self.collection.find(
+            wash_match(filtro), projection, batch_size=batch_size
+        ).sort([("data_dia", 1), ("created_at", 1)])
+        async for lavagem in cursor:
+            yield lavagem
+
+    async def plate_hits(self, prefix: str, limit: int) -> List[dict]:
+        cursor = self.collection.find(
+            {"matriculas": {"$regex": f"^{re.escape(prefix)}"}}, WASH_PROJECTION
+        ).sort(PAGE_SORT).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def text_hits(self, text: str, limit: int) -> List[dict]:
+        score = {"$meta": "textScore"}
+        cursor = self.collection.find(
+            {"$text": {"$search": text}}, {**WASH_PROJECTION, "score": score}
+        ).sort([("score", score), *PAGE_SORT]).limit(limit)
+        lavagens = await cursor.to_list(limit)
+        for lavagem in lavagens:
+            del lavagem["score"]
+        return lavagens
+
+    async def stats(self, filtro: WashFilter) -> WashStats:
+        """Pure date ranges come from the daily rollups; any dimension filter
+        falls back to the aggregation pipeline over the indexed raw washes."""
+        if filtro.dimensions() or not await self.rollups_usable():
+            result = await self.collection.aggregate(build_stats_pipeline(wash_match(filtro))).to_list(1)
+            return stats_from_facets(result[0] if result else {})
+        dia = date_range_match(filtro.from_, filtro.to).get("data_dia")
+        return await self.rollup_stats({"dia": dia} if dia else {})
+
+    async def dashboard(
+        self, filtro: WashFilter, limit: int, after: Optional[PageKey] = None, with_stats: bool = True
+    ) -> Tuple[List[dict], Optional[WashStats]]:
+        """Bounded or filtered views run as a single $facet over the matched
+        washes. Unfiltered all-time views keep the indexed page plus the daily
+        rollups: a facet would rescan the whole collection for the stats."""
+        if not with_stats or not (filtro.dimensions() or (filtro.from_ and filtro.to)):
+            return await super().dashboard(filtro, limit, after, with_stats)
+        pipeline = build_dashboard_pipeline(wash_match(filtro), limit, after)
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        facets = result[0] if result else {}
+        return facets.pop("items", []), stats_from_facets(facets)
+
+    async def series_buckets(self, filtro: WashFilter, bucket: str, group_by: Optional[str]) -> SeriesBuckets:
+        pipeline = build_series_pipeline(wash_match(filtro), bucket, group_by)
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        facets = result[0] if result else {}
+        totais = {
+            row["_id"].date(): SeriesValue(total_lavagens=row["total_lavagens"], total_valor=row["total_valor"])
+            for row in facets.get("totais", [])
+        }
+        grupos = {}
+        for row in facets.get("grupos", []):
+            grupos.setdefault(row["_id"]["periodo"].date(), {})[str(row["_id"]["grupo"])] = SeriesValue(
+                total_lavagens=row["total_lavagens"], total_valor=row["total_valor"]
+            )
+        return totais, grupos
+
+    async def analytics_rows(
+        self, filtro: WashFilter, group_by: str, top: int, sort: str
+    ) -> Tuple[SeriesValue, List[AnalyticsRow]]:
+        pipeline = build_analytics_pipeline(wash_match(filtro), group_by, top, sort)
+        result = await self.collection.aggregate(pipeline).to_list(1)
+        facets = result[0] if result else {}
+        totais = (facets.get("totais") or [{}])[0]
+        return (
+            SeriesValue(total_lavagens=totais.get("total_lavagens", 0), total_valor=totais.get("total_valor", 0)),
+            [(row["_id"], row["lavagens"], row["valor"], row["valor_trabalhos"]) for row in facets.get("grupos", [])],
+        )
+
+    # Daily rollups
+    async def check_rollups(self) -> Tuple[int, int]:
+        """(washes counted by the rollups, washes stored); they differ when the
+        rollups are missing (e.g. an upgraded deployment) or out of date."""
+        result = await self.db.lavagens_daily.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$total_lavagens"}}},
+        ]).to_list(1)
+        counted = result[0]["total"] if result else 0
+        stored = await self.collection.count_documents({})
+        if self.rollups_ready and counted != stored:
+            logger.warning(
+                "Daily rollups drifted (%d counted, %d stored); date-range stats use the aggregation"
+                " pipeline until `python manage.py rebuild-rollups` is run with the API stopped", counted, stored,
+            )
+        self.rollups_ready = counted == stored
+        self.rollups_checked_at = monotonic()
+        return counted, stored
+
+    async def rollups_usable(self) -> bool:
+        # Transactions keep rollups in step once they are; otherwise keep checking
+        recheck = not self.rollups_ready or not self.transactions
+        if recheck and (
+            self.rollups_checked_at is None or monotonic() - self.rollups_checked_at >= ROLLUP_RECHECK_SECONDS
+        ):
+            await self.check_rollups()
+        return self.rollups_ready
+
+    async def apply_rollups(self, lavagens: List[dict], sign: int = 1, session=None):
+        operations = rollup_operations(lavagens, sign)
+        if operations:
+            await self.db.lavagens_daily.bulk_write(operations, ordered=False, session=session)
+
+    async def rollup_stats(self, match: dict) -> WashStats:
+        """Merge the daily rollups selected by `match` into a single WashStats."""
+        total_lavagens = 0
+        total_valor = 0
+        breakdowns = {prefix: Counter() for prefix in [*ROLLUP_DIMENSIONS.values(), "por_lavador"]}
+        async for dia in self.db.lavagens_daily.find(match, {"dia": 0}):
+            total_lavagens += dia.get("total_lavagens", 0)
+            total_valor += dia.get("total_valor", 0)
+            for prefix, counts in breakdowns.items():
+                for key, count in dia.get(prefix, {}).items():
+                    counts[unquote(key)] += count
+        # Deletes leave zeroed counters behind; drop them like the raw pipeline would
+        breakdowns = {prefix: {k: v for k, v in counts.items() if v > 0} for prefix, counts in breakdowns.items()}
+        return WashStats(total_lavagens=total_lavagens, total_valor=round(total_valor, 2), **breakdowns)
+
+    async def api_running(self) -> bool:
+        return await self.db.instancias.find_one({"visto_em": {"$gt": datetime.utcnow() - INSTANCE_TTL}}) is not None
+
+    async def rebuild_rollups(self, batch_size: int = 1000) -> int:
+        """Recompute lavagens_daily from scratch; returns the number of days.
+
+        The API's $inc on the live rollups would be lost in the swap, so this
+        refuses to run (MaintenanceConflict) while any API worker is up.
+        """
+        if await self.api_running():
+            raise MaintenanceConflict("stop the API before rebuilding the rollups")
+        # Build into a scratch collection and swap it in, so stats never read a
+        # half-built rollup
+        target = self.db.lavagens_daily_rebuild
+        await target.drop()
+        for keys, options in INDEXES["lavagens_daily"]:
+            await target.create_index(keys, **options)
+
+        days = {}
+        dias = {}
+        cursor = self.collection.find(
+            {},
+            {"_id": 0, "data": 1, "data_dia": 1, "valor": 1, "lavadores": 1,
+             "tipo_veiculo": 1, "area_negocio": 1, "tipo_lavagem": 1},
+            batch_size=batch_size,
+        )
+        async for lavagem in cursor:
+            days.setdefault(lavagem["data"], Counter()).update(rollup_increments(lavagem))
+            dias.setdefault(lavagem["data"], lavagem.get("data_dia"))
+
+        operations = [
+            UpdateOne({"_id": data}, {"$inc": dict(inc), "$setOnInsert": {"dia": dias[data]}}, upsert=True)
+            for data, inc in days.items()
+        ]
+        for start in range(0, len(operations), batch_size):
+            await target.bulk_write(operations[start:start + batch_size], ordered=False)
+        if await self.api_running():
+            # A worker started meanwhile and may have written: the scan may be stale
+            await target.drop()
+            raise MaintenanceConflict("an API worker started during the rebuild; stop it and run again")
+        if operations:
+            await target.rename("lavagens_daily", dropTarget=True)
+        else:
+            await self.db.lavagens_daily.delete_many({})
+        return len(operations)
+
+
+class MongoNameRepository:
+    collection_name: str
+    model: type
+
+    def __init__(self, db):
+        self.collection = db[self.collection_name]
+
+    async def list(self) -> List[dict]:
+        entries = await self.collection.find(collation=NOME_COLLATION).sort("nome", 1).to_list(1000)
+        return [self.model(**entry).model_dump() for entry in entries]
+
+    async def create(self, entry: dict) -> None:
+        try:
+            await self.collection.insert_one(dict(entry))
+        except DuplicateKeyError:
+            raise DuplicateError(entry["nome"])
+
+    async def delete(self, entry_id: str) -> bool:
+        result = await self.collection.delete_one({"id": entry_id})
+        return result.deleted_count > 0
+
+
+class MongoWasherRepository(MongoNameRepository, WasherRepository):
+    collection_name = "lavadores"
+    model = CustomWasher
+
+
+class MongoCompanyRepository(MongoNameRepository, CompanyRepository):
+    collection_name = "empresas_externas"
+    model = ExternalCompany
+
+
+class MongoStatementRepository(StatementRepository):
+    def __init__(self, db):
+        self.collection = db.extratos
+
+    async def get(self, statement_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": statement_id}, {"_id": 0})
+
+    async def list(self, periodo: str) -> List[dict]:
+        projection = {"_id": 0, **{field: 1 for field in StatementSummary.model_fields}}
+        return await self.collection.find({"periodo": periodo}, projection).sort("empresa_nome", 1).to_list(None)
+
+    async def create(self, statement: dict) -> None:
+        try:
+            await self.collection.insert_one({"_id": statement["id"], **statement})
+        except DuplicateKeyError:
+            raise DuplicateError(statement["id"])
+
+
+class MongoChangeLog(ChangeLog):
+    """Seqs come from a counter document, so concurrent writers (other
+    workers included) never share one. An entry can become visible after a
+    later one, which is why readers go through `settled_changes`."""
+
+    def __init__(self, db):
+        self.db = db
+        self.collection = db.alteracoes
+        self.epoch = ""
+
+    async def start(self):
+        try:
+            await self.db.contadores.update_one(
+                {"_id": "alteracoes"}, {"$setOnInsert": {"seq": 0, "epoch": uuid.uuid4().hex}}, upsert=True
+            )
+        except DuplicateKeyError:
+            pass  # another worker created it first
+        counter = await self.db.contadores.find_one({"_id": "alteracoes"})
+        self.epoch = counter["epoch"]
+
+    async def append(self, colecao: str, op: str, docs: List[dict]) -> None:
+        if not docs:
+            return
+        now = datetime.utcnow()
+        # Reserve len(docs) seqs in one round trip
+        counter = await self.db.contadores.find_one_and_update(
+            {"_id": "alteracoes"}, {"$inc": {"seq": len(docs)}}, return_document=ReturnDocument.AFTER
+        )
+        first = counter["seq"] - len(docs) + 1
+        await self.collection.insert_many([
+            {
+                "seq": first + offset, "colecao": colecao, "op": op, "id": doc["id"],
+                "doc": doc,
+                "ts": now,
+            }
+            for offset, doc in enumerate(docs)
+        ])
+
+    async def since(self, seq: int, limit: int) -> List[dict]:
+        cursor = self.collection.find({"seq": {"$gt": seq}}, {"_id": 0}).sort("seq", 1).limit(limit)
+        return await cursor.to_list(limit)
+
+    async def bounds(self) -> Tuple[int, int]:
+        counter = await self.db.contadores.find_one({"_id": "alteracoes"})
+        oldest = await self.collection.find_one({}, {"_id": 0, "seq": 1}, sort=[("seq", 1)])
+        last = counter["seq"] if counter else 0
+        return (oldest["seq"] if oldest else last + 1), last
+
+
+# Change stream over the API's collections, shared by every worker
+WATCHED_COLLECTIONS = ["lavagens", "lavadores", "empresas_externas"]
+WATCH_PIPELINE = [{"$match": {"ns.coll": {"$in": WATCHED_COLLECTIONS}, "operationType": {"$in": ["insert", "delete"]}}}]
+# Not a replica set / server too old for pre-images
+CHANGE_STREAM_UNSUPPORTED = {40573, 40415}
+CHANGE_STREAM_HISTORY_LOST = 286
+# An older resume token is not worth replaying: a restarted worker has nothing cached yet
+RESUME_TOKEN_MAX_AGE = timedelta(minutes=10)
+
+
+def client_options_from_env() -> dict:
+    """Motor client settings, overridable per deployment through MONGO_* variables."""
+    env = os.environ.get
+    return {
+        "maxPoolSize": int(env("MONGO_MAX_POOL_SIZE", "100")),
+        "minPoolSize": int(env("MONGO_MIN_POOL_SIZE", "10")),
+        # Compressors whose module is missing (zstandard, python-snappy) are
+        # skipped by the driver with a warning; zlib is always available
+        "compressors": env("MONGO_COMPRESSORS", "zstd,snappy,zlib"),
+        "serverSelectionTimeoutMS": int(env("MONGO_SERVER_SELECTION_TIMEOUT_MS", "5000")),
+        "connectTimeoutMS": int(env("MONGO_CONNECT_TIMEOUT_MS", "5000")),
+        "socketTimeoutMS": int(env("MONGO_SOCKET_TIMEOUT_MS", "30000")),
+        # Client-side operation timeout: the driver also sends it as maxTimeMS
+        # on every command, so the server abandons runaway queries too
+        "timeoutMS": int(env("MONGO_TIMEOUT_MS", "15000")),
+    }
+
+
+def _stored_key(keys: list) -> list:
+    # Text indexes are reported under their internal key, not the indexed fields
+    if any(direction == "text" for _, direction in keys):
+        return [("_fts", "text"), ("_ftsx", 1)]
+    return keys
+
+
+class MongoStorage(Storage):
+    def __init__(self, mongo_url: str, db_name: str, **client_options):
+        self.client = AsyncIOMotorClient(mongo_url, **client_options)
+        self.db = self.client[db_name]
+        self.warm_connections = client_options.get("minPoolSize", 0)
+        self.lavagens = MongoWashRepository(self.db)
+        self.lavadores = MongoWasherRepository(self.db)
+        self.empresas_externas = MongoCompanyRepository(self.db)
+        self.extratos = MongoStatementRepository(self.db)
+        self.changes = MongoChangeLog(self.db)
+
+    async def start(self):
+        await self.warm_up()
+        self.lavagens.transactions = await self.supports_transactions()
+        await self.ensure_indexes()
+        await self.enable_pre_images()
+        await self.changes.start()
+        missing = await self.missing_indexes()
+        if missing:
+            logger.warning("Serving without indexes: %s", ", ".join(missing))
+        counted, stored = await self.lavagens.check_rollups()
+        if counted != stored:
+            logger.warning(
+                "Daily rollups count %d of %d washes; date-range stats use the aggregation pipeline"
+                " until `python manage.py rebuild-rollups` is run with the API stopped", counted, stored,
+            )
+
+    async def warm_up(self):
+        """Open the minimum pool now, so the first requests skip connection setup."""
+        # Concurrent pings each need their own connection
+        await asyncio.gather(*(self.db.command("ping") for _ in range(max(self.warm_connections, 1))))
+
+    async def ping(self) -> bool:
+        await self.db.command("ping")
+        return True
+
+    async def supports_transactions(self) -> bool:
+        """Replica sets and sharded clusters have multi-document transactions;
+        a standalone server does not."""
+        hello = await self.db.command("hello")
+        return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+    async def enable_pre_images(self):
+        """Let change streams carry deleted washes (MongoDB 6.0+)."""
+        try:
+            await self.db.command("collMod", "lavagens", changeStreamPreAndPostImages={"enabled": True})
+        except OperationFailure as e:
+            logger.info("Change stream pre-images unavailable, deletes will resync live dashboards: %s", e)
+
+    async def watch(self, resume_token=None) -> AsyncIterator[dict]:
+        while True:
+            try:
+                async with self.db.watch(
+                    WATCH_PIPELINE, resume_after=resume_token, full_document_before_change="whenAvailable"
+                ) as stream:
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        doc = change.get("fullDocument") or change.get("fullDocumentBeforeChange")
+                        if doc is not None:
+                            doc = {key: value for key, value in doc.items() if key not in ("_id", "matriculas")}
+                        yield {
+                            "colecao": change["ns"]["coll"],
+                            "op": change["operationType"],
+                            "id": doc["id"] if doc else None,
+                            "doc": doc,
+                            "token": resume_token,
+                        }
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAM_UNSUPPORTED:
+                    raise ChangeStreamUnavailable(str(e)) from e
+                if e.code != CHANGE_STREAM_HISTORY_LOST or resume_token is None:
+                    raise
+                # The oplog moved past our token: start from now and say so
+                resume_token = None
+                yield {"colecao": None, "op": "resync", "id": None, "doc": None, "token": None}
+
+    async def load_resume_token(self):
+        saved = await self.db.change_streams.find_one({"_id": "api"})
+        if saved and saved["updated_at"] > datetime.utcnow() - RESUME_TOKEN_MAX_AGE:
+            return saved["token"]
+        return None
+
+    async def save_resume_token(self, token):
+        await self.db.change_streams.update_one(
+            {"_id": "api"}, {"$set": {"token": token, "updated_at": datetime.utcnow()}}, upsert=True
+        )
+
+    async def heartbeat(self, instance: str):
+        await self.db.instancias.update_one(
+            {"_id": instance},
+            {"$set": {"visto_em": datetime.utcnow(), "host": socket.gethostname(), "pid": os.getpid()}},
+            upsert=True,
+        )
+
+    async def retire(self, instance: str):
+        await self.db.instancias.delete_one({"_id": instance})
+
+    async def ensure_indexes(self):
+        for collection, indexes in INDEXES.items():
+            for keys, options in indexes:
+                try:
+                    await self.db[collection].create_index(keys, **options)
+                except OperationFailure as e:
+                    # e.g. existing duplicates block a unique index; keep serving
+                    logger.error("Could not create index %s on %s: %s", keys, collection, e)
+
+    async def missing_indexes(self) -> List[str]:
+        missing = []
+        for collection, indexes in INDEXES.items():
+            existing = [index["key"] for index in (await self.db[collection].index_information()).values()]
+            for keys, options in indexes:
+                if _stored_key(keys) not in existing:
+                    missing.append(f"{collection}({', '.join(field for field, _ in keys)})")
+        return missing
+
+    async def close(self):
+        self.client.close()
@@ -0,0 +1,569 @@
+"""
+SQLite storage engine (aiosqlite)
+
+A single-file alternative to MongoDB for small installations. Washers are
+stored as a JSON array and filtered through json_each; dates are ISO strings,
+which sort and compare correctly as text.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import json
+import sqlite3
+import uuid
+from datetime import date, datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+import aiosqlite
+
+from models import (
+    BulkItemResult, CustomWasher, ExternalCompany, SeriesValue, StatementSummary, WashFilter, WashRegistration,
+    WashStats, public_wash,
+)
+from repositories.base import (
+    CHANGE_RETENTION,
+    STATS_DIMENSIONS,
+    AnalyticsRow,
+    ChangeLog,
+    CompanyRepository,
+    DuplicateError,
+    PageKey,
+    SeriesBuckets,
+    StatementRepository,
+    Storage,
+    WashRepository,
+    WasherRepository,
+    plate_keys,
+    search_terms,
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS lavagens (
+    id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    tipo_veiculo TEXT,
+    area_negocio TEXT,
+    lavadores TEXT NOT NULL,
+    tipo_lavagem TEXT,
+    empresa_tipo TEXT,
+    empresa_nome TEXT,
+    matricula_trator TEXT,
+    matricula_reboque TEXT,
+    valor REAL NOT NULL,
+    observacoes TEXT,
+    created_at TEXT NOT NULL,
+    data_dia TEXT,
+    idempotency_key TEXT UNIQUE
+);
+CREATE INDEX IF NOT EXISTS lavagens_created_at ON lavagens (created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS lavagens_data_dia ON lavagens (data_dia, created_at);
+CREATE INDEX IF NOT EXISTS lavagens_area_negocio ON lavagens (area_negocio, data_dia);
+CREATE INDEX IF NOT EXISTS lavagens_tipo_veiculo ON lavagens (tipo_veiculo, data_dia);
+CREATE INDEX IF NOT EXISTS lavagens_empresa_nome ON lavagens (empresa_nome, data_dia);
+CREATE TABLE IF NOT EXISTS lavadores (
+    id TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    nome_chave TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS empresas_externas (
+    id TEXT PRIMARY KEY,
+    nome TEXT NOT NULL,
+    nome_chave TEXT NOT NULL UNIQUE,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS extratos (
+    id TEXT PRIMARY KEY,
+    periodo TEXT NOT NULL,
+    empresa_nome TEXT NOT NULL,
+    resumo TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS extratos_periodo ON extratos (periodo, empresa_nome);
+"""
+
+# Search: normalised plates (written alongside each wash) and a full-text index
+# of observacoes kept in step by triggers. The index carries created_at so hits
+# are ranked without joining every match back to lavagens.
+SEARCH_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lavagens_matriculas (
+    matricula TEXT NOT NULL,
+    id TEXT NOT NULL,
+    PRIMARY KEY (matricula, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lavagens_matriculas_id ON lavagens_matriculas (id);
+CREATE VIRTUAL TABLE IF NOT EXISTS lavagens_fts USING fts5(
+    id UNINDEXED, created_at UNINDEXED, observacoes, tokenize = 'unicode61 remove_diacritics 2'
+);
+-- FTS5 cannot index `id`; this maps it to the FTS rowid so deletes are lookups
+CREATE TABLE IF NOT EXISTS lavagens_fts_ids (
+    id TEXT PRIMARY KEY,
+    fts_rowid INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS lavagens_fts_insert AFTER INSERT ON lavagens BEGIN
+    INSERT INTO lavagens_fts (id, created_at, observacoes) VALUES (new.id, new.created_at, new.observacoes);
+    INSERT INTO lavagens_fts_ids (id, fts_rowid) VALUES (new.id, last_insert_rowid());
+END;
+CREATE TRIGGER IF NOT EXISTS lavagens_fts_delete AFTER DELETE ON lavagens BEGIN
+    DELETE FROM lavagens_fts WHERE rowid = (SELECT fts_rowid FROM lavagens_fts_ids WHERE id = old.id);
+    DELETE FROM lavagens_fts_ids WHERE id = old.id;
+END;
+"""
+
+# Change log for /api/sync; AUTOINCREMENT never reuses a seq, even after pruning
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alteracoes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    colecao TEXT NOT NULL,
+    op TEXT NOT NULL,
+    id TEXT NOT NULL,
+    doc TEXT,
+    ts TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS alteracoes_ts ON alteracoes (ts);
+CREATE TABLE IF NOT EXISTS alteracoes_epoch (epoch TEXT NOT NULL);
+"""
+
+COLUMNS = [
+    "id", "data", "tipo_veiculo", "area_negocio", "lavadores", "tipo_lavagem",
+    "empresa_tipo", "empresa_nome", "matricula_trator", "matricula_reboque",
+    "valor", "observacoes", "created_at", "data_dia", "idempotency_key",
+]
+INSERT_WASH = "INSERT INTO lavagens ({}) VALUES ({})".format(", ".join(COLUMNS), ", ".join("?" * len(COLUMNS)))
+SELECT_WASH = "SELECT {} FROM lavagens".format(", ".join(COLUMNS))
+SEARCH_TEXT = (
+    "SELECT {} FROM lavagens JOIN ("
+    "SELECT id, created_at, rank FROM lavagens_fts WHERE lavagens_fts MATCH ?"
+    " ORDER BY rank, created_at DESC, id DESC LIMIT ?"
+    ") AS hits ON lavagens.id = hits.id ORDER BY hits.rank, hits.created_at DESC, hits.id DESC"
+).format(", ".join(f"lavagens.{column}" for column in COLUMNS))
+
+# Bucket start per series bucket; weeks start on Monday like bucket_start()
+PERIODOS = {
+    "day": "data_dia",
+    "week": "date(data_dia, '-' || ((CAST(strftime('%w', data_dia) AS INTEGER) + 6) % 7) || ' days')",
+    "month": "date(data_dia, 'start of month')",
+}
+
+# Breakdown keys: missing and empty values count as "N/A", like stat_key()
+LAVADOR_KEY = "COALESCE(NULLIF(lavador.value, ''), 'N/A')"
+
+
+def _timestamp(value: datetime) -> str:
+    # Fixed width, so text order is chronological order
+    return value.isoformat(timespec="microseconds")
+
+
+def to_row(lavagem: WashRegistration) -> tuple:
+    doc = lavagem.document()
+    doc["lavadores"] = json.dumps(doc["lavadores"], ensure_ascii=False)
+    doc["created_at"] = _timestamp(doc["created_at"])
+    doc["data_dia"] = doc["data_dia"].date().isoformat() if doc["data_dia"] else None
+    return tuple(doc[column] for column in COLUMNS)
+
+
+def from_row(row: tuple) -> dict:
+    doc = dict(zip(COLUMNS, row))
+    doc["lavadores"] = json.loads(doc["lavadores"])
+    doc["created_at"] = datetime.fromisoformat(doc["created_at"])
+    doc["data_dia"] = datetime.fromisoformat(doc["data_dia"]) if doc["data_dia"] else None
+    return doc
+
+
+def where(filtro: WashFilter, after: Optional[PageKey] = None) -> Tuple[str, list]:
+    clauses = []
+    params = []
+    for field, value in filtro.dimensions().items():
+        if field == "lavadores":
+            clauses.append("EXISTS (SELECT 1 FROM json_each(lavagens.lavadores) WHERE value = ?)")
+        else:
+            clauses.append(f"{field} = ?")
+        params.append(value)
+    if filtro.from_:
+        clauses.append("data_dia >= ?")
+        params.append(filtro.from_.isoformat())
+    if filtro.to:
+        clauses.append("data_dia <= ?")
+        params.append(filtro.to.isoformat())
+    if after:
+        clauses.append("(created_at < ? OR (created_at = ? AND id < ?))")
+        created_at = _timestamp(after[0])
+        params.extend([created_at, created_at, after[1]])
+    return (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+
+class SqliteWashRepository(WashRepository):
+    def __init__(self, storage: "SqliteStorage"):
+        self.storage = storage
+
+    @property
+    def db(self) -> aiosqlite.Connection:
+        return self.storage.connection
+
+    async def _insert_plates(self, lavagens: List[dict]):
+        await self.db.executemany(
+            "INSERT OR IGNORE INTO lavagens_matriculas (matricula, id) VALUES (?, ?)",
+            [(matricula, lavagem["id"]) for lavagem in lavagens for matricula in plate_keys(lavagem)],
+        )
+
+    async def create(self, lavagem: WashRegistration) -> WashRegistration:
+        async with self.storage.transaction():
+            try:
+                await self.db.execute(INSERT_WASH, to_row(lavagem))
+            except sqlite3.IntegrityError:
+                # Replayed idempotency key: hand back the wash created the first time
+                async with self.db.execute(
+                    SELECT_WASH + " WHERE idempotency_key = ?", (lavagem.idempotency_key,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+                if row is None:
+                    raise
+                return WashRegistration(**from_row(row))
+            await self._insert_plates([lavagem.model_dump()])
+        return lavagem
+
+    async def create_many(self, lavagens: List[WashRegistration]) -> List[BulkItemResult]:
+        resultados = []
+        inserted = []
+        # One transaction for the whole batch
+        async with self.storage.transaction():
+            for index, lavagem in enumerate(lavagens):
+                try:
+                    await self.db.execute(INSERT_WASH, to_row(lavagem))
+                except sqlite3.IntegrityError as e:
+                    async with self.db.execute(
+                        "SELECT id FROM lavagens WHERE idempotency_key = ?", (lavagem.idempotency_key,)
+                    ) as cursor:
+                        row = await cursor.fetchone()
+                    if row:
+                        resultados.append(BulkItemResult(index=index, status="duplicada", id=row[0]))
+                    else:
+                        resultados.append(BulkItemResult(index=index, status="erro", erro=str(e)))
+                    continue
+                inserted.append(lavagem.model_dump())
+                resultados.append(BulkItemResult(index=index, status="criada", id=lavagem.id))
+            await self._insert_plates(inserted)
+        return resultados
+
+    async def delete(self, wash_id: str) -> Optional[dict]:
+        async with self.storage.transaction():
+            async with self.db.execute(
+                "DELETE FROM lavagens WHERE id = ? RETURNING " + ", ".join(COLUMNS), (wash_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            await self.db.execute("DELETE FROM lavagens_matriculas WHERE id = ?", (wash_id,))
+        return from_row(row) if row else None
+
+    async def delete_many(self, wash_ids: List[str]) -> int:
+        deleted = 0
+        async with self.storage.transaction():
+            # Stay under SQLite's bound-parameter limit
+            for start in range(0, len(wash_ids), 500):
+                chunk = wash_ids[start:start + 500]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor = await self.db.execute(f"DELETE FROM lavagens WHERE id IN ({placeholders})", chunk)
+                deleted += cursor.rowcount
+                await self.db.execute(f"DELETE FROM lavagens_matriculas WHERE id IN ({placeholders})", chunk)
+        return deleted
+
+    async def list(
+        self, filtro: WashFilter, limit: Optional[int] = None, after: Optional[PageKey] = None
+    ) -> List[dict]:
+        clause, params = where(filtro, after)
+        sql = SELECT_WASH + clause + " ORDER BY created_at DESC, id DESC"
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        async with self.db.execute(sql, params) as cursor:
+            return [public_wash(from_row(row)) for row in await cursor.fetchall()]
+
+    async def stream(
+        self, filtro: WashFilter, batch_size: int = 1000, fields: Optional[List[str]] = None
+    ) -> AsyncIterator[dict]:
+        clause, params = where(filtro)
+        async with self.db.execute(SELECT_WASH + clause + " ORDER BY data_dia, created_at", params) as cursor:
+            while True:
+                rows = await cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield from_row(row)
+
+    async def plate_hits(self, prefix: str, limit: int) -> List[dict]:
+        async with self.db.execute(
+            SELECT_WASH + " WHERE id IN (SELECT id FROM lavagens_matriculas WHERE matricula >= ? AND matricula < ?)"
+            " ORDER BY created_at DESC, id DESC LIMIT ?",
+            (prefix, prefix + "\U0010ffff", limit),
+        ) as cursor:
+            return [public_wash(from_row(row)) for row in await cursor.fetchall()]
+
+    async def text_hits(self, text: str, limit: int) -> List[dict]:
+        # Any of the words, quoted so FTS5 operators in user input stay literal
+        match = " OR ".join(f'"{term}"' for term in search_terms(text))
+        async with self.db.execute(SEARCH_TEXT, (match, limit)) as cursor:
+            return [public_wash(from_row(row)) for row in await cursor.fetchall()]
+
+    async def index_search(self):
+        """Fill the search tables from existing washes (databases created before them)."""
+        async with self.storage.transaction():
+            await self.db.execute("DELETE FROM lavagens_fts")
+            await self.db.execute(
+                "INSERT INTO lavagens_fts (id, created_at, observacoes)"
+                " SELECT id, created_at, observacoes FROM lavagens"
+            )
+            await self.db.execute("DELETE FROM lavagens_fts_ids")
+            await self.db.execute("INSERT INTO lavagens_fts_ids (id, fts_rowid) SELECT id, rowid FROM lavagens_fts")
+            async with self.db.execute("SELECT id, matricula_trator, matricula_reboque FROM lavagens") as cursor:
+                rows = await cursor.fetchall()
+            await self._insert_plates([
+                {"id": wash_id, "matricula_trator": trator, "matricula_reboque": reboque}
+                for wash_id, trator, reboque in rows
+            ])
+
+    async def stats(self, filtro: WashFilter) -> WashStats:
+        clause, params = where(filtro)
+        async with self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(valor), 0) FROM lavagens" + clause, params
+        ) as cursor:
+            total_lavagens, total_valor = await cursor.fetchone()
+        breakdowns = {}
+        for field, prefix in STATS_DIMENSIONS.items():
+            async with self.db.execute(
+                f"SELECT COALESCE(NULLIF({field}, ''), 'N/A'), COUNT(*) FROM lavagens{clause} GROUP BY 1", params
+            ) as cursor:
+                breakdowns[prefix] = dict(await cursor.fetchall())
+        async with self.db.execute(
+            f"SELECT {LAVADOR_KEY}, COUNT(*) FROM lavagens, json_each(lavagens.lavadores) AS lavador"
+            + clause + " GROUP BY 1",
+            params,
+        ) as cursor:
+            breakdowns["por_lavador"] = dict(await cursor.fetchall())
+        return WashStats(total_lavagens=total_lavagens, total_valor=round(total_valor, 2), **breakdowns)
+
+    async def series_buckets(self, filtro: WashFilter, bucket: str, group_by: Optional[str]) -> SeriesBuckets:
+        clause, params = where(filtro)
+        clause = (clause + " AND" if clause else " WHERE") + " data_dia IS NOT NULL"
+        periodo = PERIODOS[bucket]
+        async with self.db.execute(
+            f"SELECT {periodo}, COUNT(*), SUM(valor) FROM lavagens{clause} GROUP BY 1", params
+        ) as cursor:
+            totais = {
+                date.fromisoformat(row[0]): SeriesValue(total_lavagens=row[1], total_valor=row[2])
+                for row in await cursor.fetchall()
+            }
+        grupos = {}
+        if group_by:
+            if group_by == "lavador":
+                source, grupo = "lavagens, json_each(lavagens.lavadores) AS lavador", LAVADOR_KEY
+            else:
+                source, grupo = "lavagens", f"COALESCE(NULLIF({group_by}, ''), 'N/A')"
+            async with self.db.execute(
+                f"SELECT {periodo}, {grupo}, COUNT(*), SUM(valor) FROM {source}{clause} GROUP BY 1, 2", params
+            ) as cursor:
+                for periodo_, key, total_lavagens, total_valor in await cursor.fetchall():
+                    grupos.setdefault(date.fromisoformat(periodo_), {})[str(key)] = SeriesValue(
+                        total_lavagens=total_lavagens, total_valor=total_valor
+                    )
+        return totais, grupos
+
+    async def analytics_rows(
+        self, filtro: WashFilter, group_by: str, top: int, sort: str
+    ) -> Tuple[SeriesValue, List[AnalyticsRow]]:
+        clause, params = where(filtro)
+        async with self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(valor), 0) FROM lavagens" + clause, params
+        ) as cursor:
+            total_lavagens, total_valor = await cursor.fetchone()
+        if group_by == "lavador":
+            # A job shared by n washers credits valor / n to each of them
+            source, grupo = "lavagens, json_each(lavagens.lavadores) AS lavador", LAVADOR_KEY
+            valor = "SUM(valor / json_array_length(lavagens.lavadores))"
+        else:
+            source, grupo, valor = "lavagens", f"COALESCE(NULLIF({group_by}, ''), 'N/A')", "SUM(valor)"
+        order = 3 if sort == "valor" else 2
+        async with self.db.execute(
+            f"SELECT {grupo}, COUNT(*), {valor}, SUM(valor) FROM {source}{clause}"
+            f" GROUP BY 1 ORDER BY {order} DESC, 1 LIMIT ?",
+            [*params, top],
+        ) as cursor:
+            rows = [tuple(row) for row in await cursor.fetchall()]
+        return SeriesValue(total_lavagens=total_lavagens, total_valor=total_valor), rows
+
+
+class SqliteNameRepository:
+    table: str
+    model: type
+
+    def __init__(self, storage: "SqliteStorage"):
+        self.storage = storage
+
+    async def list(self) -> List[dict]:
+        async with self.storage.connection.execute(
+            f"SELECT id, nome, created_at FROM {self.table} ORDER BY nome_chave LIMIT 1000"
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [
+            self.model(id=entry_id, nome=nome, created_at=datetime.fromisoformat(created_at)).model_dump()
+            for entry_id, nome, created_at in rows
+        ]
+
+    async def create(self, entry: dict) -> None:
+        async with self.storage.transaction():
+            try:
+                await self.storage.connection.execute(
+                    f"INSERT INTO {self.table} (id, nome, nome_chave, created_at) VALUES (?, ?, ?, ?)",
+                    (entry["id"], entry["nome"], entry["nome"].casefold(), _timestamp(entry["created_at"])),
+                )
+            except sqlite3.IntegrityError:
+                raise DuplicateError(entry["nome"])
+
+    async def delete(self, entry_id: str) -> bool:
+        async with self.storage.transaction():
+            cursor = await self.storage.connection.execute(f"DELETE FROM {self.table} WHERE id = ?", (entry_id,))
+        return cursor.rowcount > 0
+
+
+class SqliteWasherRepository(SqliteNameRepository, WasherRepository):
+    table = "lavadores"
+    model = CustomWasher
+
+
+class SqliteCompanyRepository(SqliteNameRepository, CompanyRepository):
+    table = "empresas_externas"
+    model = ExternalCompany
+
+
+class SqliteStatementRepository(StatementRepository):
+    def __init__(self, storage: "SqliteStorage"):
+        self.storage = storage
+
+    async def get(self, statement_id: str) -> Optional[dict]:
+        async with self.storage.connection.execute("SELECT doc FROM extratos WHERE id = ?", (statement_id,)) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def list(self, periodo: str) -> List[dict]:
+        async with self.storage.connection.execute(
+            "SELECT resumo FROM extratos WHERE periodo = ? ORDER BY empresa_nome", (periodo,)
+        ) as cursor:
+            return [json.loads(row[0]) for row in await cursor.fetchall()]
+
+    async def create(self, statement: dict) -> None:
+        resumo = {key: statement[key] for key in StatementSummary.model_fields}
+        async with self.storage.transaction():
+            try:
+                await self.storage.connection.execute(
+                    "INSERT INTO extratos (id, periodo, empresa_nome, resumo, doc) VALUES (?, ?, ?, ?, ?)",
+                    (statement["id"], statement["periodo"], statement["empresa_nome"], _json(resumo), _json(statement)),
+                )
+            except sqlite3.IntegrityError:
+                raise DuplicateError(statement["id"])
+
+
+class SqliteChangeLog(ChangeLog):
+    def __init__(self, storage: "SqliteStorage"):
+        self.storage = storage
+        self.epoch = ""
+
+    @property
+    def db(self) -> aiosqlite.Connection:
+        return self.storage.connection
+
+    async def start(self):
+        async with self.db.execute("SELECT epoch FROM alteracoes_epoch") as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            row = (uuid.uuid4().hex,)
+            async with self.storage.transaction():
+                await self.db.execute("INSERT INTO alteracoes_epoch (epoch) VALUES (?)", row)
+        self.epoch = row[0]
+
+    async def append(self, colecao: str, op: str, docs: List[dict]) -> None:
+        now = datetime.utcnow()
+        # Inside a route's transaction this joins it, so the write and its entry commit together
+        async with self.storage.transaction():
+            await self.db.executemany(
+                "INSERT INTO alteracoes (colecao, op, id, doc, ts) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (colecao, op, doc["id"], _json(doc), _timestamp(now))
+                    for doc in docs
+                ],
+            )
+            await self.db.execute("DELETE FROM alteracoes WHERE ts < ?", (_timestamp(now - CHANGE_RETENTION),))
+
+    async def since(self, seq: int, limit: int) -> List[dict]:
+        async with self.db.execute(
+            "SELECT seq, colecao, op, id, doc, ts FROM alteracoes WHERE seq > ? ORDER BY seq LIMIT ?", (seq, limit)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        return [
+            {"seq": seq_, "colecao": colecao, "op": op, "id": entry_id,
+             "doc": json.loads(doc) if doc else None, "ts": datetime.fromisoformat(ts)}
+            for seq_, colecao, op, entry_id, doc, ts in rows
+        ]
+
+    async def bounds(self) -> Tuple[int, int]:
+        async with self.db.execute(
+            "SELECT (SELECT MIN(seq) FROM alteracoes),"
+            " COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'alteracoes'), 0)"
+        ) as cursor:
+            first, last = await cursor.fetchone()
+        return (last + 1 if first is None else first), last
+
+
+def _json(doc: dict) -> str:
+    return json.dumps(doc, ensure_ascii=False, default=lambda value: value.isoformat())
+
+
+class SqliteStorage(Storage):
+    def __init__(self, path: str):
+        self.path = path
+        self.connection: Optional[aiosqlite.Connection] = None
+        # Every request shares the connection: writes take turns, each in its own transaction
+        self._write_lock = asyncio.Lock()
+        self._in_transaction = contextvars.ContextVar("sqlite_transaction", default=False)
+        self.lavagens = SqliteWashRepository(self)
+        self.lavadores = SqliteWasherRepository(self)
+        self.empresas_externas = SqliteCompanyRepository(self)
+        self.extratos = SqliteStatementRepository(self)
+        self.changes = SqliteChangeLog(self)
+
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        """BEGIN … COMMIT, or ROLLBACK if the block raises, holding the write lock."""
+        if self._in_transaction.get():
+            yield
+            return
+        async with self._write_lock:
+            token = self._in_transaction.set(True)
+            try:
+                await self.connection.execute("BEGIN IMMEDIATE")
+                try:
+                    yield
+                except BaseException:
+                    await self.connection.rollback()
+                    raise
+                await self.connection.commit()
+            finally:
+                self._in_transaction.reset(token)
+
+    async def start(self):
+        # Autocommit mode: transactions are only the explicit ones above
+        self.connection = await aiosqlite.connect(self.path, isolation_level=None)
+        await self.connection.execute("PRAGMA journal_mode=WAL")
+        async with self.connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'lavagens_fts'") as cursor:
+            search_ready = await cursor.fetchone() is not None
+        await self.connection.executescript(SCHEMA + SEARCH_SCHEMA + CHANGES_SCHEMA)
+        await self.changes.start()
+        if not search_ready:
+            await self.lavagens.index_search()
+
+    async def ping(self) -> bool:
+        async with self.connection.execute("SELECT 1") as cursor:
+            return (await cursor.fetchone()) == (1,)
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
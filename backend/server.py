@@ -1,84 +1,271 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Query, Request, Response, Path as PathParam
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.background import BackgroundTask
+from starlette.responses import StreamingResponse
+from pymongo.errors import (
+    ExecutionTimeout, NetworkTimeout, PyMongoError, ServerSelectionTimeoutError, WaitQueueTimeoutError,
+)
+from contextlib import asynccontextmanager
+import asyncio
+import orjson
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import ValidationError
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Union
+import io
+import csv
+import json
+import base64
 import uuid
-from datetime import datetime, date
+from urllib.parse import quote
+from datetime import datetime, date, timedelta
+
+from archive import ArchivedWashError, ArchivedWashRepository, ArchiveStore
+from billing import (
+    OpenPeriodError, get_statement, issue_period, list_statements as list_period_statements, statement_csv,
+    statement_pdf,
+)
+from cache import ResponseCache
+from events import EventBroker, stats_of
+from limits import ClientDisconnected, DeadlineExceeded, Overloaded, RouteLimiter
+from listener import ChangeListener
+from metrics import SHED_REQUESTS, MetricsMiddleware, metrics_endpoint, mongo_listeners
+from models import (
+    AuthRequest, BillingStatement, BulkItemResult, BulkResult, CustomWasher, CustomWasherCreate, Dashboard,
+    ExternalCompany, ExternalCompanyCreate, StatementSummary, SyncPage, WashFilter, WashRegistration,
+    WashRegistrationCreate, WashRegistrationPage, WashAnalytics, WashSearchPage, WashSeries, WashStats, month_range,
+    public_wash,
+)
+from repositories import (
+    ChangeLog, CompanyRepository, DuplicateError, PageKey, QueryTooLargeError, StatementRepository, Storage,
+    WashRepository, WasherRepository, create_storage,
+)
+from repositories.base import settled_changes
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Read-mostly responses (lookup lists, stats) cached per path + query string
+response_cache = ResponseCache(
+    maxsize=int(os.environ.get("CACHE_MAX_ENTRIES", "256")),
+    ttl=float(os.environ.get("CACHE_TTL_SECONDS", "60")),
+)
+
+# Expensive route classes: bounded concurrency and queue per worker, and a deadline per request
+stats_limiter = RouteLimiter.from_env("stats", concurrency=8, queue=32, deadline=5)
+month_limiter = RouteLimiter.from_env("month", concurrency=4, queue=16, deadline=10)
+export_limiter = RouteLimiter.from_env("export", concurrency=2, queue=4)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connect, warm the pool and check indexes before accepting traffic
+    app.state.ready = False
+    app.state.storage = create_storage(os.environ.get("STORAGE_BACKEND", "mongo"), event_listeners=mongo_listeners())
+    await app.state.storage.start()
+    # Reads also cover the months moved to the archive by `manage.py archive`
+    app.state.storage.lavagens = ArchivedWashRepository(app.state.storage.lavagens, ArchiveStore(
+        os.environ.get("ARCHIVE_DIR", str(ROOT_DIR / "arquivo")),
+        cache_months=int(os.environ.get("ARCHIVE_CACHE_MONTHS", "12")),
+    ))
+    # Other workers' writes: drop their cached responses and feed the live dashboards
+    listener = None
+    if app.state.storage.shared:
+        listener = ChangeListener(
+            app.state.storage, apply_remote_change, resync_caches,
+            poll_seconds=float(os.environ.get("CHANGE_POLL_SECONDS", "1")),
+        )
+        listener.start()
+    # Tell maintenance commands (manage.py rebuild-rollups) that this worker is writing
+    instance = uuid.uuid4().hex
+    await app.state.storage.heartbeat(instance)
+    heartbeat = asyncio.create_task(_heartbeat(app.state.storage, instance))
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        heartbeat.cancel()
+        if listener is not None:
+            await listener.stop()
+        try:
+            await app.state.storage.retire(instance)
+        except Exception as e:
+            logger.warning("Could not retire instance %s: %s", instance, e)
+        await app.state.storage.close()
+
+INSTANCE_HEARTBEAT_SECONDS = 15
+
+async def _heartbeat(storage, instance: str):
+    while True:
+        await asyncio.sleep(INSTANCE_HEARTBEAT_SECONDS)
+        try:
+            await storage.heartbeat(instance)
+        except Exception as e:
+            logger.warning("Heartbeat failed: %s", e)
+
+def apply_remote_change(event: dict):
+    response_cache.invalidate(event["colecao"])
+    if event["colecao"] != "lavagens":
+        return
+    if event["doc"] is None:
+        broker.resync()  # a delete without its pre-image
+    elif event["op"] == "insert":
+        broker.publish_insert(event["doc"])
+    else:
+        broker.publish_delete(event["doc"])
+
+def resync_caches():
+    response_cache.clear()
+    broker.resync()
+
+# Live dashboard events, fanned out to every open /lavagens/stream in this worker
+broker = EventBroker()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
-# Models
-class WashRegistration(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    data: str  # Date in YYYY-MM-DD format
-    tipo_veiculo: str
-    area_negocio: str
-    lavadores: List[str]  # Changed to list of washers
-    tipo_lavagem: str
-    empresa_tipo: str  # "interna" or "externa"
-    empresa_nome: str
-    matricula_trator: Optional[str] = ""
-    matricula_reboque: Optional[str] = ""
-    valor: float
-    observacoes: Optional[str] = ""
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class WashRegistrationCreate(BaseModel):
-    data: str
-    tipo_veiculo: str
-    area_negocio: str
-    lavadores: List[str]  # Changed to list of washers
-    tipo_lavagem: str
-    empresa_tipo: str
-    empresa_nome: str
-    matricula_trator: Optional[str] = ""
-    matricula_reboque: Optional[str] = ""
-    valor: float
-    observacoes: Optional[str] = ""
-
-class CustomWasher(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    nome: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class CustomWasherCreate(BaseModel):
-    nome: str
-
-class ExternalCompany(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
-    nome: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
-
-class ExternalCompanyCreate(BaseModel):
-    nome: str
-
-class AuthRequest(BaseModel):
-    password: str
-
-class WashStats(BaseModel):
-    total_lavagens: int
-    total_valor: float
-    por_tipo_veiculo: dict
-    por_area_negocio: dict
-    por_lavador: dict
-    por_tipo_lavagem: dict
+# Storage: routes get their repositories from the engine opened at startup
+def get_storage(request: Request) -> Storage:
+    return request.app.state.storage
+
+def get_wash_repository(request: Request) -> WashRepository:
+    return request.app.state.storage.lavagens
+
+def get_washer_repository(request: Request) -> WasherRepository:
+    return request.app.state.storage.lavadores
+
+def get_company_repository(request: Request) -> CompanyRepository:
+    return request.app.state.storage.empresas_externas
+
+def get_statement_repository(request: Request) -> StatementRepository:
+    return request.app.state.storage.extratos
+
+def get_change_log(request: Request) -> ChangeLog:
+    return request.app.state.storage.changes
+
+def wash_filter(
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    area_negocio: Optional[str] = None,
+    lavador: Optional[str] = None,
+    empresa_tipo: Optional[str] = None,
+    empresa_nome: Optional[str] = None,
+    tipo_veiculo: Optional[str] = None,
+) -> WashFilter:
+    if from_ and to and from_ > to:
+        raise HTTPException(status_code=400, detail="Intervalo de datas inválido")
+    return WashFilter(
+        from_=from_, to=to, area_negocio=area_negocio, lavador=lavador,
+        empresa_tipo=empresa_tipo, empresa_nome=empresa_nome, tipo_veiculo=tipo_veiculo,
+    )
+
+# Response caching
+async def cached_json(
+    request: Request,
+    tags: Iterable[str],
+    producer: Callable[[], Awaitable],
+    vary: str = "",
+    limiter: Optional[RouteLimiter] = None,
+) -> Response:
+    """Serve `producer()` as JSON from the response cache, honouring If-None-Match.
+
+    `tags` name the collections the response depends on; writes to any of them
+    invalidate it. `vary` adds implicit inputs (e.g. today's date) to the key.
+    Cache misses run through `limiter`, when given; hits never wait for it.
+    """
+    key = f"{request.url.path}?{request.url.query}#{vary}"
+    entry = response_cache.get(key)
+    if entry is None:
+        content = jsonable_encoder(await (limiter.run(request, producer) if limiter else producer()))
+        body = json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+        entry = response_cache.set(key, body, tags)
+    headers = {"ETag": entry.etag, "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry.etag in (tag.strip() for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
+    return Response(entry.body, media_type="application/json", headers=headers)
+
+# Keyset pagination over (created_at, id), newest first
+def encode_cursor(lavagem: dict) -> str:
+    raw = json.dumps([lavagem["created_at"].isoformat(), lavagem["id"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> PageKey:
+    """Turn an opaque cursor back into the (created_at, id) it was made from."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, wash_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(wash_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+async def paginate_washes(repo: WashRepository, filtro: WashFilter, limit: int, after: Optional[str]) -> dict:
+    """Return one WashRegistrationPage, already shaped for ORJSONResponse."""
+    # One extra document tells us whether another page exists
+    lavagens = await repo.list(filtro, limit + 1, decode_cursor(after) if after else None)
+    return page_of(lavagens, limit)
+
+def page_of(lavagens: List[dict], limit: int) -> dict:
+    """Trim a list fetched with `limit + 1` to one page and its next cursor."""
+    next_cursor = encode_cursor(lavagens[limit - 1]) if len(lavagens) > limit else None
+    return {"items": lavagens[:limit], "next_cursor": next_cursor}
+
+# Streaming export
+EXPORT_FIELDS = [
+    "id", "data", "tipo_veiculo", "area_negocio", "lavadores", "tipo_lavagem",
+    "empresa_tipo", "empresa_nome", "matricula_trator", "matricula_reboque",
+    "valor", "observacoes", "created_at",
+]
+EXPORT_BATCH_SIZE = 2000
+EXPORT_CHUNK_BYTES = 64 * 1024
+# CSV has no list type: several washers share one cell, e.g. "Ana Silva; Rui Costa"
+LAVADORES_SEPARATOR = "; "
+
+def _export_row(lavagem: dict) -> dict:
+    lavagem = {field: lavagem.get(field, "") for field in EXPORT_FIELDS}
+    if isinstance(lavagem["created_at"], datetime):
+        lavagem["created_at"] = lavagem["created_at"].isoformat()
+    return lavagem
+
+async def _export_csv(lavagens):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    # Send the header straight away so the download starts immediately
+    yield buffer.getvalue()
+    buffer.seek(0)
+    buffer.truncate()
+    async for lavagem in lavagens:
+        row = _export_row(lavagem)
+        if isinstance(row["lavadores"], list):
+            row["lavadores"] = LAVADORES_SEPARATOR.join(row["lavadores"])
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+async def _export_ndjson(lavagens):
+    chunk = []
+    size = 0
+    async for lavagem in lavagens:
+        line = json.dumps(_export_row(lavagem), ensure_ascii=False) + "\n"
+        chunk.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_BYTES:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    yield "".join(chunk)
 
 # Auth endpoint
 @api_router.post("/auth")
@@ -90,232 +277,507 @@ async def authenticate(auth: AuthRequest):
 
 # Wash registration endpoints
 @api_router.post("/lavagens", response_model=WashRegistration)
-async def create_wash_registration(wash: WashRegistrationCreate):
-    wash_dict = wash.dict()
+async def create_wash_registration(
+    wash: WashRegistrationCreate,
+    repo: WashRepository = Depends(get_wash_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    wash_dict = wash.model_dump()
     wash_obj = WashRegistration(**wash_dict)
-    await db.lavagens.insert_one(wash_obj.dict())
-    return wash_obj
-
-@api_router.get("/lavagens", response_model=List[WashRegistration])
-async def get_wash_registrations():
-    lavagens = await db.lavagens.find().sort("created_at", -1).to_list(1000)
-    return [WashRegistration(**lavagem) for lavagem in lavagens]
-
-@api_router.get("/lavagens/today", response_model=List[WashRegistration])
-async def get_today_washes():
-    today = datetime.now().strftime("%Y-%m-%d")
-    lavagens = await db.lavagens.find({"data": today}).sort("created_at", -1).to_list(1000)
-    return [WashRegistration(**lavagem) for lavagem in lavagens]
-
-@api_router.get("/lavagens/month/{year}/{month}", response_model=List[WashRegistration])
-async def get_month_washes(year: int, month: int):
-    # Get all washes for the specific month/year
-    lavagens = await db.lavagens.find().to_list(1000)
-    month_washes = []
-    for lavagem in lavagens:
+    async with storage.transaction():
+        lavagem = await repo.create(wash_obj)
+        if lavagem.id == wash_obj.id:
+            await changes.append("lavagens", "insert", [wash_obj.model_dump()])
+    if lavagem.id == wash_obj.id:
+        response_cache.invalidate("lavagens")
+        broker.publish_insert(wash_obj.model_dump())
+    return lavagem
+
+BULK_MAX_ITEMS = 1000
+
+def _validation_message(error: ValidationError) -> str:
+    return "; ".join(
+        f"{'.'.join(str(loc) for loc in err['loc'])}: {err['msg']}" for err in error.errors()
+    )
+
+@api_router.post("/lavagens/bulk", response_model=BulkResult)
+async def create_wash_registrations_bulk(
+    items: List[Dict[str, Any]],
+    repo: WashRepository = Depends(get_wash_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    if len(items) > BULK_MAX_ITEMS:
+        raise HTTPException(status_code=413, detail=f"Máximo de {BULK_MAX_ITEMS} lavagens por pedido")
+
+    # Validate every item up front; invalid ones are reported, not fatal
+    resultados = {}
+    indexes = []
+    lavagens = []
+    for index, item in enumerate(items):
         try:
-            wash_date = datetime.strptime(lavagem["data"], "%Y-%m-%d")
-            if wash_date.year == year and wash_date.month == month:
-                month_washes.append(WashRegistration(**lavagem))
-        except:
+            wash = WashRegistrationCreate.model_validate(item)
+        except ValidationError as e:
+            resultados[index] = BulkItemResult(index=index, status="invalida", erro=_validation_message(e))
             continue
-    return month_washes
+        indexes.append(index)
+        lavagens.append(WashRegistration(**wash.model_dump()))
 
-@api_router.get("/lavagens/stats", response_model=WashStats)
-async def get_wash_stats():
-    lavagens = await db.lavagens.find().to_list(1000)
-    
-    total_lavagens = len(lavagens)
-    total_valor = sum([lavagem.get("valor", 0) for lavagem in lavagens])
-    
-    # Stats by type
-    por_tipo_veiculo = {}
-    por_area_negocio = {}
-    por_lavador = {}
-    por_tipo_lavagem = {}
-    
-    for lavagem in lavagens:
-        # Vehicle type stats
-        tipo = lavagem.get("tipo_veiculo", "N/A")
-        por_tipo_veiculo[tipo] = por_tipo_veiculo.get(tipo, 0) + 1
-        
-        # Business area stats
-        area = lavagem.get("area_negocio", "N/A")
-        por_area_negocio[area] = por_area_negocio.get(area, 0) + 1
-        
-        # Washer stats (handle multiple washers)
-        lavadores = lavagem.get("lavadores", [])
-        if isinstance(lavadores, list):
-            for lavador in lavadores:
-                por_lavador[lavador] = por_lavador.get(lavador, 0) + 1
-        else:
-            # Backward compatibility
-            lavador = lavadores if lavadores else "N/A"
-            por_lavador[lavador] = por_lavador.get(lavador, 0) + 1
-            
-        # Wash type stats
-        tipo_lav = lavagem.get("tipo_lavagem", "N/A")
-        por_tipo_lavagem[tipo_lav] = por_tipo_lavagem.get(tipo_lav, 0) + 1
-    
-    return WashStats(
-        total_lavagens=total_lavagens,
-        total_valor=total_valor,
-        por_tipo_veiculo=por_tipo_veiculo,
-        por_area_negocio=por_area_negocio,
-        por_lavador=por_lavador,
-        por_tipo_lavagem=por_tipo_lavagem
+    if lavagens:
+        created = []
+        async with storage.transaction():
+            for resultado in await repo.create_many(lavagens):
+                if resultado.status == "criada":
+                    created.append(lavagens[resultado.index])
+                resultado.index = indexes[resultado.index]
+                resultados[resultado.index] = resultado
+            if created:
+                await changes.append("lavagens", "insert", [lavagem.model_dump() for lavagem in created])
+        if created:
+            response_cache.invalidate("lavagens")
+            for lavagem in created:
+                broker.publish_insert(lavagem.model_dump())
+
+    resultados = [resultados[index] for index in sorted(resultados)]
+    return BulkResult(
+        criadas=sum(r.status == "criada" for r in resultados),
+        duplicadas=sum(r.status == "duplicada" for r in resultados),
+        falhadas=sum(r.status in ("invalida", "erro") for r in resultados),
+        resultados=resultados,
     )
 
+# `legacy=true` keeps the old unpaginated list (capped at 1000) for older clients
+@api_router.get("/lavagens", response_model=Union[WashRegistrationPage, List[WashRegistration]])
+async def get_wash_registrations(
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    legacy: bool = False,
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    if legacy:
+        return ORJSONResponse(await repo.list(WashFilter(), 1000))
+    return ORJSONResponse(await paginate_washes(repo, WashFilter(), limit, after))
+
+@api_router.get("/lavagens/today", response_model=Union[WashRegistrationPage, List[WashRegistration]])
+async def get_today_washes(
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    legacy: bool = False,
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    today = date.today()
+    filtro = WashFilter(from_=today, to=today)
+    if legacy:
+        return ORJSONResponse(await repo.list(filtro, 1000))
+    return ORJSONResponse(await paginate_washes(repo, filtro, limit, after))
+
+# Years a month route accepts: month_range needs the following January to exist
+MAX_YEAR = 9998
+
+@api_router.get("/lavagens/month/{year}/{month}", response_model=Union[WashRegistrationPage, List[WashRegistration]])
+async def get_month_washes(
+    request: Request,
+    year: int = PathParam(..., ge=1, le=MAX_YEAR),
+    month: int = PathParam(..., ge=1, le=12),
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    legacy: bool = False,
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    start, end = month_range(year, month)
+    filtro = WashFilter(from_=start.date(), to=(end - timedelta(days=1)).date())
+    if legacy:
+        return ORJSONResponse(await month_limiter.run(request, lambda: repo.list(filtro, 1000)))
+    return ORJSONResponse(await month_limiter.run(request, lambda: paginate_washes(repo, filtro, limit, after)))
+
+# Search by licence plate (any prefix, separators and case ignored) or by words in observacoes
+SEARCH_MAX_OFFSET = 1000
+
+@api_router.get("/lavagens/search", response_model=WashSearchPage)
+async def search_wash_registrations(
+    q: str = Query(..., min_length=2, max_length=100),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=SEARCH_MAX_OFFSET),
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    # One extra hit tells us whether another page exists
+    lavagens = await repo.search(q, limit + 1, offset)
+    return ORJSONResponse({
+        "items": lavagens[:limit],
+        "next_offset": offset + limit if len(lavagens) > limit and offset + limit <= SEARCH_MAX_OFFSET else None,
+    })
+
+@api_router.get("/lavagens/export")
+async def export_wash_registrations(
+    formato: str = Query("csv", alias="format", pattern="^(csv|ndjson)$"),
+    from_: Optional[date] = Query(None, alias="from"),
+    to: Optional[date] = None,
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    # Refuse before any byte is sent; the slot is held until the download ends or is dropped.
+    # No overall deadline: a long export is legitimate, each batch is bound by timeoutMS
+    lease = await export_limiter.acquire()
+    lavagens = repo.stream(WashFilter(from_=from_, to=to), EXPORT_BATCH_SIZE)
+    if formato == "csv":
+        body, media_type = _export_csv(lavagens), "text/csv; charset=utf-8"
+    else:
+        body, media_type = _export_ndjson(lavagens), "application/x-ndjson"
+    return StreamingResponse(
+        export_limiter.stream(lease, body),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="lavagens.{formato}"'},
+        background=BackgroundTask(lease.release),
+    )
+
+@api_router.get("/lavagens/stats", response_model=WashStats)
+async def get_wash_stats(
+    request: Request,
+    filtro: WashFilter = Depends(wash_filter),
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    return await cached_json(request, ["lavagens"], lambda: repo.stats(filtro), limiter=stats_limiter)
+
 @api_router.get("/lavagens/stats/today", response_model=WashStats)
-async def get_today_stats():
-    today = datetime.now().strftime("%Y-%m-%d")
-    lavagens = await db.lavagens.find({"data": today}).to_list(1000)
-    
-    total_lavagens = len(lavagens)
-    total_valor = sum([lavagem.get("valor", 0) for lavagem in lavagens])
-    
-    # Stats by type for today
-    por_tipo_veiculo = {}
-    por_area_negocio = {}
-    por_lavador = {}
-    por_tipo_lavagem = {}
-    
-    for lavagem in lavagens:
-        tipo = lavagem.get("tipo_veiculo", "N/A")
-        por_tipo_veiculo[tipo] = por_tipo_veiculo.get(tipo, 0) + 1
-        
-        area = lavagem.get("area_negocio", "N/A")
-        por_area_negocio[area] = por_area_negocio.get(area, 0) + 1
-        
-        lavadores = lavagem.get("lavadores", [])
-        if isinstance(lavadores, list):
-            for lavador in lavadores:
-                por_lavador[lavador] = por_lavador.get(lavador, 0) + 1
-        else:
-            lavador = lavadores if lavadores else "N/A"
-            por_lavador[lavador] = por_lavador.get(lavador, 0) + 1
-            
-        tipo_lav = lavagem.get("tipo_lavagem", "N/A")
-        por_tipo_lavagem[tipo_lav] = por_tipo_lavagem.get(tipo_lav, 0) + 1
-    
-    return WashStats(
-        total_lavagens=total_lavagens,
-        total_valor=total_valor,
-        por_tipo_veiculo=por_tipo_veiculo,
-        por_area_negocio=por_area_negocio,
-        por_lavador=por_lavador,
-        por_tipo_lavagem=por_tipo_lavagem
+async def get_today_stats(request: Request, repo: WashRepository = Depends(get_wash_repository)):
+    today = date.today()
+    filtro = WashFilter(from_=today, to=today)
+    return await cached_json(
+        request, ["lavagens"], lambda: repo.stats(filtro), vary=today.isoformat(), limiter=stats_limiter,
     )
 
 @api_router.get("/lavagens/stats/month/{year}/{month}", response_model=WashStats)
-async def get_month_stats(year: int, month: int):
-    lavagens = await db.lavagens.find().to_list(1000)
-    month_washes = []
-    
-    for lavagem in lavagens:
+async def get_month_stats(
+    request: Request,
+    year: int = PathParam(..., ge=1, le=MAX_YEAR),
+    month: int = PathParam(..., ge=1, le=12),
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    start, end = month_range(year, month)
+    filtro = WashFilter(from_=start.date(), to=(end - timedelta(days=1)).date())
+    return await cached_json(request, ["lavagens"], lambda: repo.stats(filtro), limiter=stats_limiter)
+
+@api_router.get("/lavagens/series", response_model=WashSeries)
+async def get_wash_series(
+    request: Request,
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    group_by: Optional[str] = Query(None, pattern="^(tipo_veiculo|area_negocio|lavador|tipo_lavagem)$"),
+    filtro: WashFilter = Depends(wash_filter),
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    async def load():
         try:
-            wash_date = datetime.strptime(lavagem["data"], "%Y-%m-%d")
-            if wash_date.year == year and wash_date.month == month:
-                month_washes.append(lavagem)
-        except:
-            continue
-    
-    total_lavagens = len(month_washes)
-    total_valor = sum([lavagem.get("valor", 0) for lavagem in month_washes])
-    
-    # Stats by type for month
-    por_tipo_veiculo = {}
-    por_area_negocio = {}
-    por_lavador = {}
-    por_tipo_lavagem = {}
-    
-    for lavagem in month_washes:
-        tipo = lavagem.get("tipo_veiculo", "N/A")
-        por_tipo_veiculo[tipo] = por_tipo_veiculo.get(tipo, 0) + 1
-        
-        area = lavagem.get("area_negocio", "N/A")
-        por_area_negocio[area] = por_area_negocio.get(area, 0) + 1
-        
-        lavadores = lavagem.get("lavadores", [])
-        if isinstance(lavadores, list):
-            for lavador in lavadores:
-                por_lavador[lavador] = por_lavador.get(lavador, 0) + 1
-        else:
-            lavador = lavadores if lavadores else "N/A"
-            por_lavador[lavador] = por_lavador.get(lavador, 0) + 1
-            
-        tipo_lav = lavagem.get("tipo_lavagem", "N/A")
-        por_tipo_lavagem[tipo_lav] = por_tipo_lavagem.get(tipo_lav, 0) + 1
-    
-    return WashStats(
-        total_lavagens=total_lavagens,
-        total_valor=total_valor,
-        por_tipo_veiculo=por_tipo_veiculo,
-        por_area_negocio=por_area_negocio,
-        por_lavador=por_lavador,
-        por_tipo_lavagem=por_tipo_lavagem
+            return await repo.series(filtro, bucket, group_by)
+        except QueryTooLargeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    return await cached_json(request, ["lavagens"], load, limiter=stats_limiter)
+
+# Revenue attribution: per washer (valor split between the washers of a job),
+# company, area or vehicle type, ranked in the database
+@api_router.get("/lavagens/analytics", response_model=WashAnalytics)
+async def get_wash_analytics(
+    request: Request,
+    group_by: str = Query("lavador", pattern="^(lavador|empresa_nome|area_negocio|tipo_veiculo|tipo_lavagem)$"),
+    sort: str = Query("valor", pattern="^(valor|lavagens)$"),
+    top: int = Query(10, ge=1, le=500),
+    filtro: WashFilter = Depends(wash_filter),
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    return await cached_json(
+        request, ["lavagens"], lambda: repo.analytics(filtro, group_by, top, sort), limiter=stats_limiter,
+    )
+
+# Dashboards: one page of washes and the stats of the same view in one request
+@api_router.get("/dashboard", response_model=Dashboard)
+async def get_dashboard(
+    request: Request,
+    scope: str = Query("today", pattern="^(today|month|range)$"),
+    year: Optional[int] = Query(None, ge=1, le=MAX_YEAR),
+    month: Optional[int] = Query(None, ge=1, le=12),
+    filtro: WashFilter = Depends(wash_filter),
+    limit: int = Query(50, ge=1, le=500),
+    after: Optional[str] = None,
+    stats: bool = True,
+    repo: WashRepository = Depends(get_wash_repository),
+):
+    """`scope=today` and `scope=month` (year/month, default the current one)
+    fix the dates; `scope=range` takes from/to. Dimension filters apply to
+    every scope. Pass `stats=false` with `after` when paging on, since the
+    stats of the view do not change between pages."""
+    today = date.today()
+    if scope == "today":
+        filtro = filtro.model_copy(update={"from_": today, "to": today})
+    elif scope == "month":
+        start, end = month_range(year or today.year, month or today.month)
+        filtro = filtro.model_copy(update={"from_": start.date(), "to": (end - timedelta(days=1)).date()})
+
+    # The "Hoje" dashboard is what every tablet opens at shift change
+    limiter = stats_limiter if scope == "today" else month_limiter
+    lavagens, estatisticas = await limiter.run(request, lambda: repo.dashboard(
+        filtro, limit + 1, decode_cursor(after) if after else None, with_stats=stats,
+    ))
+    return ORJSONResponse({
+        "scope": scope,
+        "inicio": filtro.from_,
+        "fim": filtro.to,
+        **page_of(lavagens, limit),
+        "stats": estatisticas.model_dump() if estatisticas else None,
+    })
+
+# Monthly billing statements (extratos) of external companies
+@api_router.get("/extratos/{year}/{month}", response_model=List[StatementSummary])
+async def list_statements(
+    request: Request,
+    year: int = PathParam(..., ge=1, le=MAX_YEAR),
+    month: int = PathParam(..., ge=1, le=12),
+    repo: WashRepository = Depends(get_wash_repository),
+    extratos: StatementRepository = Depends(get_statement_repository),
+):
+    """Issued statements, plus provisional ones for companies not issued yet (always, in the current month)."""
+    periodo = f"{year:04d}-{month:02d}"
+    return await month_limiter.run(request, lambda: list_period_statements(repo, extratos, periodo))
+
+@api_router.post("/extratos/{year}/{month}", response_model=List[StatementSummary])
+async def issue_statements(
+    request: Request,
+    year: int = PathParam(..., ge=1, le=MAX_YEAR),
+    month: int = PathParam(..., ge=1, le=12),
+    repo: WashRepository = Depends(get_wash_repository),
+    extratos: StatementRepository = Depends(get_statement_repository),
+):
+    """Issue every statement of a closed month not issued yet; issued ones never change."""
+    try:
+        return await month_limiter.run(request, lambda: issue_period(repo, extratos, f"{year:04d}-{month:02d}"))
+    except OpenPeriodError:
+        raise HTTPException(status_code=400, detail="O mês ainda não terminou")
+
+@api_router.get("/extratos/{year}/{month}/{empresa_nome}", response_model=BillingStatement)
+async def get_billing_statement(
+    request: Request,
+    empresa_nome: str,
+    year: int = PathParam(..., ge=1, le=MAX_YEAR),
+    month: int = PathParam(..., ge=1, le=12),
+    format: str = Query("json", pattern="^(json|csv|pdf)$"),
+    repo: WashRepository = Depends(get_wash_repository),
+    extratos: StatementRepository = Depends(get_statement_repository),
+):
+    periodo = f"{year:04d}-{month:02d}"
+    statement = await month_limiter.run(request, lambda: get_statement(repo, extratos, periodo, empresa_nome))
+    if statement is None:
+        raise HTTPException(status_code=404, detail="Sem lavagens para esta empresa no período")
+    if format == "json":
+        return statement
+    filename = f"extrato-{periodo}-{empresa_nome}.{format}"
+    headers = {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"}
+    if format == "csv":
+        return Response(statement_csv(statement), media_type="text/csv; charset=utf-8", headers=headers)
+    return Response(await asyncio.to_thread(statement_pdf, statement), media_type="application/pdf", headers=headers)
+
+# Live feed for the "Hoje" dashboard
+STREAM_KEEPALIVE_SECONDS = 15
+
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def _today_events(request: Request, repo: WashRepository):
+    subscription = broker.subscribe()
+    try:
+        # Subscribe before the snapshot so nothing written meanwhile is missed;
+        # `known` then drops events the snapshot already reflects
+        snapshot_day = None
+        known = set()
+        while True:
+            if snapshot_day != date.today() or subscription.lost:
+                snapshot_day = date.today()
+                subscription.reset()
+                filtro = WashFilter(from_=snapshot_day, to=snapshot_day)
+                lavagens = await repo.list(filtro)
+                known = {lavagem["id"] for lavagem in lavagens}
+                # Stats from the very same list, so later deltas apply exactly
+                yield _sse("snapshot", {"data": snapshot_day.isoformat(), "lavagens": lavagens, "stats": stats_of(lavagens)})
+
+            event = await subscription.get(STREAM_KEEPALIVE_SECONDS)
+            if await request.is_disconnected():
+                break
+            if event is None:
+                yield b": keepalive\n\n"
+                continue
+            if event["type"] == "resync":
+                continue  # `lost` is set: the next pass sends a fresh snapshot
+            if event["type"] == "insert":
+                if event["lavagem"]["data"] != snapshot_day.isoformat() or event["lavagem"]["id"] in known:
+                    continue
+                known.add(event["lavagem"]["id"])
+            elif event["type"] == "delete":
+                if event["id"] not in known:
+                    continue
+                known.discard(event["id"])
+            yield _sse(event["type"], event)
+    finally:
+        broker.unsubscribe(subscription)
+
+@api_router.get("/lavagens/stream")
+async def stream_today_washes(request: Request, repo: WashRepository = Depends(get_wash_repository)):
+    """Server-Sent Events: a `snapshot` of today's washes and stats, then
+    `insert`/`delete` events carrying the wash and its stats `delta`."""
+    return StreamingResponse(
+        _today_events(request, repo),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # nginx: flush each event
+            # GZipMiddleware buffers streamed bodies; an explicit encoding makes it pass events through
+            "Content-Encoding": "identity",
+        },
     )
 
 @api_router.delete("/lavagens/{wash_id}")
-async def delete_wash_registration(wash_id: str):
-    result = await db.lavagens.delete_one({"id": wash_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Lavagem não encontrada")
+async def delete_wash_registration(
+    wash_id: str,
+    repo: WashRepository = Depends(get_wash_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    async with storage.transaction():
+        try:
+            lavagem = await repo.delete(wash_id)
+        except ArchivedWashError:
+            raise HTTPException(status_code=409, detail="Lavagem arquivada")
+        if lavagem is None:
+            raise HTTPException(status_code=404, detail="Lavagem não encontrada")
+        await changes.append("lavagens", "delete", [public_wash(lavagem)])
+    response_cache.invalidate("lavagens")
+    broker.publish_delete(lavagem)
     return {"message": "Lavagem eliminada com sucesso"}
 
 # Custom washers endpoints
 @api_router.post("/lavadores", response_model=CustomWasher)
-async def add_custom_washer(washer: CustomWasherCreate):
-    # Check if washer already exists
-    existing = await db.lavadores.find_one({"nome": washer.nome})
-    if existing:
-        raise HTTPException(status_code=400, detail="Lavador já existe")
-    
-    washer_dict = washer.dict()
+async def add_custom_washer(
+    washer: CustomWasherCreate,
+    repo: WasherRepository = Depends(get_washer_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    washer_dict = washer.model_dump()
     washer_obj = CustomWasher(**washer_dict)
-    await db.lavadores.insert_one(washer_obj.dict())
+    async with storage.transaction():
+        try:
+            await repo.create(washer_obj.model_dump())
+        except DuplicateError:
+            raise HTTPException(status_code=400, detail="Lavador já existe")
+        await changes.append("lavadores", "insert", [washer_obj.model_dump()])
+    response_cache.invalidate("lavadores")
     return washer_obj
 
 @api_router.get("/lavadores", response_model=List[CustomWasher])
-async def get_custom_washers():
-    lavadores = await db.lavadores.find().sort("nome", 1).to_list(1000)
-    return [CustomWasher(**lavador) for lavador in lavadores]
+async def get_custom_washers(request: Request, repo: WasherRepository = Depends(get_washer_repository)):
+    return await cached_json(request, ["lavadores"], repo.list)
 
 @api_router.delete("/lavadores/{washer_id}")
-async def delete_custom_washer(washer_id: str):
-    result = await db.lavadores.delete_one({"id": washer_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Lavador não encontrado")
+async def delete_custom_washer(
+    washer_id: str,
+    repo: WasherRepository = Depends(get_washer_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    async with storage.transaction():
+        if not await repo.delete(washer_id):
+            raise HTTPException(status_code=404, detail="Lavador não encontrado")
+        await changes.append("lavadores", "delete", [{"id": washer_id}])
+    response_cache.invalidate("lavadores")
     return {"message": "Lavador eliminado com sucesso"}
 
 # External companies endpoints
 @api_router.post("/empresas-externas", response_model=ExternalCompany)
-async def add_external_company(company: ExternalCompanyCreate):
-    # Check if company already exists
-    existing = await db.empresas_externas.find_one({"nome": company.nome})
-    if existing:
-        raise HTTPException(status_code=400, detail="Empresa já existe")
-    
-    company_dict = company.dict()
+async def add_external_company(
+    company: ExternalCompanyCreate,
+    repo: CompanyRepository = Depends(get_company_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    company_dict = company.model_dump()
     company_obj = ExternalCompany(**company_dict)
-    await db.empresas_externas.insert_one(company_obj.dict())
+    async with storage.transaction():
+        try:
+            await repo.create(company_obj.model_dump())
+        except DuplicateError:
+            raise HTTPException(status_code=400, detail="Empresa já existe")
+        await changes.append("empresas_externas", "insert", [company_obj.model_dump()])
+    response_cache.invalidate("empresas_externas")
     return company_obj
 
 @api_router.get("/empresas-externas", response_model=List[ExternalCompany])
-async def get_external_companies():
-    empresas = await db.empresas_externas.find().sort("nome", 1).to_list(1000)
-    return [ExternalCompany(**empresa) for empresa in empresas]
+async def get_external_companies(request: Request, repo: CompanyRepository = Depends(get_company_repository)):
+    return await cached_json(request, ["empresas_externas"], repo.list)
 
 @api_router.delete("/empresas-externas/{company_id}")
-async def delete_external_company(company_id: str):
-    result = await db.empresas_externas.delete_one({"id": company_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
+async def delete_external_company(
+    company_id: str,
+    repo: CompanyRepository = Depends(get_company_repository),
+    changes: ChangeLog = Depends(get_change_log),
+    storage: Storage = Depends(get_storage),
+):
+    async with storage.transaction():
+        if not await repo.delete(company_id):
+            raise HTTPException(status_code=404, detail="Empresa não encontrada")
+        await changes.append("empresas_externas", "delete", [{"id": company_id}])
+    response_cache.invalidate("empresas_externas")
     return {"message": "Empresa eliminada com sucesso"}
 
+# Delta sync: what changed in the three collections since a client's last token
+SYNC_MAX_CHANGES = 1000
+
+def encode_sync_token(epoch: str, seq: int) -> str:
+    return f"{epoch}.{seq}"
+
+def decode_sync_token(token: str):
+    try:
+        epoch, seq = token.rsplit(".", 1)
+        return epoch, int(seq)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Token inválido")
+
+@api_router.get("/sync", response_model=SyncPage)
+async def sync_changes(
+    since: Optional[str] = None,
+    limit: int = Query(SYNC_MAX_CHANGES, ge=1, le=SYNC_MAX_CHANGES),
+    changes: ChangeLog = Depends(get_change_log),
+):
+    """Inserts and deletes since `since`, net of each other, plus the token to
+    pass next time. Without a usable token the answer is `reset`: fetch the
+    token first, then the full lists, so nothing written in between is lost
+    (replayed changes are harmless: inserts carry ids, deletes of unknown ids
+    are no-ops)."""
+    oldest, newest = await changes.bounds()
+    epoch, seq = decode_sync_token(since) if since else (None, None)
+    if epoch != changes.epoch or seq + 1 < oldest or seq > newest:
+        return SyncPage(token=encode_sync_token(changes.epoch, newest), reset=True)
+
+    entries = await changes.since(seq, limit)
+    # Past a gap an earlier write may still land; the client resumes from before it
+    settled, seq, stalled = settled_changes(entries, seq)
+    latest: Dict[tuple, dict] = {}
+    for entry in settled:
+        # Only the last change of each document matters
+        key = (entry["colecao"], entry["id"])
+        latest.pop(key, None)
+        latest[key] = entry
+
+    inseridos = {"lavagens": [], "lavadores": [], "empresas_externas": []}
+    eliminados: Dict[str, List[str]] = {}
+    for (colecao, entry_id), entry in latest.items():
+        if entry["op"] == "insert":
+            inseridos[colecao].append(entry["doc"])
+        else:
+            eliminados.setdefault(colecao, []).append(entry_id)
+    return SyncPage(token=encode_sync_token(changes.epoch, seq), has_more=len(entries) == limit and not stalled, eliminados=eliminados, **inseridos)
+
 # Include the router in the main app
 app.include_router(api_router)
 
+# Compress larger payloads (long lists, exports); tiny responses are not worth it
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -324,6 +786,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Outermost, so the timings include every other middleware
+app.add_middleware(MetricsMiddleware, router_app=app)
+app.add_route("/metrics", metrics_endpoint, include_in_schema=False)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -331,6 +797,56 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+HEALTHZ_TIMEOUT_SECONDS = 2.0
+
+# Readiness probe: 200 only once startup finished and the storage answers
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    if not getattr(app.state, "ready", False):
+        return JSONResponse({"status": "starting"}, status_code=503)
+    try:
+        ok = await asyncio.wait_for(app.state.storage.ping(), HEALTHZ_TIMEOUT_SECONDS)
+    except Exception as e:
+        logger.warning("Health check failed: %s", e)
+        ok = False
+    if not ok:
+        return JSONResponse({"status": "unavailable"}, status_code=503)
+    return {"status": "ok"}
+
+@app.exception_handler(ExecutionTimeout)
+@app.exception_handler(NetworkTimeout)
+async def mongo_timeout_handler(request: Request, exc: PyMongoError):
+    # timeoutMS / maxTimeMS expired: fail fast instead of piling up
+    return JSONResponse({"detail": "A consulta excedeu o tempo limite"}, status_code=504)
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    SHED_REQUESTS.labels(exc.route_class, "overloaded").inc()
+    return JSONResponse(
+        {"detail": "Servidor sobrecarregado, tente novamente dentro de instantes"},
+        status_code=503, headers={"Retry-After": str(exc.retry_after)},
+    )
+
+@app.exception_handler(WaitQueueTimeoutError)
+async def pool_exhausted_handler(request: Request, exc: WaitQueueTimeoutError):
+    # No pooled connection freed up within the deadline: as overloaded as it gets
+    return JSONResponse(
+        {"detail": "Servidor sobrecarregado, tente novamente dentro de instantes"},
+        status_code=503, headers={"Retry-After": "2"},
+    )
+
+@app.exception_handler(DeadlineExceeded)
+async def deadline_handler(request: Request, exc: DeadlineExceeded):
+    SHED_REQUESTS.labels(exc.route_class, "deadline").inc()
+    return JSONResponse({"detail": "A consulta excedeu o tempo limite"}, status_code=504)
+
+@app.exception_handler(ClientDisconnected)
+async def disconnected_handler(request: Request, exc: ClientDisconnected):
+    # Nobody is listening any more; 499 (nginx's "client closed request") only shows up in metrics
+    SHED_REQUESTS.labels(exc.route_class, "disconnected").inc()
+    return Response(status_code=499)
+
+@app.exception_handler(ServerSelectionTimeoutError)
+async def mongo_unavailable_handler(request: Request, exc: ServerSelectionTimeoutError):
+    logger.error("MongoDB unavailable on %s: %s", request.url.path, exc)
+    return JSONResponse({"detail": "Base de dados indisponível"}, status_code=503)
@@ -117,19 +117,46 @@ class HPDBackendTester:
         
         # Test GET /api/lavagens
         try:
-            response = self.session.get(f"{self.base_url}/lavagens")
+            response = self.session.get(f"{self.base_url}/lavagens", params={"limit": 2})
+            
+            if response.status_code == 200:
+                data = response.json()
+                if isinstance(data.get("items"), list) and "next_cursor" in data:
+                    self.log_test("Wash CRUD - Get Page", True, f"Retrieved {len(data['items'])} wash records")
+                else:
+                    self.log_test("Wash CRUD - Get Page", False, "Response is not a page", data)
+                
+                if data.get("next_cursor"):
+                    next_page = self.session.get(
+                        f"{self.base_url}/lavagens",
+                        params={"limit": 2, "after": data["next_cursor"]}
+                    ).json()
+                    first_ids = {lavagem["id"] for lavagem in data["items"]}
+                    if not first_ids & {lavagem["id"] for lavagem in next_page.get("items", [])}:
+                        self.log_test("Wash CRUD - Next Page", True, "Cursor returned a disjoint page")
+                    else:
+                        self.log_test("Wash CRUD - Next Page", False, "Pages overlap", next_page)
+            else:
+                self.log_test("Wash CRUD - Get Page", False, f"HTTP {response.status_code}", response.text)
+                
+        except Exception as e:
+            self.log_test("Wash CRUD - Get Page", False, f"Request failed: {str(e)}")
+        
+        # Test GET /api/lavagens?legacy=true
+        try:
+            response = self.session.get(f"{self.base_url}/lavagens", params={"legacy": "true"})
             
             if response.status_code == 200:
                 data = response.json()
                 if isinstance(data, list):
-                    self.log_test("Wash CRUD - Get All", True, f"Retrieved {len(data)} wash records")
+                    self.log_test("Wash CRUD - Get All (legacy)", True, f"Retrieved {len(data)} wash records")
                 else:
-                    self.log_test("Wash CRUD - Get All", False, "Response is not a list", data)
+                    self.log_test("Wash CRUD - Get All (legacy)", False, "Response is not a list", data)
             else:
-                self.log_test("Wash CRUD - Get All", False, f"HTTP {response.status_code}", response.text)
+                self.log_test("Wash CRUD - Get All (legacy)", False, f"HTTP {response.status_code}", response.text)
                 
         except Exception as e:
-            self.log_test("Wash CRUD - Get All", False, f"Request failed: {str(e)}")
+            self.log_test("Wash CRUD - Get All (legacy)", False, f"Request failed: {str(e)}")
         
         # Test DELETE /api/lavagens/{wash_id}
         if created_wash_id:
@@ -185,7 +212,7 @@ class HPDBackendTester:
             response = self.session.get(f"{self.base_url}/lavagens/today")
             
             if response.status_code == 200:
-                data = response.json()
+                data = response.json().get("items")
                 if isinstance(data, list):
                     today_count = len(data)
                     self.log_test("Daily Washes", True, f"Retrieved {today_count} washes for today")
@@ -227,6 +254,49 @@ class HPDBackendTester:
         except Exception as e:
             self.log_test("Monthly Washes", False, f"Request failed: {str(e)}")
     
+    def test_bulk_registration(self):
+        """Test bulk wash registration with idempotent replays"""
+        print("\n=== Testing Bulk Wash Registration ===")
+        
+        key = f"backend-test-{datetime.now().timestamp()}"
+        bulk_data = [
+            {
+                "data": datetime.now().strftime("%Y-%m-%d"),
+                "tipo_veiculo": "Basculante",
+                "area_negocio": "Construção",
+                "lavadores": ["Anfílófio Sousa"],
+                "tipo_lavagem": "Exterior Conjunto",
+                "empresa_tipo": "interna",
+                "empresa_nome": "HPD Transportes",
+                "valor": 40.00,
+                "idempotency_key": key
+            },
+            {"data": "2024-01-01", "valor": "sem valor"}
+        ]
+        
+        created_ids = []
+        try:
+            first = self.session.post(f"{self.base_url}/lavagens/bulk", json=bulk_data).json()
+            replay = self.session.post(f"{self.base_url}/lavagens/bulk", json=bulk_data).json()
+            created_ids = [r["id"] for r in first.get("resultados", []) if r["status"] == "criada"]
+            
+            statuses = [r["status"] for r in first.get("resultados", [])]
+            replay_statuses = [r["status"] for r in replay.get("resultados", [])]
+            if statuses == ["criada", "invalida"] and replay_statuses == ["duplicada", "invalida"]:
+                self.log_test("Bulk Registration", True, "Per-item results and idempotent replay OK")
+            else:
+                self.log_test("Bulk Registration", False, "Unexpected per-item results", {"first": first, "replay": replay})
+                
+        except Exception as e:
+            self.log_test("Bulk Registration", False, f"Request failed: {str(e)}")
+        
+        # Cleanup
+        for wash_id in created_ids:
+            try:
+                self.session.delete(f"{self.base_url}/lavagens/{wash_id}")
+            except:
+                pass
+    
     def test_custom_washers(self):
         """Test custom washers management"""
         print("\n=== Testing Custom Washers Management ===")
@@ -324,6 +394,7 @@ class HPDBackendTester:
         self.test_wash_registration_crud()
         self.test_daily_washes()
         self.test_monthly_washes()
+        self.test_bulk_registration()
         self.test_custom_washers()
         self.test_external_companies()
         
@@ -118,6 +118,60 @@ const App = () => {
   );
 };
 
+// Lookup lists and the recent wash list, kept in localStorage and brought up to
+// date through /api/sync deltas instead of downloading them again on every screen
+const SYNC_STORAGE_KEY = 'hpdlav-sync';
+const SYNC_WASH_LIMIT = 1000;
+
+const byName = (a, b) => a.nome.localeCompare(b.nome, 'pt', { sensitivity: 'base' });
+const byNewest = (a, b) => (a.created_at < b.created_at ? 1 : a.created_at > b.created_at ? -1 : 0);
+
+const mergeChanges = (list, inserted, deleted, order) => {
+  const removed = new Set([...(deleted || []), ...inserted.map(item => item.id)]);
+  return list.filter(item => !removed.has(item.id)).concat(inserted).sort(order);
+};
+
+const loadSyncedLists = async () => {
+  const cached = JSON.parse(localStorage.getItem(SYNC_STORAGE_KEY) || 'null');
+  if (cached) {
+    let lists = cached;
+    let reset = false;
+    while (true) {
+      const { data } = await axios.get(`${API}/sync`, { params: { since: lists.token } });
+      if (data.reset) {
+        reset = true;
+        break;
+      }
+      lists = {
+        token: data.token,
+        lavagens: mergeChanges(lists.lavagens, data.lavagens, data.eliminados.lavagens, byNewest).slice(0, SYNC_WASH_LIMIT),
+        lavadores: mergeChanges(lists.lavadores, data.lavadores, data.eliminados.lavadores, byName),
+        empresas_externas: mergeChanges(lists.empresas_externas, data.empresas_externas, data.eliminados.empresas_externas, byName)
+      };
+      if (!data.has_more) break;
+    }
+    if (!reset) {
+      localStorage.setItem(SYNC_STORAGE_KEY, JSON.stringify(lists));
+      return lists;
+    }
+  }
+  // Token first: anything written while the full lists load is replayed on the next sync
+  const { data } = await axios.get(`${API}/sync`);
+  const [lavagens, lavadores, empresas] = await Promise.all([
+    axios.get(`${API}/lavagens`, { params: { legacy: true } }),
+    axios.get(`${API}/lavadores`),
+    axios.get(`${API}/empresas-externas`)
+  ]);
+  const lists = {
+    token: data.token,
+    lavagens: lavagens.data,
+    lavadores: lavadores.data,
+    empresas_externas: empresas.data
+  };
+  localStorage.setItem(SYNC_STORAGE_KEY, JSON.stringify(lists));
+  return lists;
+};
+
 // Registo Lavagem Component
 const RegistoLavagem = () => {
   const [formData, setFormData] = useState({
@@ -177,25 +231,16 @@ const RegistoLavagem = () => {
   const empresasInternas = ['TPD', 'Hurtrans'];
 
   useEffect(() => {
-    fetchCustomWashers();
-    fetchExternalCompanies();
+    fetchLookups();
   }, []);
 
-  const fetchCustomWashers = async () => {
+  const fetchLookups = async () => {
     try {
-      const response = await axios.get(`${API}/lavadores`);
-      setCustomWashers(response.data);
+      const lists = await loadSyncedLists();
+      setCustomWashers(lists.lavadores);
+      setExternalCompanies(lists.empresas_externas);
     } catch (error) {
-      console.error('Erro ao buscar lavadores:', error);
-    }
-  };
-
-  const fetchExternalCompanies = async () => {
-    try {
-      const response = await axios.get(`${API}/empresas-externas`);
-      setExternalCompanies(response.data);
-    } catch (error) {
-      console.error('Erro ao buscar empresas:', error);
+      console.error('Erro ao buscar lavadores e empresas:', error);
     }
   };
 
@@ -224,7 +269,7 @@ const RegistoLavagem = () => {
       await axios.post(`${API}/lavadores`, { nome: newWasherName });
       setNewWasherName('');
       setShowNewWasher(false);
-      fetchCustomWashers();
+      fetchLookups();
     } catch (error) {
       alert('Erro ao adicionar lavador: ' + (error.response?.data?.detail || 'Erro desconhecido'));
     }
@@ -237,7 +282,7 @@ const RegistoLavagem = () => {
       await axios.post(`${API}/empresas-externas`, { nome: newCompanyName });
       setNewCompanyName('');
       setShowNewCompany(false);
-      fetchExternalCompanies();
+      fetchLookups();
     } catch (error) {
       alert('Erro ao adicionar empresa: ' + (error.response?.data?.detail || 'Erro desconhecido'));
     }
@@ -615,7 +660,13 @@ const RegistoLavagem = () => {
 const Agendamentos = () => {
   const [agendamentos, setAgendamentos] = useState([]);
   const [lavagens, setLavagens] = useState([]);
+  const [stats, setStats] = useState(null);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const [search, setSearch] = useState('');
+  const [searchResults, setSearchResults] = useState(null);
+  const [nextOffset, setNextOffset] = useState(null);
 
   useEffect(() => {
     fetchLavagens();
@@ -623,8 +674,10 @@ const Agendamentos = () => {
 
   const fetchLavagens = async () => {
     try {
-      const response = await axios.get(`${API}/lavagens`);
-      setLavagens(response.data);
+      const response = await axios.get(`${API}/dashboard`, { params: { scope: 'range', limit: 50 } });
+      setLavagens(response.data.items);
+      setNextCursor(response.data.next_cursor);
+      setStats(response.data.stats);
       setLoading(false);
     } catch (error) {
       console.error('Erro ao buscar lavagens:', error);
@@ -632,6 +685,43 @@ const Agendamentos = () => {
     }
   };
 
+  const fetchMoreLavagens = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/lavagens`, { params: { limit: 50, after: nextCursor } });
+      setLavagens([...lavagens, ...response.data.items]);
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error('Erro ao buscar lavagens:', error);
+    }
+    setLoadingMore(false);
+  };
+
+  // Search by plate (any part, with or without dashes) or by words in the observations
+  const searchLavagens = async (e, offset = 0) => {
+    if (e) e.preventDefault();
+    if (search.trim().length < 2) return;
+    setLoadingMore(true);
+    try {
+      const response = await axios.get(`${API}/lavagens/search`, { params: { q: search.trim(), offset } });
+      setSearchResults(offset ? [...searchResults, ...response.data.items] : response.data.items);
+      setNextOffset(response.data.next_offset);
+    } catch (error) {
+      console.error('Erro ao pesquisar lavagens:', error);
+    }
+    setLoadingMore(false);
+  };
+
+  const clearSearch = () => {
+    setSearch('');
+    setSearchResults(null);
+    setNextOffset(null);
+  };
+
+  const rows = searchResults || lavagens;
+  const totalLavagens = stats ? stats.total_lavagens : lavagens.length;
+  const totalValor = stats ? stats.total_valor : lavagens.reduce((sum, l) => sum + l.valor, 0);
+
   if (loading) {
     return (
       <div className="bg-white rounded-lg shadow-md p-8">
@@ -647,12 +737,32 @@ const Agendamentos = () => {
       <div className="flex justify-between items-center mb-6">
         <h2 className="text-2xl font-bold text-gray-800">Todas as Lavagens Registadas</h2>
         <span className="bg-blue-100 text-blue-800 px-3 py-1 rounded-full text-sm font-medium">
-          Total: {lavagens.length}
+          Total: {totalLavagens}
         </span>
       </div>
+
+      <form onSubmit={searchLavagens} className="flex gap-2 mb-6">
+        <input
+          type="text"
+          value={search}
+          onChange={(e) => setSearch(e.target.value)}
+          placeholder="Pesquisar por matrícula ou observações"
+          className="flex-1 px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+        />
+        <button type="submit" className="bg-blue-600 text-white py-2 px-4 rounded-md hover:bg-blue-700">
+          Pesquisar
+        </button>
+        {searchResults && (
+          <button type="button" onClick={clearSearch} className="bg-gray-200 text-gray-800 py-2 px-4 rounded-md hover:bg-gray-300">
+            Limpar
+          </button>
+        )}
+      </form>
       
-      {lavagens.length === 0 ? (
-        <p className="text-gray-600 text-center py-8">Nenhuma lavagem registada ainda.</p>
+      {rows.length === 0 ? (
+        <p className="text-gray-600 text-center py-8">
+          {searchResults ? 'Nenhuma lavagem encontrada.' : 'Nenhuma lavagem registada ainda.'}
+        </p>
       ) : (
         <div className="table-container overflow-x-auto">
           <table className="min-w-full table-auto">
@@ -669,7 +779,7 @@ const Agendamentos = () => {
               </tr>
             </thead>
             <tbody>
-              {lavagens.map((lavagem) => (
+              {rows.map((lavagem) => (
                 <tr key={lavagem.id} className="table-row hover:bg-gray-50">
                   <td className="px-4 py-2 text-sm text-gray-900 border-b">
                     {new Date(lavagem.data).toLocaleDateString('pt-PT')}
@@ -711,17 +821,41 @@ const Agendamentos = () => {
               ))}
             </tbody>
           </table>
+
+          {searchResults && nextOffset !== null && (
+            <div className="flex justify-center mt-4">
+              <button
+                onClick={() => searchLavagens(null, nextOffset)}
+                disabled={loadingMore}
+                className="bg-blue-600 text-white py-2 px-6 rounded-md hover:bg-blue-700 disabled:opacity-50"
+              >
+                {loadingMore ? 'A carregar...' : 'Mais resultados'}
+              </button>
+            </div>
+          )}
+
+          {!searchResults && nextCursor && (
+            <div className="flex justify-center mt-4">
+              <button
+                onClick={fetchMoreLavagens}
+                disabled={loadingMore}
+                className="bg-blue-600 text-white py-2 px-6 rounded-md hover:bg-blue-700 disabled:opacity-50"
+              >
+                {loadingMore ? 'A carregar...' : `Carregar mais (${lavagens.length} de ${totalLavagens})`}
+              </button>
+            </div>
+          )}
           
           <div className="mt-4 p-4 bg-gray-50 rounded">
             <div className="grid grid-cols-1 md:grid-cols-3 gap-4 text-sm">
               <div>
-                <strong>Total de Lavagens:</strong> {lavagens.length}
+                <strong>Total de Lavagens:</strong> {totalLavagens}
               </div>
               <div>
-                <strong>Valor Total:</strong> €{lavagens.reduce((sum, l) => sum + l.valor, 0).toFixed(2)}
+                <strong>Valor Total:</strong> €{totalValor.toFixed(2)}
               </div>
               <div>
-                <strong>Valor Médio:</strong> €{lavagens.length > 0 ? (lavagens.reduce((sum, l) => sum + l.valor, 0) / lavagens.length).toFixed(2) : '0.00'}
+                <strong>Valor Médio:</strong> €{totalLavagens > 0 ? (totalValor / totalLavagens).toFixed(2) : '0.00'}
               </div>
             </div>
           </div>
@@ -731,6 +865,36 @@ const Agendamentos = () => {
   );
 };
 
+// Every wash of a dashboard view plus its stats; stats come with the first page only
+const fetchDashboard = async (params) => {
+  const response = await axios.get(`${API}/dashboard`, { params: { ...params, limit: 500 } });
+  let { items, next_cursor: cursor } = response.data;
+  while (cursor) {
+    const page = await axios.get(`${API}/dashboard`, { params: { ...params, limit: 500, stats: false, after: cursor } });
+    items = items.concat(page.data.items);
+    cursor = page.data.next_cursor;
+  }
+  return { items, stats: response.data.stats };
+};
+
+// Apply a stats delta from the live feed; counters that drop to zero disappear
+const applyStatsDelta = (stats, delta) => {
+  const updated = { ...stats };
+  Object.entries(delta).forEach(([key, value]) => {
+    if (typeof value === 'number') {
+      updated[key] = (updated[key] || 0) + value;
+      return;
+    }
+    const counts = { ...(updated[key] || {}) };
+    Object.entries(value).forEach(([name, count]) => {
+      counts[name] = (counts[name] || 0) + count;
+      if (counts[name] <= 0) delete counts[name];
+    });
+    updated[key] = counts;
+  });
+  return updated;
+};
+
 // Dia Atual Component
 const DiaAtual = () => {
   const [todayWashes, setTodayWashes] = useState([]);
@@ -738,17 +902,38 @@ const DiaAtual = () => {
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
-    fetchTodayData();
+    if (typeof EventSource === 'undefined') {
+      fetchTodayData();
+      return undefined;
+    }
+    // Live feed: a snapshot first, then every insert/delete as it happens
+    const source = new EventSource(`${API}/lavagens/stream`);
+    source.addEventListener('snapshot', (event) => {
+      const snapshot = JSON.parse(event.data);
+      setTodayWashes(snapshot.lavagens);
+      setTodayStats(snapshot.stats);
+      setLoading(false);
+    });
+    source.addEventListener('insert', (event) => {
+      const { lavagem, delta } = JSON.parse(event.data);
+      setTodayWashes((washes) => [lavagem, ...washes]);
+      setTodayStats((stats) => applyStatsDelta(stats, delta));
+    });
+    source.addEventListener('delete', (event) => {
+      const { id, delta } = JSON.parse(event.data);
+      setTodayWashes((washes) => washes.filter((wash) => wash.id !== id));
+      setTodayStats((stats) => applyStatsDelta(stats, delta));
+    });
+    // EventSource reconnects by itself and receives a fresh snapshot
+    source.onerror = () => setLoading(false);
+    return () => source.close();
   }, []);
 
   const fetchTodayData = async () => {
     try {
-      const [washesResponse, statsResponse] = await Promise.all([
-        axios.get(`${API}/lavagens/today`),
-        axios.get(`${API}/lavagens/stats/today`)
-      ]);
-      setTodayWashes(washesResponse.data);
-      setTodayStats(statsResponse.data);
+      const { items, stats } = await fetchDashboard({ scope: 'today' });
+      setTodayWashes(items);
+      setTodayStats(stats);
       setLoading(false);
     } catch (error) {
       console.error('Erro ao buscar dados de hoje:', error);
@@ -891,14 +1076,9 @@ const Mensal = () => {
     try {
       const year = currentDate.getFullYear();
       const month = currentDate.getMonth() + 1;
-      
-      const [washesResponse, statsResponse] = await Promise.all([
-        axios.get(`${API}/lavagens/month/${year}/${month}`),
-        axios.get(`${API}/lavagens/stats/month/${year}/${month}`)
-      ]);
-      
-      setMonthWashes(washesResponse.data);
-      setMonthStats(statsResponse.data);
+      const { items, stats } = await fetchDashboard({ scope: 'month', year, month });
+      setMonthWashes(items);
+      setMonthStats(stats);
       setLoading(false);
     } catch (error) {
       console.error('Erro ao buscar dados mensais:', error);
@@ -1072,6 +1252,9 @@ const Mensal = () => {
 const Relatorios = () => {
   const [allStats, setAllStats] = useState(null);
   const [allWashes, setAllWashes] = useState([]);
+  const [monthlySeries, setMonthlySeries] = useState(null);
+  const [washerRevenue, setWasherRevenue] = useState(null);
+  const [companyRevenue, setCompanyRevenue] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -1080,13 +1263,19 @@ const Relatorios = () => {
 
   const fetchAllData = async () => {
     try {
-      const [statsResponse, washesResponse] = await Promise.all([
+      const [statsResponse, washesResponse, seriesResponse, washerResponse, companyResponse] = await Promise.all([
         axios.get(`${API}/lavagens/stats`),
-        axios.get(`${API}/lavagens`)
+        axios.get(`${API}/lavagens`, { params: { limit: 10 } }),
+        axios.get(`${API}/lavagens/series`, { params: { bucket: 'month' } }),
+        axios.get(`${API}/lavagens/analytics`, { params: { group_by: 'lavador', top: 20 } }),
+        axios.get(`${API}/lavagens/analytics`, { params: { group_by: 'empresa_nome', empresa_tipo: 'externa', top: 20 } })
       ]);
       
       setAllStats(statsResponse.data);
-      setAllWashes(washesResponse.data);
+      setAllWashes(washesResponse.data.items);
+      setMonthlySeries(seriesResponse.data);
+      setWasherRevenue(washerResponse.data);
+      setCompanyRevenue(companyResponse.data);
       setLoading(false);
     } catch (error) {
       console.error('Erro ao buscar dados dos relatórios:', error);
@@ -1129,11 +1318,11 @@ const Relatorios = () => {
             <div className="bg-purple-50 p-4 rounded-lg">
               <h3 className="text-lg font-semibold text-purple-800">Período</h3>
               <p className="text-lg font-bold text-purple-600">
-                {allWashes.length > 0 ? (
+                {monthlySeries && monthlySeries.inicio ? (
                   <>
-                    <div className="text-sm">{new Date(Math.min(...allWashes.map(w => new Date(w.data)))).toLocaleDateString('pt-PT')}</div>
+                    <div className="text-sm">{new Date(monthlySeries.inicio).toLocaleDateString('pt-PT')}</div>
                     <div className="text-xs">até</div>
-                    <div className="text-sm">{new Date(Math.max(...allWashes.map(w => new Date(w.data)))).toLocaleDateString('pt-PT')}</div>
+                    <div className="text-sm">{new Date(monthlySeries.fim).toLocaleDateString('pt-PT')}</div>
                   </>
                 ) : 'N/A'}
               </p>
@@ -1239,6 +1428,107 @@ const Relatorios = () => {
         </div>
       )}
 
+      {/* Monthly Evolution */}
+      {monthlySeries && monthlySeries.pontos.length > 0 && (
+        <div className="bg-white rounded-lg shadow-md p-6">
+          <h3 className="text-xl font-bold text-gray-800 mb-4">Evolução Mensal</h3>
+          <div className="table-container overflow-x-auto">
+            <table className="min-w-full table-auto">
+              <thead className="bg-gray-50">
+                <tr>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Mês</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Lavagens</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Valor</th>
+                </tr>
+              </thead>
+              <tbody>
+                {monthlySeries.pontos.slice().reverse().map((ponto) => (
+                  <tr key={ponto.periodo} className="table-row hover:bg-gray-50">
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">
+                      {new Date(ponto.periodo).toLocaleDateString('pt-PT', { month: 'long', year: 'numeric' })}
+                    </td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">
+                      <div className="flex items-center gap-2">
+                        <div className="bg-blue-200 rounded-full h-2 flex-1 min-w-[40px]">
+                          <div
+                            className="bg-blue-600 h-2 rounded-full"
+                            style={{width: `${(ponto.total_lavagens / Math.max(1, ...monthlySeries.pontos.map(p => p.total_lavagens))) * 100}%`}}
+                          ></div>
+                        </div>
+                        <span className="font-medium text-sm w-10 text-right">{ponto.total_lavagens}</span>
+                      </div>
+                    </td>
+                    <td className="px-4 py-2 text-sm font-medium text-gray-900 border-b">€{ponto.total_valor.toFixed(2)}</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        </div>
+      )}
+
+      {/* Revenue per Washer (shared jobs split evenly) */}
+      {washerRevenue && washerRevenue.grupos.length > 0 && (
+        <div className="bg-white rounded-lg shadow-md p-6">
+          <h3 className="text-xl font-bold text-gray-800 mb-4">Receita por Lavador</h3>
+          <div className="table-container overflow-x-auto">
+            <table className="min-w-full table-auto">
+              <thead className="bg-gray-50">
+                <tr>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Lavador</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Lavagens</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Receita Atribuída</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Ticket Médio</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Quota</th>
+                </tr>
+              </thead>
+              <tbody>
+                {washerRevenue.grupos.map((grupo) => (
+                  <tr key={grupo.nome} className="table-row hover:bg-gray-50">
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">{grupo.nome}</td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">{grupo.lavagens}</td>
+                    <td className="px-4 py-2 text-sm font-medium text-gray-900 border-b">€{grupo.valor.toFixed(2)}</td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">€{grupo.ticket_medio.toFixed(2)}</td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">{(grupo.quota * 100).toFixed(1)}%</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        </div>
+      )}
+
+      {/* External Companies */}
+      {companyRevenue && companyRevenue.grupos.length > 0 && (
+        <div className="bg-white rounded-lg shadow-md p-6">
+          <h3 className="text-xl font-bold text-gray-800 mb-4">Empresas Externas</h3>
+          <div className="table-container overflow-x-auto">
+            <table className="min-w-full table-auto">
+              <thead className="bg-gray-50">
+                <tr>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Empresa</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Lavagens</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Valor</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Ticket Médio</th>
+                  <th className="px-4 py-2 text-left text-sm font-medium text-gray-700 border-b">Quota</th>
+                </tr>
+              </thead>
+              <tbody>
+                {companyRevenue.grupos.map((grupo) => (
+                  <tr key={grupo.nome} className="table-row hover:bg-gray-50">
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">{grupo.nome}</td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">{grupo.lavagens}</td>
+                    <td className="px-4 py-2 text-sm font-medium text-gray-900 border-b">€{grupo.valor.toFixed(2)}</td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">€{grupo.ticket_medio.toFixed(2)}</td>
+                    <td className="px-4 py-2 text-sm text-gray-900 border-b">{(grupo.quota * 100).toFixed(1)}%</td>
+                  </tr>
+                ))}
+              </tbody>
+            </table>
+          </div>
+        </div>
+      )}
+
       {/* Recent Washes Summary */}
       <div className="bg-white rounded-lg shadow-md p-6">
         <h3 className="text-xl font-bold text-gray-800 mb-4">Resumo das Últimas 10 Lavagens</h3>
@@ -1320,15 +1610,10 @@ const Configuracoes = () => {
 
   const fetchAllData = async () => {
     try {
-      const [lavagemResponse, washersResponse, companiesResponse] = await Promise.all([
-        axios.get(`${API}/lavagens`),
-        axios.get(`${API}/lavadores`),
-        axios.get(`${API}/empresas-externas`)
-      ]);
-      
-      setLavagens(lavagemResponse.data);
-      setCustomWashers(washersResponse.data);
-      setExternalCompanies(companiesResponse.data);
+      const lists = await loadSyncedLists();
+      setLavagens(lists.lavagens);
+      setCustomWashers(lists.lavadores);
+      setExternalCompanies(lists.empresas_externas);
       setLoading(false);
     } catch (error) {
       console.error('Erro ao buscar dados:', error);
@@ -0,0 +1,737 @@
+"""
+API tests against the in-memory storage engine (no MongoDB needed)
+
+Run from the repository root: python -m pytest -q tests
+"""
+
+import asyncio
+import csv
+import io
+import json
+import os
+import sys
+import time
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+import metrics  # noqa: E402
+import server  # noqa: E402
+from archive import archive_before  # noqa: E402
+from limits import RouteLimiter  # noqa: E402
+from models import WashRegistration  # noqa: E402
+from reports import breakdowns, snapshot  # noqa: E402
+from repositories import DuplicateError  # noqa: E402
+from repositories.sqlite import SqliteStorage  # noqa: E402
+
+
+def wash(**overrides):
+    lavagem = {
+        "data": "2024-03-05",
+        "tipo_veiculo": "Cisterna",
+        "area_negocio": "Alimentar",
+        "lavadores": ["Ana"],
+        "tipo_lavagem": "Exterior",
+        "empresa_tipo": "interna",
+        "empresa_nome": "HPD",
+        "valor": 10.0,
+    }
+    lavagem.update(overrides)
+    return lavagem
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setenv("STORAGE_BACKEND", "memory")
+    monkeypatch.setenv("ARCHIVE_DIR", str(tmp_path / "arquivo"))
+    # The response cache is module-wide; each test starts with an empty store
+    server.response_cache.clear()
+    with TestClient(server.app) as client:
+        yield client
+
+
+@pytest.fixture
+def washes(client):
+    for lavagem in [
+        wash(),
+        wash(data="2024-03-06", lavadores=["Ana", "Rui"], valor=30.0),
+        wash(data="2024-03-20", area_negocio="Química", tipo_veiculo="Porta-contentores", valor=20.0),
+        wash(data="2024-04-02", empresa_tipo="externa", empresa_nome="Transportes Silva", valor=15.0),
+        wash(data="2024-03-10", empresa_tipo="externa", empresa_nome="Transportes Silva", valor=25.0),
+        wash(data="2024-03-11", empresa_tipo="externa", empresa_nome="Frio Norte", lavadores=["Rui"], valor=40.0),
+    ]:
+        assert client.post("/api/lavagens", json=lavagem).status_code == 200
+
+
+# Registration and idempotency keys
+
+def test_replayed_idempotency_key_returns_the_original(client):
+    first = client.post("/api/lavagens", json=wash(idempotency_key="k1")).json()
+    replay = client.post("/api/lavagens", json=wash(idempotency_key="k1", valor=99.0)).json()
+    assert replay["id"] == first["id"]
+    assert replay["valor"] == 10.0
+    assert len(client.get("/api/lavagens").json()["items"]) == 1
+
+
+@pytest.mark.parametrize("key", ["", "   ", None])
+def test_blank_idempotency_key_is_no_key(client, key):
+    first = client.post("/api/lavagens", json=wash(idempotency_key=key)).json()
+    second = client.post("/api/lavagens", json=wash(idempotency_key=key)).json()
+    assert first["id"] != second["id"]
+    assert len(client.get("/api/lavagens").json()["items"]) == 2
+
+
+def test_idempotency_key_is_never_returned(client):
+    created = client.post("/api/lavagens", json=wash(idempotency_key="segredo", matricula_trator="AA-00-BB")).json()
+    token = client.get("/api/sync").json()["token"]
+    client.post("/api/lavagens", json=wash(idempotency_key="outro"))
+    responses = [
+        created,
+        client.post("/api/lavagens", json=wash(idempotency_key="segredo")).json(),
+        *client.get("/api/lavagens").json()["items"],
+        *client.get("/api/lavagens", params={"legacy": True}).json(),
+        *client.get("/api/lavagens/search", params={"q": "AA00"}).json()["items"],
+        *client.get("/api/sync", params={"since": token}).json()["lavagens"],
+    ]
+    assert all("idempotency_key" not in lavagem for lavagem in responses)
+    assert "segredo" not in client.get("/api/lavagens/export", params={"format": "ndjson"}).text
+
+
+PUBLIC_FIELDS = {
+    "id", "data", "tipo_veiculo", "area_negocio", "lavadores", "tipo_lavagem",
+    "empresa_tipo", "empresa_nome", "matricula_trator", "matricula_reboque",
+    "valor", "observacoes", "created_at",
+}
+
+
+def test_public_wash_fields_match_the_baseline(client, washes):
+    token = client.get("/api/sync").json()["token"]
+    created = client.post("/api/lavagens", json=wash(matricula_trator="AA-00-BB", observacoes="lama")).json()
+    responses = [
+        created,
+        *client.get("/api/lavagens").json()["items"],
+        *client.get("/api/lavagens", params={"legacy": True}).json(),
+        *client.get("/api/lavagens/month/2024/3").json()["items"],
+        *client.get("/api/lavagens/search", params={"q": "AA00"}).json()["items"],
+        *client.get("/api/lavagens/search", params={"q": "lama"}).json()["items"],
+        *client.get("/api/dashboard", params={"scope": "month", "year": 2024, "month": 3}).json()["items"],
+        *client.get("/api/sync", params={"since": token}).json()["lavagens"],
+    ]
+    assert len(responses) == 30
+    assert all(set(lavagem) == PUBLIC_FIELDS for lavagem in responses)
+
+
+def test_bulk_reports_each_item(client):
+    client.post("/api/lavagens", json=wash(idempotency_key="k1"))
+    result = client.post("/api/lavagens/bulk", json=[
+        wash(),
+        wash(idempotency_key="k1"),
+        {"data": "2024-03-05"},
+        wash(idempotency_key="k2"),
+        wash(idempotency_key="k2"),
+        wash(idempotency_key=""),
+    ]).json()
+    assert (result["criadas"], result["duplicadas"], result["falhadas"]) == (3, 2, 1)
+    assert [item["status"] for item in result["resultados"]] == [
+        "criada", "duplicada", "invalida", "criada", "duplicada", "criada",
+    ]
+    assert result["resultados"][4]["id"] == result["resultados"][3]["id"]
+    assert len(client.get("/api/lavagens").json()["items"]) == 4
+
+
+def test_memory_engine_rejects_a_duplicate_id(client):
+    repo = server.app.state.storage.lavagens
+    lavagem = WashRegistration(**wash())
+    asyncio.run(repo.create(lavagem))
+    with pytest.raises(DuplicateError):
+        asyncio.run(repo.create(WashRegistration(**wash(id=lavagem.id, valor=99.0))))
+    [result] = asyncio.run(repo.create_many([WashRegistration(**wash(id=lavagem.id))]))
+    assert result.status == "erro"
+    assert [item["valor"] for item in client.get("/api/lavagens").json()["items"]] == [lavagem.valor]
+
+
+def test_bulk_rejects_oversized_batches(client):
+    response = client.post("/api/lavagens/bulk", json=[wash()] * (server.BULK_MAX_ITEMS + 1))
+    assert response.status_code == 413
+
+
+# Paging
+
+def all_pages(client, path, **params):
+    ids = []
+    page = client.get(path, params={"limit": 2, **params}).json()
+    ids += [lavagem["id"] for lavagem in page["items"]]
+    while page["next_cursor"]:
+        page = client.get(path, params={"limit": 2, "after": page["next_cursor"], **params}).json()
+        ids += [lavagem["id"] for lavagem in page["items"]]
+    return ids
+
+
+@pytest.mark.usefixtures("washes")
+@pytest.mark.parametrize("path", ["/api/lavagens", "/api/lavagens/month/2024/3"])
+def test_cursor_pages_match_the_legacy_list(client, path):
+    legacy = [lavagem["id"] for lavagem in client.get(path, params={"legacy": True}).json()]
+    assert len(legacy) == (6 if path == "/api/lavagens" else 5)
+    # Newest first, each wash once
+    assert all_pages(client, path) == legacy
+
+
+@pytest.mark.usefixtures("washes")
+def test_month_page_stays_in_the_month(client):
+    page = client.get("/api/lavagens/month/2024/4").json()
+    assert [lavagem["data"] for lavagem in page["items"]] == ["2024-04-02"]
+    assert page["next_cursor"] is None
+
+
+@pytest.mark.parametrize("path", ["/api/lavagens", "/api/lavagens/today", "/api/lavagens/month/2024/3", "/api/dashboard"])
+def test_bad_cursor_is_rejected(client, path):
+    response = client.get(path, params={"after": "não-é-um-cursor"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Cursor inválido"
+
+
+# Export
+
+@pytest.mark.usefixtures("washes")
+def test_export_csv(client):
+    response = client.get("/api/lavagens/export", params={"from": "2024-03-06", "to": "2024-03-31"})
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == 'attachment; filename="lavagens.csv"'
+    linhas = list(csv.DictReader(io.StringIO(response.text)))
+    assert list(linhas[0]) == server.EXPORT_FIELDS
+    # In date order, several washers in one cell
+    assert [linha["data"] for linha in linhas] == ["2024-03-06", "2024-03-10", "2024-03-11", "2024-03-20"]
+    assert linhas[0]["lavadores"] == "Ana; Rui"
+
+
+@pytest.mark.usefixtures("washes")
+def test_export_ndjson(client):
+    response = client.get("/api/lavagens/export", params={"format": "ndjson"})
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    lavagens = [json.loads(line) for line in response.text.splitlines()]
+    assert len(lavagens) == 6
+    assert all(list(lavagem) == server.EXPORT_FIELDS for lavagem in lavagens)
+
+
+def test_export_streams_in_chunks(monkeypatch):
+    monkeypatch.setattr(server, "EXPORT_CHUNK_BYTES", 1)
+
+    async def chunks(export):
+        async def lavagens():
+            for valor in (1.0, 2.0, 3.0):
+                yield {**wash(valor=valor), "id": str(valor), "created_at": "2024-03-05T10:00:00"}
+        return [chunk async for chunk in export(lavagens())]
+
+    # The CSV header goes out on its own, before the first wash is read
+    assert len(asyncio.run(chunks(server._export_csv))) == 5
+    assert len([chunk for chunk in asyncio.run(chunks(server._export_ndjson)) if chunk]) == 3
+
+
+def test_export_releases_its_slot(client):
+    # More sequential downloads than the limiter has slots and queue places (2 + 4)
+    for _ in range(8):
+        assert client.get("/api/lavagens/export").status_code == 200
+
+
+def test_export_rejects_unknown_formats(client):
+    assert client.get("/api/lavagens/export", params={"format": "xlsx"}).status_code == 422
+
+
+# Search
+
+def search(client, q, **params):
+    return client.get("/api/lavagens/search", params={"q": q, **params}).json()
+
+
+def test_search_by_plate_prefix(client):
+    trator = client.post("/api/lavagens", json=wash(matricula_trator="aa-12 bc")).json()
+    reboque = client.post("/api/lavagens", json=wash(matricula_reboque="AA 13-ZZ")).json()
+    client.post("/api/lavagens", json=wash(matricula_trator="BB-12-CC"))
+    # Separators and case ignored, newest first
+    assert [lavagem["id"] for lavagem in search(client, "AA1")["items"]] == [reboque["id"], trator["id"]]
+    assert [lavagem["id"] for lavagem in search(client, "aa-12")["items"]] == [trator["id"]]
+    assert search(client, "ZZ99")["items"] == []
+
+
+def test_search_observacoes(client):
+    uma = client.post("/api/lavagens", json=wash(observacoes="Lama na cisterna")).json()
+    duas = client.post("/api/lavagens", json=wash(observacoes="Cisterna com lama e óleo")).json()
+    client.post("/api/lavagens", json=wash(observacoes="Sem notas"))
+    # Accents and case ignored; more words matched ranks first
+    assert [lavagem["id"] for lavagem in search(client, "OLEO lama")["items"]] == [duas["id"], uma["id"]]
+
+
+def test_plate_hits_rank_above_text_hits(client):
+    texto = client.post("/api/lavagens", json=wash(observacoes="reboque AA12 riscado")).json()
+    ambos = client.post("/api/lavagens", json=wash(matricula_trator="AA-12-BC", observacoes="aa12")).json()
+    assert [lavagem["id"] for lavagem in search(client, "aa12")["items"]] == [ambos["id"], texto["id"]]
+
+
+def test_search_pages_by_offset(client):
+    for valor in (1.0, 2.0, 3.0):
+        client.post("/api/lavagens", json=wash(matricula_trator=f"CC-0{int(valor)}-DD", valor=valor))
+    first = search(client, "CC", limit=2)
+    assert [lavagem["valor"] for lavagem in first["items"]] == [3.0, 2.0]
+    rest = search(client, "CC", limit=2, offset=first["next_offset"])
+    assert [lavagem["valor"] for lavagem in rest["items"]] == [1.0]
+    assert rest["next_offset"] is None
+
+
+def test_search_forgets_deleted_washes(client):
+    lavagem = client.post("/api/lavagens", json=wash(matricula_trator="EE-01-FF", observacoes="palha")).json()
+    client.delete(f"/api/lavagens/{lavagem['id']}")
+    assert search(client, "EE01")["items"] == []
+    assert search(client, "palha")["items"] == []
+
+
+def test_search_covers_archived_months(client):
+    antiga = client.post("/api/lavagens", json=wash(data="2024-01-10", matricula_trator="GG-01-HH", observacoes="arquivo")).json()
+    archive(client, date(2024, 2, 1))
+    assert [lavagem["id"] for lavagem in search(client, "GG01")["items"]] == [antiga["id"]]
+    assert [lavagem["id"] for lavagem in search(client, "arquivo")["items"]] == [antiga["id"]]
+
+
+@pytest.mark.parametrize("params", [{"q": "a"}, {"q": "aa", "limit": 101}, {"q": "aa", "offset": 1001}])
+def test_search_rejects_bad_queries(client, params):
+    assert client.get("/api/lavagens/search", params=params).status_code == 422
+
+
+# Response cache
+
+@pytest.mark.usefixtures("washes")
+def test_etag_revalidation(client):
+    first = client.get("/api/lavagens/stats")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"] == "no-cache"
+
+    again = client.get("/api/lavagens/stats", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["etag"] == etag
+    assert client.get("/api/lavagens/stats", headers={"If-None-Match": f'"outra", {etag}'}).status_code == 304
+    assert client.get("/api/lavagens/stats", headers={"If-None-Match": '"outra"'}).json() == first.json()
+
+
+@pytest.mark.usefixtures("washes")
+def test_writes_invalidate_cached_responses(client):
+    etag = client.get("/api/lavagens/stats").headers["etag"]
+    criada = client.post("/api/lavagens", json=wash(valor=5.0)).json()
+    after_insert = client.get("/api/lavagens/stats", headers={"If-None-Match": etag})
+    assert after_insert.status_code == 200
+    assert after_insert.json()["total_lavagens"] == 7
+
+    client.delete(f"/api/lavagens/{criada['id']}")
+    after_delete = client.get("/api/lavagens/stats", headers={"If-None-Match": after_insert.headers["etag"]})
+    assert after_delete.status_code == 200
+    assert after_delete.json()["total_lavagens"] == 6
+    # Same body, same ETag
+    assert after_delete.headers["etag"] == etag
+
+
+@pytest.mark.usefixtures("washes")
+def test_invalidation_is_per_collection(client):
+    stats = client.get("/api/lavagens/stats").headers["etag"]
+    lavadores = client.get("/api/lavadores")
+    client.post("/api/lavadores", json={"nome": "Zé"})
+    assert client.get("/api/lavagens/stats", headers={"If-None-Match": stats}).status_code == 304
+    refreshed = client.get("/api/lavadores", headers={"If-None-Match": lavadores.headers["etag"]})
+    assert refreshed.status_code == 200
+    assert [lavador["nome"] for lavador in refreshed.json()] == ["Zé"]
+
+
+# Load shedding and deadlines
+
+def shed_count(client, route_class, reason):
+    for line in client.get("/metrics").text.splitlines():
+        if line.startswith(f'hpd_shed_requests_total{{reason="{reason}",route_class="{route_class}"}}'):
+            return float(line.split()[-1])
+    return 0.0
+
+
+def test_saturated_route_is_shed_with_retry_after(client, monkeypatch):
+    # No slot and no queue: every request is refused straight away
+    monkeypatch.setattr(server, "stats_limiter", RouteLimiter("stats", concurrency=0, queue=0, retry_after=7))
+    shed = shed_count(client, "stats", "overloaded")
+    response = client.get("/api/lavagens/stats")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "7"
+    assert shed_count(client, "stats", "overloaded") == shed + 1
+    # Other route classes are unaffected
+    assert client.get("/api/lavagens/month/2024/3").status_code == 200
+
+
+def test_saturated_export_is_refused_before_streaming(client, monkeypatch):
+    monkeypatch.setattr(server, "export_limiter", RouteLimiter("export", concurrency=0, queue=0))
+    response = client.get("/api/lavagens/export")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "2"
+
+
+def test_slow_query_hits_the_deadline(client, monkeypatch):
+    monkeypatch.setattr(server, "month_limiter", RouteLimiter("month", concurrency=1, queue=0, deadline=0.05))
+    repo = server.app.state.storage.lavagens
+    list_washes = repo.list
+
+    async def slow_list(*args, **kwargs):
+        await asyncio.sleep(1)
+        return await list_washes(*args, **kwargs)
+
+    monkeypatch.setattr(repo, "list", slow_list)
+    shed = shed_count(client, "month", "deadline")
+    response = client.get("/api/lavagens/month/2024/3")
+    assert response.status_code == 504
+    assert response.json()["detail"] == "A consulta excedeu o tempo limite"
+    assert shed_count(client, "month", "deadline") == shed + 1
+
+    # The abandoned query gave its slot back
+    monkeypatch.setattr(repo, "list", list_washes)
+    assert client.get("/api/lavagens/month/2024/3").status_code == 200
+
+
+# Live feed
+
+class Connected:
+    async def is_disconnected(self):
+        return False
+
+
+def sse(chunk: bytes):
+    event, data = chunk.decode().strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_live_feed_follows_todays_washes(client):
+    today = date.today().isoformat()
+    antes = client.post("/api/lavagens", json=wash(data=today, valor=5.0)).json()
+    events = server._today_events(Connected(), server.app.state.storage.lavagens)
+
+    async def next_event():
+        return sse(await anext(events))
+
+    try:
+        kind, snapshot = client.portal.call(next_event)
+        assert kind == "snapshot"
+        assert [lavagem["id"] for lavagem in snapshot["lavagens"]] == [antes["id"]]
+        assert snapshot["stats"]["total_lavagens"] == 1
+
+        # Other days are not part of the feed
+        client.post("/api/lavagens", json=wash(data="2024-03-05"))
+        nova = client.post("/api/lavagens", json=wash(data=today, valor=7.0)).json()
+        kind, event = client.portal.call(next_event)
+        assert kind == "insert"
+        assert event["lavagem"] == nova
+        assert (event["delta"]["total_lavagens"], event["delta"]["total_valor"]) == (1, 7.0)
+
+        client.delete(f"/api/lavagens/{antes['id']}")
+        kind, event = client.portal.call(next_event)
+        assert (kind, event["id"]) == ("delete", antes["id"])
+        assert (event["delta"]["total_lavagens"], event["delta"]["total_valor"]) == (-1, -5.0)
+    finally:
+        client.portal.call(events.aclose)
+
+
+def test_live_feed_resends_a_snapshot_after_lost_events(client):
+    today = date.today().isoformat()
+    events = server._today_events(Connected(), server.app.state.storage.lavagens)
+
+    async def next_event():
+        return sse(await anext(events))
+
+    try:
+        assert client.portal.call(next_event)[0] == "snapshot"
+        lavagem = client.post("/api/lavagens", json=wash(data=today)).json()
+        server.broker.resync()
+        # What was queued before the loss still goes out, then a fresh snapshot
+        assert client.portal.call(next_event)[0] == "insert"
+        kind, snapshot = client.portal.call(next_event)
+        assert kind == "snapshot"
+        assert [entry["id"] for entry in snapshot["lavagens"]] == [lavagem["id"]]
+    finally:
+        client.portal.call(events.aclose)
+
+
+# Cross-worker coherency
+
+@pytest.fixture
+def sqlite_client(tmp_path, monkeypatch):
+    # SQLite is shared between workers, so the app follows the change log
+    monkeypatch.setenv("STORAGE_BACKEND", "sqlite")
+    monkeypatch.setenv("SQLITE_PATH", str(tmp_path / "lavagens.db"))
+    monkeypatch.setenv("ARCHIVE_DIR", str(tmp_path / "arquivo"))
+    monkeypatch.setenv("CHANGE_POLL_SECONDS", "0.05")
+    server.response_cache.clear()
+    with TestClient(server.app) as client:
+        yield client
+
+
+def test_writes_of_another_worker_invalidate_this_one(sqlite_client, tmp_path):
+    client = sqlite_client
+    assert client.get("/api/lavagens/stats").json()["total_lavagens"] == 0
+
+    async def other_worker_registers():
+        storage = SqliteStorage(str(tmp_path / "lavagens.db"))
+        await storage.start()
+        try:
+            lavagem = WashRegistration(**wash())
+            async with storage.transaction():
+                await storage.lavagens.create(lavagem)
+                await storage.changes.append("lavagens", "insert", [lavagem.model_dump()])
+        finally:
+            await storage.close()
+
+    client.portal.call(other_worker_registers)
+    deadline = time.monotonic() + 5
+    while client.get("/api/lavagens/stats").json()["total_lavagens"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert client.get("/api/lavagens/stats").json()["total_lavagens"] == 1
+
+
+# Metrics
+
+def test_unanswered_mongo_commands_are_forgotten(monkeypatch):
+    monkeypatch.setattr(metrics, "COMMANDS_PENDING_MAX", 3)
+    listener = metrics.CommandMetrics()
+    started = [
+        SimpleNamespace(connection_id=("db", 27017), request_id=request_id, command_name="insert",
+                        command={"insert": "lavagens"})
+        for request_id in range(5)
+    ]
+    for event in started:
+        listener.started(event)
+    assert list(listener._pending) == [(("db", 27017), request_id) for request_id in (2, 3, 4)]
+
+    listener.succeeded(SimpleNamespace(**vars(started[4]), duration_micros=1500))
+    assert len(listener._pending) == 2
+    assert 'hpd_mongo_command_duration_seconds_count{collection="lavagens",command="insert"}' in (
+        metrics.generate_latest(metrics.registry).decode()
+    )
+
+
+# Delta sync
+
+def test_sync_without_token_resets(client):
+    page = client.get("/api/sync").json()
+    assert page["reset"] is True
+    assert page["lavagens"] == []
+
+
+def test_sync_returns_inserts_and_deletes_since_token(client):
+    token = client.get("/api/sync").json()["token"]
+    criada = client.post("/api/lavagens", json=wash()).json()
+    eliminada = client.post("/api/lavagens", json=wash(valor=5.0)).json()
+    client.delete(f"/api/lavagens/{eliminada['id']}")
+    lavador = client.post("/api/lavadores", json={"nome": "Zé"}).json()
+
+    page = client.get("/api/sync", params={"since": token}).json()
+    assert page["reset"] is False
+    assert page["has_more"] is False
+    # Changes are net: the wash inserted and then deleted only shows as deleted
+    assert [lavagem["id"] for lavagem in page["lavagens"]] == [criada["id"]]
+    assert page["eliminados"] == {"lavagens": [eliminada["id"]]}
+    assert [entry["id"] for entry in page["lavadores"]] == [lavador["id"]]
+
+    # Nothing new after the returned token
+    page = client.get("/api/sync", params={"since": page["token"]}).json()
+    assert page["lavagens"] == [] and page["eliminados"] == {}
+
+
+def test_sync_pages_with_limit(client):
+    token = client.get("/api/sync").json()["token"]
+    for valor in (1.0, 2.0, 3.0):
+        client.post("/api/lavagens", json=wash(valor=valor))
+    first = client.get("/api/sync", params={"since": token, "limit": 2}).json()
+    assert len(first["lavagens"]) == 2 and first["has_more"] is True
+    rest = client.get("/api/sync", params={"since": first["token"], "limit": 2}).json()
+    assert [lavagem["valor"] for lavagem in rest["lavagens"]] == [3.0]
+
+
+def test_sync_replayed_idempotency_key_is_logged_once(client):
+    token = client.get("/api/sync").json()["token"]
+    client.post("/api/lavagens", json=wash(idempotency_key="k1"))
+    client.post("/api/lavagens", json=wash(idempotency_key="k1"))
+    page = client.get("/api/sync", params={"since": token}).json()
+    assert len(page["lavagens"]) == 1
+
+
+def test_sync_foreign_or_malformed_token(client):
+    assert client.get("/api/sync", params={"since": "outro.0"}).json()["reset"] is True
+    assert client.get("/api/sync", params={"since": "abc"}).status_code == 400
+
+
+# Stats
+
+@pytest.mark.usefixtures("washes")
+@pytest.mark.parametrize("params, total, valor", [
+    ({}, 6, 140.0),
+    ({"from": "2024-03-06", "to": "2024-03-20"}, 4, 115.0),
+    ({"area_negocio": "Química"}, 1, 20.0),
+    ({"lavador": "Rui"}, 2, 70.0),
+    ({"empresa_tipo": "externa"}, 3, 80.0),
+    ({"empresa_nome": "Transportes Silva", "to": "2024-03-31"}, 1, 25.0),
+    ({"tipo_veiculo": "Cisterna", "lavador": "Ana"}, 4, 80.0),
+])
+def test_stats_filters(client, params, total, valor):
+    stats = client.get("/api/lavagens/stats", params=params).json()
+    assert stats["total_lavagens"] == total
+    assert stats["total_valor"] == valor
+
+
+@pytest.mark.usefixtures("washes")
+def test_stats_breakdowns(client):
+    stats = client.get("/api/lavagens/stats", params={"to": "2024-03-31"}).json()
+    assert stats["por_lavador"] == {"Ana": 4, "Rui": 2}
+    assert stats["por_area_negocio"] == {"Alimentar": 4, "Química": 1}
+
+
+@pytest.mark.parametrize("path", ["/api/lavagens/stats", "/api/lavagens/series", "/api/lavagens/analytics"])
+def test_inverted_range_is_rejected(client, path):
+    response = client.get(path, params={"from": "2024-03-02", "to": "2024-03-01"})
+    assert response.status_code == 400
+
+
+# Series
+
+@pytest.mark.usefixtures("washes")
+def test_series_by_month(client):
+    series = client.get("/api/lavagens/series", params={"bucket": "month"}).json()
+    pontos = {ponto["periodo"]: (ponto["total_lavagens"], ponto["total_valor"]) for ponto in series["pontos"]}
+    assert pontos == {"2024-03-01": (5, 125.0), "2024-04-01": (1, 15.0)}
+
+
+@pytest.mark.usefixtures("washes")
+def test_series_fills_empty_days_and_groups(client):
+    series = client.get(
+        "/api/lavagens/series", params={"from": "2024-03-05", "to": "2024-03-07", "group_by": "lavador"}
+    ).json()
+    assert [ponto["periodo"] for ponto in series["pontos"]] == ["2024-03-05", "2024-03-06", "2024-03-07"]
+    assert [ponto["total_lavagens"] for ponto in series["pontos"]] == [1, 1, 0]
+    assert set(series["pontos"][1]["grupos"]) == {"Ana", "Rui"}
+
+
+@pytest.mark.usefixtures("washes")
+def test_series_by_week_starts_on_monday(client):
+    series = client.get("/api/lavagens/series", params={"bucket": "week", "to": "2024-03-31"}).json()
+    assert all(date.fromisoformat(ponto["periodo"]).weekday() == 0 for ponto in series["pontos"])
+    assert sum(ponto["total_lavagens"] for ponto in series["pontos"]) == 5
+
+
+# Analytics
+
+@pytest.mark.usefixtures("washes")
+def test_analytics_splits_shared_jobs_between_washers(client):
+    analytics = client.get("/api/lavagens/analytics", params={"group_by": "lavador"}).json()
+    grupos = {grupo["nome"]: grupo for grupo in analytics["grupos"]}
+    assert analytics["total_lavagens"] == 6
+    assert analytics["total_valor"] == 140.0
+    # The 30.0 job of Ana and Rui credits 15.0 to each
+    assert grupos["Ana"]["valor"] == 10.0 + 15.0 + 20.0 + 15.0 + 25.0
+    assert grupos["Rui"]["valor"] == 15.0 + 40.0
+    assert [grupo["nome"] for grupo in analytics["grupos"]] == ["Ana", "Rui"]
+
+
+@pytest.mark.usefixtures("washes")
+def test_analytics_top_and_sort(client):
+    analytics = client.get(
+        "/api/lavagens/analytics", params={"group_by": "empresa_nome", "sort": "lavagens", "top": 2}
+    ).json()
+    assert [(grupo["nome"], grupo["lavagens"]) for grupo in analytics["grupos"]] == [("HPD", 3), ("Transportes Silva", 2)]
+
+
+def test_reports_credit_washers_like_analytics(client):
+    client.post("/api/lavagens", json=wash(lavadores=["Ana", "Rui"], valor=30.0))
+    client.post("/api/lavagens", json=wash(lavadores=[], valor=50.0))
+    analytics = client.get("/api/lavagens/analytics", params={"group_by": "lavador"}).json()
+
+    frame, credits = client.portal.call(snapshot, server.app.state.storage.lavagens, server.WashFilter())
+    lavadores = breakdowns(frame, credits)["lavadores"]
+    # The wash without washers is in the totals but credits nobody, not "N/A"
+    assert len(frame) == analytics["total_lavagens"] == 2
+    assert dict(zip(lavadores["lavador"], lavadores["valor_creditado"])) == {
+        grupo["nome"]: grupo["valor"] for grupo in analytics["grupos"]
+    } == {"Ana": 15.0, "Rui": 15.0}
+
+
+# Billing statements
+
+@pytest.mark.usefixtures("washes")
+def test_statements_preview_then_issue(client):
+    previews = client.get("/api/extratos/2024/3").json()
+    assert [(s["empresa_nome"], s["total_valor"], s["fechado"]) for s in previews] == [
+        ("Frio Norte", 40.0, False),
+        ("Transportes Silva", 25.0, False),
+    ]
+    # A GET never issues
+    assert client.get("/api/extratos/2024/3/Frio Norte").json()["fechado"] is False
+
+    issued = client.post("/api/extratos/2024/3").json()
+    assert {s["empresa_nome"] for s in issued} == {"Frio Norte", "Transportes Silva"}
+    assert all(s["fechado"] for s in issued)
+
+    # Issued statements do not change when backdated washes arrive
+    client.post("/api/lavagens", json=wash(
+        data="2024-03-15", empresa_tipo="externa", empresa_nome="Frio Norte", valor=99.0,
+    ))
+    statement = client.get("/api/extratos/2024/3/Frio Norte").json()
+    assert statement["fechado"] is True
+    assert statement["total_valor"] == 40.0
+
+
+@pytest.mark.usefixtures("washes")
+def test_statement_formats(client):
+    csv = client.get("/api/extratos/2024/3/Transportes Silva", params={"format": "csv"})
+    assert csv.headers["content-type"].startswith("text/csv")
+    assert "25" in csv.text
+    pdf = client.get("/api/extratos/2024/3/Transportes Silva", params={"format": "pdf"})
+    assert pdf.content.startswith(b"%PDF")
+
+
+def test_statement_errors(client):
+    today = date.today()
+    assert client.get("/api/extratos/2024/3/Ninguém").status_code == 404
+    assert client.post(f"/api/extratos/{today.year}/{today.month}").status_code == 400
+    assert client.get("/api/extratos/0/3").status_code == 422
+    assert client.get("/api/extratos/2024/13").status_code == 422
+
+
+# Archive
+
+def archive(client, cutoff):
+    storage = server.app.state.storage
+    return client.portal.call(archive_before, storage.lavagens.inner, storage.changes, storage.lavagens.store, cutoff)
+
+
+@pytest.mark.usefixtures("washes")
+def test_archived_washes_are_still_served(client):
+    before = {
+        path: client.get(path).json()
+        for path in ["/api/lavagens/month/2024/3", "/api/lavagens/stats/month/2024/3", "/api/lavagens/analytics"]
+    }
+    listed = [lavagem["id"] for lavagem in client.get("/api/lavagens").json()["items"]]
+
+    assert archive(client, date(2024, 4, 1)) == {"2024-03": 5}
+    assert {path: client.get(path).json() for path in before} == before
+    assert [lavagem["id"] for lavagem in client.get("/api/lavagens").json()["items"]] == listed
+    assert archive(client, date(2024, 4, 1)) == {}
+
+
+@pytest.mark.usefixtures("washes")
+def test_archiving_logs_deletes(client):
+    token = client.get("/api/sync").json()["token"]
+    march = [lavagem["id"] for lavagem in client.get("/api/lavagens/month/2024/3").json()["items"]]
+    archive(client, date(2024, 4, 1))
+    page = client.get("/api/sync", params={"since": token}).json()
+    assert sorted(page["eliminados"]["lavagens"]) == sorted(march)
+
+
+@pytest.mark.usefixtures("washes")
+def test_archived_wash_cannot_be_deleted(client):
+    archived = client.get("/api/lavagens/month/2024/3").json()["items"][0]["id"]
+    archive(client, date(2024, 4, 1))
+    response = client.delete(f"/api/lavagens/{archived}")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Lavagem arquivada"
+    assert client.delete("/api/lavagens/desconhecida").status_code == 404